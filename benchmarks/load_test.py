@@ -0,0 +1,264 @@
+"""Нагрузочный прогон страниц posts, users и about.
+
+Каждая страница запрашивается ``--requests`` раз, в отчёт попадают
+пропускная способность, медиана и 99-й перцентиль времени ответа и число
+SQL-запросов. Результаты сохраняются в JSON, чтобы сравнивать прогоны
+между собой (``--compare``).
+
+По умолчанию запросы идут через тестовый клиент Django в этом же
+процессе. С ``--base-url`` они отправляются по HTTP в ``--concurrency``
+потоков на уже запущенный сервер с той же базой, а число SQL-запросов
+берётся из его заголовка Server-Timing. Пустая база заполняется
+командой seed_benchmark::
+
+    python benchmarks/load_test.py --db /tmp/yatube-bench.sqlite3 \\
+        --posts 1000000 --users 10000
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BASE_DIR, "benchmarks", "results")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="/tmp/yatube-bench.sqlite3",
+                        help="файл базы для замеров")
+    parser.add_argument("--posts", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=50,
+                        help="сколько раз запрашивать каждую страницу")
+    parser.add_argument("--warmup", type=int, default=2,
+                        help="сколько запросов не учитывать (прогрев кеша)")
+    parser.add_argument("--base-url",
+                        help="адрес запущенного сервера, например "
+                             "http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="число потоков для --base-url")
+    parser.add_argument("--only", help="регулярное выражение для имён "
+                                       "страниц, которые прогонять")
+    parser.add_argument("--output", help="куда сохранить JSON с "
+                                         "результатами")
+    parser.add_argument("--compare", help="JSON прошлого прогона для "
+                                          "сравнения")
+    return parser.parse_args()
+
+
+def setup_django(db_path):
+    sys.path.insert(0, BASE_DIR)
+    os.environ["YATUBE_DB_PATH"] = db_path
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "yatube.settings")
+    import django
+    django.setup()
+    from django.conf import settings
+    # В режиме отладки каждый запрос к базе ещё и записывается в журнал
+    settings.DEBUG = False
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def targets():
+    """Страницы для прогона: (имя, адрес, пользователь или None)."""
+    from django.conf import settings
+    from django.urls import reverse
+    from posts.models import Group, Post, TimelineEntry, UserStats
+    from posts.pagination import NEXT, CursorPaginator
+
+    post = Post.objects.select_related("author").order_by(
+        "-comment_count").first()
+    author = UserStats.objects.select_related("user").order_by(
+        "-posts_count").first().user
+    reader = TimelineEntry.objects.select_related("user").first().user
+    group = Group.objects.first()
+    posts_total = Post.objects.count()
+    deep = posts_total * 9 // 10
+    deep_post = Post.objects.for_feed()[deep]
+    cursor = CursorPaginator(Post.objects.for_feed(),
+                             settings.PAGE_SIZE).encode_cursor(NEXT, deep_post)
+    return [
+        ("index", reverse("posts:index"), None),
+        ("index, глубокая страница",
+         reverse("posts:index") + f"?page={deep // settings.PAGE_SIZE}",
+         None),
+        ("index, курсор на той же глубине",
+         reverse("posts:index") + f"?cursor={cursor}", None),
+        ("group", reverse("posts:group", args=[group.slug]), None),
+        ("profile", reverse("posts:profile", args=[author.username]), None),
+        ("post_view", reverse("posts:post",
+                              args=[post.author.username, post.id]), None),
+        ("post_edit", reverse("posts:post_edit",
+                              args=[post.author.username, post.id]),
+         post.author),
+        ("follow_index", reverse("posts:follow_index"), reader),
+        ("new_post", reverse("posts:new_post"), reader),
+        ("search", reverse("posts:search") + "?q=кошка", None),
+        ("signup", reverse("signup"), None),
+        ("login", reverse("login"), None),
+        ("about:author", reverse("about:author"), None),
+        ("about:tech", reverse("about:tech"), None),
+        ("404", "/no-such-user/no-such-post/", None),
+    ]
+
+
+def run_client(args, url, user):
+    """Запросы через тестовый клиент. Возвращает замеры (время, статус,
+    SQL-запросов) и общее время без прогрева."""
+    from django.db import connection
+    from django.test import Client
+
+    client = Client()
+    if user is not None:
+        client.force_login(user)
+    queries = 0
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    for _ in range(args.warmup):
+        client.get(url)
+    samples = []
+    for _ in range(args.requests):
+        queries = 0
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            response = client.get(url)
+            elapsed = time.perf_counter() - started
+        samples.append((elapsed, response.status_code, queries))
+    return samples, sum(elapsed for elapsed, _, _ in samples)
+
+
+def session_cookie(user):
+    from django.conf import settings
+    from django.test import Client
+
+    client = Client()
+    client.force_login(user)
+    name = settings.SESSION_COOKIE_NAME
+    return f"{name}={client.cookies[name].value}"
+
+
+def run_http(args, url, user):
+    """Запросы по HTTP в несколько потоков."""
+    headers = {"Cookie": session_cookie(user)} if user is not None else {}
+
+    def fetch(_):
+        request = Request(args.base_url.rstrip("/") + url, headers=headers)
+        started = time.perf_counter()
+        try:
+            with urlopen(request) as response:
+                response.read()
+        except HTTPError as error:
+            response = error
+        elapsed = time.perf_counter() - started
+        timing = response.headers.get("Server-Timing", "")
+        match = re.search(r'"(\d+) queries"', timing)
+        return elapsed, response.status, int(match[1]) if match else None
+
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        list(executor.map(fetch, range(args.warmup)))
+        started = time.perf_counter()
+        samples = list(executor.map(fetch, range(args.requests)))
+        return samples, time.perf_counter() - started
+
+
+def measure(args, url, user):
+    run = run_http if args.base_url else run_client
+    samples, wall = run(args, url, user)
+    timings = [elapsed for elapsed, _, _ in samples]
+    queries = [count for _, _, count in samples if count is not None]
+    return {
+        "url": url,
+        "status": samples[-1][1],
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / wall, 1),
+        "p50_ms": round(percentile(timings, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 2),
+        "queries": statistics.median(queries) if queries else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def change(now, before):
+    if before in (None, 0) or now is None:
+        return ""
+    return f" ({(now - before) / before:+.0%})"
+
+
+def report(results, previous):
+    print(f"\n{'страница':36} {'код':>4} {'запр/с':>8} {'p50, мс':>14} "
+          f"{'p99, мс':>14} {'SQL':>8}")
+    for name, row in results.items():
+        old = previous.get(name, {})
+        p50 = change(row["p50_ms"], old.get("p50_ms"))
+        p99 = change(row["p99_ms"], old.get("p99_ms"))
+        queries = "-" if row["queries"] is None else row["queries"]
+        print(f"{name:36} {row['status']:>4} {row['throughput_rps']:>8} "
+              f"{row['p50_ms']:>8}{p50:>6} {row['p99_ms']:>8}{p99:>6} "
+              f"{queries:>8}")
+
+
+def main():
+    args = parse_args()
+    setup_django(args.db)
+    from django.core.management import call_command
+    from posts.models import Post
+
+    call_command("migrate", verbosity=0)
+    if not Post.objects.exists():
+        call_command("seed_benchmark", users=args.users, posts=args.posts,
+                     groups=args.groups)
+    results = {}
+    for name, url, user in targets():
+        if args.only and not re.search(args.only, name):
+            continue
+        results[name] = measure(args, url, user)
+        print(f"{name}: {results[name]['p50_ms']} мс", file=sys.stderr)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            previous = json.load(file)["results"]
+    report(results, previous)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "mode": "http" if args.base_url else "client",
+            "data": {"posts": Post.objects.count()},
+            "options": vars(args),
+            "results": results,
+        }, file, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Планы и время запросов лент с индексами из миграции
+posts/0007_feed_indexes и без них.
+
+База создаётся отдельно от рабочей и при первом запуске заполняется
+командой seed_benchmark, повторные запуски используют её же::
+
+    python benchmarks/query_plans.py --db /tmp/yatube-bench.sqlite3 \\
+        --posts 1000000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="/tmp/yatube-bench.sqlite3",
+                        help="файл базы для замеров")
+    parser.add_argument("--posts", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="сколько раз выполнять каждый запрос")
+    return parser.parse_args()
+
+
+def setup_django(db_path):
+    sys.path.insert(0, BASE_DIR)
+    os.environ["YATUBE_DB_PATH"] = db_path
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "yatube.settings")
+    import django
+    django.setup()
+
+
+def feed_indexes():
+    """Индексы из миграции 0007_feed_indexes: (модель, индекс)."""
+    from posts.models import Comment, Follow, Post
+    return [(model, index) for model in (Post, Comment, Follow)
+            for index in model._meta.indexes]
+
+
+def set_indexes(enabled):
+    from django.db import connection
+    with connection.schema_editor() as editor:
+        for model, index in feed_indexes():
+            if enabled:
+                editor.add_index(model, index)
+            else:
+                editor.remove_index(model, index)
+
+
+def hot_queries():
+    from posts.models import Comment, Follow, Post, TimelineEntry
+
+    post = Post.objects.order_by("-comment_count").first()
+    reader = TimelineEntry.objects.values_list("user_id", flat=True).first()
+    deep = Post.objects.count() * 9 // 10
+    # ключ записи на той же глубине, куда ведёт OFFSET: курсор его знает
+    pivot = Post.objects.order_by("-pub_date").values_list(
+        "pub_date", flat=True)[deep]
+    feed = Post.objects.for_feed()
+    return {
+        "index, первая страница": feed[:10],
+        f"index, OFFSET {deep}": feed[deep:deep + 10],
+        "index, курсор на той же глубине": feed.filter(
+            pub_date__lt=pivot)[:10],
+        "group_posts": feed.filter(group_id=post.group_id or 1)[:10],
+        "profile": feed.filter(author_id=post.author_id)[:10],
+        # Ключи страницы ленты подписок, посты по ним выбираются по id
+        "follow_index": TimelineEntry.objects.filter(
+            user_id=reader).order_by("-pub_date", "-post_id").values_list(
+            "pub_date", "post_id")[:10],
+        "post_view": Post.objects.filter(
+            author__username=post.author.username, id=post.id),
+        "comments": Comment.objects.filter(post_id=post.id),
+        "подписчики автора": Follow.objects.filter(
+            author_id=post.author_id).values_list("user_id", flat=True),
+    }
+
+
+def report(title, args):
+    print(f"\n===== {title} =====")
+    for name, queryset in hot_queries().items():
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            list(queryset.all())
+            timings.append(time.perf_counter() - started)
+        print(f"\n--- {name}: медиана "
+              f"{statistics.median(timings) * 1000:.2f} мс")
+        print(queryset.explain())
+
+
+def main():
+    args = parse_args()
+    setup_django(args.db)
+    from django.core.management import call_command
+    from posts.models import Post
+
+    call_command("migrate", verbosity=0)
+    if not Post.objects.exists():
+        call_command("seed_benchmark", users=args.users, posts=args.posts,
+                     groups=args.groups)
+    report("с индексами", args)
+    # Индексы снимаются и возвращаются напрямую, а не откатом миграций:
+    # откат задел бы и всё, что добавлено после 0007
+    set_indexes(False)
+    try:
+        report("без индексов", args)
+    finally:
+        set_indexes(True)
+
+
+if __name__ == "__main__":
+    main()
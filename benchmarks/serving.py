@@ -0,0 +1,156 @@
+"""Сравнение WSGI и ASGI на медленной базе.
+
+Скрипт по очереди запускает в дочернем процессе два сервера:
+- многопоточный WSGI-сервер runserver, поток на соединение;
+- uvicorn с мостом yatube/asgi.py, ``YATUBE_ASGI_THREADS`` потоков.
+Каждый SQL-запрос искусственно задерживается на ``--slow-db`` мс.
+Страницы чтения из load_test.py прогоняются по HTTP при нескольких
+уровнях параллельности, в отчёт попадают пропускная способность, p50 и
+p99 по каждому серверу и уровню. Для ASGI нужен uvicorn
+(``pip install uvicorn``)::
+
+    python benchmarks/serving.py --db /tmp/yatube-bench.sqlite3 \\
+        --slow-db 20 --concurrency 1,16,64
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from argparse import Namespace
+from datetime import datetime
+from urllib.error import URLError
+from urllib.request import urlopen
+
+import load_test
+
+PAGES = ("index", "group", "profile", "post_view", "follow_index")
+SERVERS = ("wsgi", "asgi")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="/tmp/yatube-bench.sqlite3",
+                        help="файл базы для замеров")
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--slow-db", type=float, default=20,
+                        help="задержка каждого SQL-запроса, мс")
+    parser.add_argument("--concurrency", default="1,16,64",
+                        help="уровни параллельности через запятую")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="запросов к каждой странице на каждом уровне")
+    parser.add_argument("--servers", default=",".join(SERVERS))
+    parser.add_argument("--threads", type=int, default=8,
+                        help="YATUBE_ASGI_THREADS для ASGI-сервера")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="куда сохранить JSON с "
+                                         "результатами")
+    parser.add_argument("--serve", choices=SERVERS,
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def slow_down_db(delay):
+    """Задержать каждый SQL-запрос на delay секунд, как если бы база
+    была на другом конце медленной сети."""
+    from django.db.backends import utils
+
+    execute = utils.CursorWrapper.execute
+
+    def slow_execute(self, *args, **kwargs):
+        time.sleep(delay)
+        return execute(self, *args, **kwargs)
+
+    utils.CursorWrapper.execute = slow_execute
+
+
+def serve(args):
+    """Режим дочернего процесса: поднять сервер args.serve."""
+    load_test.setup_django(args.db)
+    slow_down_db(args.slow_db / 1000)
+    if args.serve == "wsgi":
+        from django.core.servers.basehttp import run
+        from django.core.wsgi import get_wsgi_application
+        run("127.0.0.1", args.port, get_wsgi_application(), threading=True)
+    else:
+        import uvicorn
+        from yatube.asgi import application
+        uvicorn.run(application, host="127.0.0.1", port=args.port,
+                    log_level="warning", lifespan="on")
+
+
+def start_server(args, server):
+    env = dict(os.environ, YATUBE_ASGI_THREADS=str(args.threads),
+               YATUBE_METRICS="on")
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", server,
+         "--db", args.db, "--port", str(args.port),
+         "--slow-db", str(args.slow_db)],
+        env=env, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{args.port}/about/author/"
+    for _ in range(100):
+        try:
+            urlopen(url).read()
+            return process
+        except (URLError, ConnectionError):
+            if process.poll() is not None:
+                raise SystemExit(f"Сервер {server} не запустился")
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit(f"Сервер {server} не ответил")
+
+
+def main():
+    args = parse_args()
+    if args.serve:
+        serve(args)
+        return
+    load_test.setup_django(args.db)
+    from django.core.management import call_command
+    from posts.models import Post
+
+    call_command("migrate", verbosity=0)
+    if not Post.objects.exists():
+        call_command("seed_benchmark", users=args.users, posts=args.posts)
+    pages = [(name, url, user) for name, url, user in load_test.targets()
+             if name in PAGES]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    results = {}
+    for server in args.servers.split(","):
+        process = start_server(args, server)
+        try:
+            for level in levels:
+                options = Namespace(
+                    base_url=f"http://127.0.0.1:{args.port}",
+                    concurrency=level, requests=args.requests,
+                    warmup=level)
+                for name, url, user in pages:
+                    row = load_test.measure(options, url, user)
+                    results[f"{server} x{level} {name}"] = row
+                    print(f"{server} x{level} {name}: "
+                          f"{row['throughput_rps']} запр/с, "
+                          f"p99 {row['p99_ms']} мс", file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait()
+    load_test.report(results, {})
+
+    output = args.output or os.path.join(
+        load_test.RESULTS_DIR,
+        "serving-" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "commit": load_test.git_commit(),
+            "data": {"posts": Post.objects.count()},
+            "options": vars(args),
+            "results": results,
+        }, file, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""Одновременное чтение и запись с профилем SQLite и без него.
+
+Заполненная база копируется в два файла: для прогона с обычными
+настройками (журнал DELETE, новое соединение на каждый запрос) и для
+прогона с ``YATUBE_SQLITE_PROFILE=on`` (WAL, synchronous=NORMAL, mmap,
+постоянные соединения и чтение через соединение только для чтения, см.
+yatube/settings.py). Для каждой копии в дочернем процессе поднимается
+многопоточный runserver. ``--readers`` потоков читают ленты и страницы
+постов, а ``--writers`` потоков в то же время пишут комментарии. Каждый
+прогон длится ``--duration`` секунд.
+
+В отчёте для каждого режима:
+- чтений и записей в секунду;
+- p50 и p99 времени ответа;
+- число ошибок: под нагрузкой без WAL это чаще всего
+  ``database is locked``::
+
+    python benchmarks/sqlite_profile.py --db /tmp/yatube-bench.sqlite3 \\
+        --readers 8 --writers 4 --duration 20
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import (HTTPRedirectHandler, Request, build_opener,
+                            urlopen)
+
+import load_test
+
+MODES = ("off", "on")
+READ_PAGES = ("index", "group", "profile", "post_view")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="/tmp/yatube-bench.sqlite3",
+                        help="файл базы, с которой снимаются копии")
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--readers", type=int, default=8,
+                        help="потоков чтения")
+    parser.add_argument("--writers", type=int, default=4,
+                        help="потоков записи")
+    parser.add_argument("--duration", type=float, default=20,
+                        help="длительность прогона каждого режима, с")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="куда сохранить JSON с "
+                                         "результатами")
+    parser.add_argument("--serve", action="store_true",
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def serve(args):
+    """Режим дочернего процесса: runserver поверх args.db."""
+    load_test.setup_django(args.db)
+    from django.core.servers.basehttp import run
+    from django.core.wsgi import get_wsgi_application
+    run("127.0.0.1", args.port, get_wsgi_application(), threading=True)
+
+
+def copy_database(source, target, journal_mode):
+    """Снять копию source в target с журналом journal_mode."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+        dst.execute(f"PRAGMA journal_mode = {journal_mode}")
+    src.close()
+    dst.close()
+
+
+def start_server(args, path, mode):
+    env = dict(os.environ, YATUBE_SQLITE_PROFILE=mode)
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve",
+         "--db", path, "--port", str(args.port)],
+        env=env, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{args.port}/about/author/"
+    for _ in range(100):
+        try:
+            urlopen(url).read()
+            return process
+        except (URLError, ConnectionError):
+            if process.poll() is not None:
+                raise SystemExit(f"Сервер в режиме {mode} не запустился")
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit(f"Сервер в режиме {mode} не ответил")
+
+
+class NoRedirect(HTTPRedirectHandler):
+    # Ответ на запись — перенаправление на пост, идти по нему не нужно
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def timed(opener, request):
+    started = time.perf_counter()
+    try:
+        with opener.open(request) as response:
+            response.read()
+            status = response.status
+    except HTTPError as error:
+        status = error.code
+    except (URLError, ConnectionError):
+        status = None
+    return time.perf_counter() - started, status is not None and status < 400
+
+
+def run_mode(args, reads, writes):
+    """Гонять чтения и записи args.duration секунд. Возвращает замеры
+    {"read": [(время, успех)], "write": [...]} и общее время."""
+    base_url = f"http://127.0.0.1:{args.port}"
+    opener = build_opener(NoRedirect)
+    samples = {"read": [], "write": []}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def reader(number):
+        own = []
+        while not stop.is_set():
+            url = reads[len(own) % len(reads)]
+            own.append(timed(opener, Request(base_url + url)))
+        with lock:
+            samples["read"].extend(own)
+
+    def writer(number):
+        url, headers, token = writes[number % len(writes)]
+        own = []
+        while not stop.is_set():
+            data = urlencode({"csrfmiddlewaretoken": token,
+                              "text": f"Комментарий {len(own)} от {number}"})
+            own.append(timed(opener, Request(
+                base_url + url, data=data.encode(), headers=headers)))
+        with lock:
+            samples["write"].extend(own)
+
+    threads = [threading.Thread(target=reader, args=(number,))
+               for number in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(number,))
+                for number in range(args.writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples, wall):
+    row = {}
+    for kind, rows in samples.items():
+        timings = [elapsed for elapsed, _ in rows] or [0]
+        row[kind] = {
+            "requests": len(rows),
+            "errors": sum(not ok for _, ok in rows),
+            "throughput_rps": round(len(rows) / wall, 1),
+            "p50_ms": round(load_test.percentile(timings, 0.5) * 1000, 2),
+            "p99_ms": round(load_test.percentile(timings, 0.99) * 1000, 2),
+        }
+    return row
+
+
+def writers_setup(sessions, posts, base_url):
+    """Для каждого пишущего: адрес комментария, заголовки с сессией и
+    CSRF-токен со страницы поста."""
+    from django.urls import reverse
+
+    writes = []
+    for session, post in zip(sessions, posts):
+        page = reverse("posts:post", args=[post.author.username, post.id])
+        with urlopen(Request(base_url + page,
+                             headers={"Cookie": session})) as response:
+            html = response.read().decode()
+            cookies = response.headers.get_all("Set-Cookie") or []
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"',
+                          html)[1]
+        csrf = next(cookie.split(";")[0] for cookie in cookies
+                    if cookie.startswith("csrftoken="))
+        headers = {
+            "Cookie": f"{session}; {csrf}",
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Referer": base_url + page,
+        }
+        writes.append((
+            reverse("posts:add_comment",
+                    args=[post.author.username, post.id]),
+            headers, token))
+    return writes
+
+
+def report(results):
+    print(f"\n{'режим':6} {'':7} {'запр/с':>8} {'p50, мс':>9} "
+          f"{'p99, мс':>9} {'ошибок':>7}")
+    for mode, row in results.items():
+        for kind in ("read", "write"):
+            stats = row[kind]
+            print(f"{mode:6} {kind:7} {stats['throughput_rps']:>8} "
+                  f"{stats['p50_ms']:>9} {stats['p99_ms']:>9} "
+                  f"{stats['errors']:>7}")
+
+
+def main():
+    args = parse_args()
+    if args.serve:
+        serve(args)
+        return
+    os.environ["YATUBE_SQLITE_PROFILE"] = "off"
+    load_test.setup_django(args.db)
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.db import connections
+    from posts.models import Post
+
+    call_command("migrate", verbosity=0)
+    if not Post.objects.exists():
+        call_command("seed_benchmark", users=args.users, posts=args.posts)
+    reads = [url for name, url, _ in load_test.targets()
+             if name in READ_PAGES]
+    users = list(get_user_model().objects.order_by("-pk")[:args.writers])
+    posts = list(Post.objects.select_related("author")
+                 .order_by("-pk")[:args.writers])
+    # Сессии пишущих хранятся в базе и должны попасть в обе копии
+    sessions = [load_test.session_cookie(user) for user in users]
+    connections.close_all()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = {}
+    for mode in args.modes.split(","):
+        path = f"{args.db}.{mode}"
+        copy_database(args.db, path, "wal" if mode == "on" else "delete")
+        process = start_server(args, path, mode)
+        try:
+            writes = writers_setup(sessions, posts, base_url)
+            samples, wall = run_mode(args, reads, writes)
+        finally:
+            process.terminate()
+            process.wait()
+        results[mode] = summarize(samples, wall)
+        print(f"{mode}: чтений {results[mode]['read']['throughput_rps']}/с, "
+              f"записей {results[mode]['write']['throughput_rps']}/с",
+              file=sys.stderr)
+    report(results)
+
+    output = args.output or os.path.join(
+        load_test.RESULTS_DIR,
+        "sqlite-" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "commit": load_test.git_commit(),
+            "data": {"posts": Post.objects.count()},
+            "options": vars(args),
+            "results": results,
+        }, file, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Всплеск комментариев и подписок: запись сразу или пачками.
+
+Сценарий — вирусный пост. ``--concurrency`` пользователей одновременно
+пишут к нему по ``--requests`` комментариев, затем каждый подписывается
+на ``--requests`` авторов. Прогон повторяется в двух режимах записи:
+``WRITE_BEHIND = "off"`` (каждая строка своей транзакцией) и
+``"thread"`` (пачками из фонового потока, см. posts/write_behind.py).
+Запросы идут через тестовый клиент Django в потоках этого процесса.
+
+В отчёте для каждого режима и сценария есть:
+- пропускная способность, p50 и p99 времени ответа;
+- число упавших запросов, например из-за ``database is locked``;
+- для отложенной записи — сколько ещё ждать, пока последняя запись
+  дойдёт до базы.
+
+    python benchmarks/write_burst.py --db /tmp/yatube-bench.sqlite3 \\
+        --concurrency 16 --requests 50
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import load_test
+
+MODES = ("off", "thread")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="/tmp/yatube-bench.sqlite3",
+                        help="файл базы для замеров")
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="сколько пользователей пишут одновременно")
+    parser.add_argument("--requests", type=int, default=50,
+                        help="комментариев и подписок на пользователя")
+    parser.add_argument("--output", help="куда сохранить JSON с "
+                                         "результатами")
+    return parser.parse_args()
+
+
+def burst(concurrency, request):
+    """Запустить concurrency потоков, каждый вызывает request(номер
+    потока) и получает список (время, успех). Возвращает замеры и общее
+    время."""
+    from django.db import connection
+
+    samples = []
+    lock = threading.Lock()
+    start = threading.Barrier(concurrency + 1)
+
+    def worker(number):
+        start.wait()
+        try:
+            result = request(number)
+        finally:
+            connection.close()
+        with lock:
+            samples.extend(result)
+
+    threads = [threading.Thread(target=worker, args=(number,))
+               for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def timed(client, url, data=None):
+    started = time.perf_counter()
+    try:
+        response = client.post(url, data) if data else client.get(url)
+        ok = response.status_code < 400
+    except Exception:
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+def summarize(samples, wall):
+    timings = [elapsed for elapsed, _ in samples]
+    return {
+        "requests": len(samples),
+        "errors": sum(not ok for _, ok in samples),
+        "throughput_rps": round(len(samples) / wall, 1),
+        "p50_ms": round(load_test.percentile(timings, 0.5) * 1000, 2),
+        "p99_ms": round(load_test.percentile(timings, 0.99) * 1000, 2),
+    }
+
+
+def run_mode(args, mode, users, post, targets):
+    from django.conf import settings
+    from django.test import Client
+    from django.urls import reverse
+    from posts import write_behind
+
+    settings.WRITE_BEHIND = mode
+    clients = []
+    for user in users:
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+    comment_url = reverse("posts:add_comment",
+                          args=[post.author.username, post.id])
+    results = {}
+
+    def comment(number):
+        return [timed(clients[number], comment_url,
+                      {"text": f"Комментарий {i} от {number}"})
+                for i in range(args.requests)]
+
+    def follow(number):
+        return [timed(clients[number],
+                      reverse("posts:profile_follow", args=[author]))
+                for author in targets]
+
+    for name, request in (("comments", comment), ("follows", follow)):
+        samples, wall = burst(args.concurrency, request)
+        started = time.perf_counter()
+        write_behind.flush()
+        row = summarize(samples, wall)
+        row["flush_ms"] = (round((time.perf_counter() - started) * 1000, 2)
+                           if mode != "off" else None)
+        results[f"{mode} {name}"] = row
+        print(f"{mode} {name}: {row['throughput_rps']} запр/с, "
+              f"p99 {row['p99_ms']} мс, ошибок {row['errors']}",
+              file=sys.stderr)
+    return results
+
+
+def report(results):
+    print(f"\n{'сценарий':20} {'запр/с':>8} {'p50, мс':>9} {'p99, мс':>9} "
+          f"{'ошибок':>7} {'сброс, мс':>10}")
+    for name, row in results.items():
+        flush = "-" if row["flush_ms"] is None else row["flush_ms"]
+        print(f"{name:20} {row['throughput_rps']:>8} {row['p50_ms']:>9} "
+              f"{row['p99_ms']:>9} {row['errors']:>7} {flush:>10}")
+
+
+def main():
+    args = parse_args()
+    load_test.setup_django(args.db)
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from posts.models import Post
+
+    User = get_user_model()
+    call_command("migrate", verbosity=0)
+    if not Post.objects.exists():
+        call_command("seed_benchmark", users=args.users, posts=args.posts)
+    # Сброс по размеру пачки, а не только по таймеру
+    settings.WRITE_BEHIND_BATCH = 100
+    users = list(User.objects.order_by("-pk")[:args.concurrency])
+    authors = list(User.objects.order_by("pk").values_list(
+        "username", flat=True)[:args.requests * len(MODES)])
+    posts = Post.objects.select_related("author").order_by("-pk")
+    results = {}
+    for number, mode in enumerate(MODES):
+        targets = authors[number * args.requests:
+                          (number + 1) * args.requests]
+        results.update(run_mode(args, mode, users, posts[number], targets))
+    report(results)
+
+    output = args.output or os.path.join(
+        load_test.RESULTS_DIR,
+        "writes-" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "commit": load_test.git_commit(),
+            "options": vars(args),
+            "results": results,
+        }, file, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в {output}")
+
+
+if __name__ == "__main__":
+    main()
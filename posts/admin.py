@@ -1,9 +1,23 @@
 from django.contrib import admin
 
-from .models import Post, Group, Comment, Follow
+from . import search
+from .models import Post, Group, Comment, Follow, UserStats
 
 
-class PostAdmin(admin.ModelAdmin):
+class IndexedSearchMixin:
+    """Поиск в списке объектов по полнотекстовому индексу, а не через
+    LIKE по всей таблице."""
+
+    search_kind = search.POST
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search.filter_matching(queryset, search_term,
+                                      self.search_kind), False
+
+
+class PostAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ("pk", "text", "pub_date", "author", "group", "image")
     search_fields = ("text",)
     list_filter = ("pub_date",)
@@ -17,9 +31,10 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = "-пусто-"
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ("post", "text", "created", "author")
     search_fields = ("text",)
+    search_kind = search.COMMENT
     empty_value_display = "-пусто-"
 
 
@@ -28,7 +43,14 @@ class FollowAdmin(admin.ModelAdmin):
     search_fields = ("user", "author")
 
 
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ("user", "posts_count", "followers_count",
+                    "following_count")
+    search_fields = ("user__username",)
+
+
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Follow, FollowAdmin)
+admin.site.register(UserStats, UserStatsAdmin)
@@ -3,3 +3,13 @@ from django.apps import AppConfig
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        from django.conf import settings
+        from django.core.signals import request_started
+
+        from . import signals  # noqa: F401
+        from . import thumbnails
+
+        if settings.THUMBNAIL_WORKER == "thread":
+            request_started.connect(thumbnails.resume)
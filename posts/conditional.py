@@ -0,0 +1,110 @@
+"""Условные GET для лент и страниц постов.
+
+ETag страницы складывается из версий её лент (см. feed_cache), адреса
+с параметрами и зрителя, а Last-Modified — это время последнего
+изменения тех же лент. И то и другое лежит в кеше, поэтому на
+совпавший валидатор представление отвечает 304, не выполняя ни запрос
+ленты, ни шаблон.
+
+Если время изменения вытеснили из кеша, оно восстанавливается по
+``updated_at`` постов и комментариев ленты. Удалённые посты при этом
+не учитываются, но версия ленты при удалении меняется всё равно, а
+If-None-Match проверяется раньше If-Modified-Since.
+"""
+import hashlib
+from datetime import datetime
+
+from django.contrib.auth import get_user_model
+from django.db.models import Max
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from . import feed_cache, group_cache
+from .models import Comment, Post
+
+User = get_user_model()
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+SCOPE_POSTS = {
+    "index": lambda: Post.objects.all(),
+    "group": lambda group_id: Post.objects.filter(group_id=group_id),
+    "profile": lambda author_id: Post.objects.filter(author_id=author_id),
+}
+
+
+def _last_change(scope):
+    """Последняя правка постов ленты scope и комментариев к ним.
+    ``updated_at`` ставится и при создании, так что новые записи тоже
+    учитываются."""
+    if scope == feed_cache.ALL_FEEDS:
+        # Сообщества отметок времени не хранят: считаем, что изменились
+        return timezone.now()
+    name, *args = scope
+    posts = SCOPE_POSTS[name](*args)
+    latest = [
+        posts.aggregate(latest=Max("updated_at"))["latest"],
+        Comment.objects.filter(post__in=posts).aggregate(
+            latest=Max("updated_at"))["latest"],
+    ]
+    return max([value for value in latest if value], default=EPOCH)
+
+
+def index_scope():
+    return ("index",)
+
+
+def group_scope(slug):
+    return ("group", group_cache.get_or_404(slug).pk)
+
+
+def profile_scope(username):
+    author_id = User.objects.filter(username=username).values_list(
+        "pk", flat=True).first()
+    return None if author_id is None else ("profile", author_id)
+
+
+def post_scope(username, post_id):
+    # Пост, комментарии к нему и подписки на автора сбрасывают его профиль
+    author_id = Post.objects.filter(
+        pk=post_id, author__username=username
+    ).values_list("author_id", flat=True).first()
+    return None if author_id is None else ("profile", author_id)
+
+
+def _scopes(request, scope_of, kwargs, for_viewer):
+    # etag и last_modified вызываются по очереди, лента ищется один раз
+    if not hasattr(request, "_feed_scopes"):
+        scope = scope_of(**kwargs)
+        scopes = None if scope is None else [feed_cache.ALL_FEEDS, scope]
+        if scopes and for_viewer and request.user.is_authenticated:
+            # Подписки и отписки зрителя сбрасывают его собственный профиль
+            scopes.append(("profile", request.user.pk))
+        request._feed_scopes = scopes
+    return request._feed_scopes
+
+
+def feed_condition(scope_of, for_viewer=False):
+    """Декоратор условного GET для страницы ленты. scope_of получает
+    аргументы представления из адреса и возвращает ленту страницы или
+    None, если страницы нет: тогда представление отвечает само. При
+    for_viewer страница зависит и от подписок зрителя."""
+
+    def etag(request, **kwargs):
+        scopes = _scopes(request, scope_of, kwargs, for_viewer)
+        if scopes is None:
+            return None
+        viewer = request.user.pk if request.user.is_authenticated else "anon"
+        parts = [feed_cache.version(*scope) for scope in scopes]
+        parts += [request.get_full_path(), viewer]
+        return hashlib.md5(
+            ":".join(str(part) for part in parts).encode()).hexdigest()
+
+    def last_modified(request, **kwargs):
+        scopes = _scopes(request, scope_of, kwargs, for_viewer)
+        if scopes is None:
+            return None
+        return max(feed_cache.modified(scope, lambda: _last_change(scope))
+                   for scope in scopes)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
@@ -0,0 +1,349 @@
+"""Выгрузка и загрузка контента в JSONL.
+
+Каждая таблица — пользователи, сообщества, посты, комментарии и
+подписки — пишется в свой файл ``<имя>.jsonl`` построчно, по объекту
+в строке. Выгрузка читает таблицу через ``iterator``, загрузка пишет
+пачками через executemany, каждая пачка в своей транзакции, поэтому
+память не растёт с размером данных.
+
+После каждой пачки рядом с файлами в ``export-checkpoint.json`` или
+``import-checkpoint.json`` записывается, докуда дошла работа, и
+прерванная команда продолжает с этого места. Строки загружаются со
+своими id, а строки с уже существующими id пропускаются, так что повтор
+пачки после сбоя ничего не дублирует. Если же строка с новым id
+совпадает с существующей по уникальному полю (имя пользователя, slug
+сообщества, пара подписчик—автор), загрузка останавливается с
+ImportConflict. Молча пропустить такую строку нельзя: ссылки на неё из
+следующих таблиц повисли бы.
+
+Производные данные — счётчики, ленты подписок, поисковый индекс и
+варианты картинок — не выгружаются, а строятся заново после загрузки,
+и кеши, собранные по старому содержимому базы, сбрасываются.
+"""
+import json
+import os
+from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from itertools import chain, islice
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from . import (counters, feed_cache, follow_graph, group_cache, search,
+               thumbnails, timeline, trending)
+from .models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+DERIVED_FIELDS = {
+    Group: {"posts_count", "last_post_at"},
+    Post: {"comment_count", "thumbnail", "thumbnail_srcset",
+           "thumbnail_webp_srcset"},
+}
+TABLES = {
+    "users": User,
+    "groups": Group,
+    "posts": Post,
+    "comments": Comment,
+    "follows": Follow,
+}
+# Таблицы одного этапа не ссылаются друг на друга и грузятся параллельно
+STAGES = [("users", "groups"), ("posts",), ("comments", "follows")]
+
+
+class ImportConflict(Exception):
+    """Загружаемые строки совпадают с уже существующими по уникальному
+    полю."""
+
+
+class ContentEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder обрезает время до миллисекунд
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def fields_of(model):
+    derived = DERIVED_FIELDS.get(model, set())
+    return [field for field in model._meta.concrete_fields
+            if field.attname not in derived]
+
+
+def insert_rows(model, rows, batch_size=1000, ignore_conflicts=False):
+    """Вставить строки через executemany, минуя модели и сигналы: так
+    сохраняются даты из auto_now_add. Строки — словари attname: значение,
+    недостающие поля получают значения по умолчанию из модели, а поля
+    с auto_now и auto_now_add — текущее время, как при save()."""
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    # Без явного id его назначает база
+    fields = [field for field in model._meta.concrete_fields
+              if field.attname in first or field is not model._meta.auto_field]
+    ops = connection.ops
+    sql = "{} {} ({}) VALUES ({}){}".format(
+        ops.insert_statement(ignore_conflicts=ignore_conflicts),
+        ops.quote_name(model._meta.db_table),
+        ", ".join(ops.quote_name(field.column) for field in fields),
+        ", ".join(["%s"] * len(fields)),
+        " " + ops.ignore_conflicts_suffix_sql(ignore_conflicts)
+        if ignore_conflicts else "",
+    ).rstrip()
+    now = timezone.now()
+    defaults = {
+        field.attname: now if getattr(field, "auto_now", False)
+        or getattr(field, "auto_now_add", False) else field.get_default()
+        for field in fields
+    }
+    batch = []
+    count = 0
+    with connection.cursor() as cursor:
+        for row in chain([first], rows):
+            batch.append([
+                field.get_db_prep_save(
+                    row[field.attname] if field.attname in row
+                    else defaults[field.attname], connection)
+                for field in fields
+            ])
+            if len(batch) == batch_size:
+                cursor.executemany(sql, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            count += len(batch)
+    return count
+
+
+class Checkpoint:
+    """Докуда дошла выгрузка или загрузка каждой таблицы. Пишется
+    атомарно: сбой посреди записи не портит прошлое состояние."""
+
+    def __init__(self, directory, name, restart=False):
+        self.path = os.path.join(directory, f"{name}-checkpoint.json")
+        self.lock = threading.Lock()
+        self.state = {}
+        if not restart and os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as file:
+                self.state = json.load(file)
+
+    def get(self, table):
+        with self.lock:
+            return dict(self.state.get(table, {}))
+
+    def update(self, table, **values):
+        with self.lock:
+            self.state.setdefault(table, {}).update(values)
+            temporary = self.path + ".tmp"
+            with open(temporary, "w", encoding="utf-8") as file:
+                json.dump(self.state, file)
+            os.replace(temporary, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def export_table(directory, table, checkpoint, chunk_size):
+    """Выгрузить таблицу, продолжая с последнего сохранённого id.
+    Возвращает число выгруженных строк."""
+    state = checkpoint.get(table)
+    if state.get("done"):
+        return 0
+    model = TABLES[table]
+    names = [field.attname for field in fields_of(model)]
+    pk = model._meta.pk.attname
+    rows = model._base_manager.order_by("pk").values_list(*names)
+    if state.get("last_pk") is not None:
+        rows = rows.filter(pk__gt=state["last_pk"])
+    count = 0
+    with open(os.path.join(directory, f"{table}.jsonl"), "a+b") as file:
+        # Строки после последней отметки могли записаться не целиком
+        file.truncate(state.get("offset", 0))
+        for row in rows.iterator(chunk_size=chunk_size):
+            line = json.dumps(dict(zip(names, row)), cls=ContentEncoder,
+                              ensure_ascii=False)
+            file.write(line.encode() + b"\n")
+            count += 1
+            if count % chunk_size == 0:
+                file.flush()
+                checkpoint.update(table, last_pk=row[names.index(pk)],
+                                  offset=file.tell())
+        file.flush()
+        checkpoint.update(table, offset=file.tell(), done=True)
+    return count
+
+
+def export_all(directory, chunk_size=2000, restart=False):
+    os.makedirs(directory, exist_ok=True)
+    checkpoint = Checkpoint(directory, "export", restart)
+    counts = {table: export_table(directory, table, checkpoint, chunk_size)
+              for table in TABLES}
+    checkpoint.remove()
+    return counts
+
+
+def _decode(fields, line):
+    record = json.loads(line)
+    return {name: fields[name].to_python(value) if value is not None
+            else None for name, value in record.items()}
+
+
+def _unique_fields(model):
+    """Наборы attname, значения которых уникальны, кроме первичного
+    ключа."""
+    sets = [(field.attname,) for field in model._meta.concrete_fields
+            if field.unique and not field.primary_key]
+    sets += [tuple(model._meta.get_field(name).attname for name in names)
+             for names in model._meta.unique_together]
+    return sets
+
+
+def _new_rows(model, batch):
+    """Строки пачки, которых ещё нет в базе. Строки с существующим id
+    остались от прерванной загрузки и пропускаются, а совпадения по
+    остальным уникальным полям — с базой или внутри пачки — поднимают
+    ImportConflict."""
+    pk = model._meta.pk.attname
+    manager = model._base_manager
+    loaded = set(manager.filter(
+        pk__in=[row[pk] for row in batch if pk in row]
+    ).values_list("pk", flat=True))
+    rows = [row for row in batch if row.get(pk) not in loaded]
+    conflicts = []
+    for names in _unique_fields(model):
+        values = [tuple(row.get(name) for name in names) for row in rows]
+        values = [value for value in values if None not in value]
+        taken = set(manager.filter(**{
+            f"{names[0]}__in": {value[0] for value in values}
+        }).values_list(*names))
+        repeated = {value for value, count in Counter(values).items()
+                    if count > 1}
+        conflicts += [
+            ", ".join(f"{name}={part}" for name, part in zip(names, value))
+            for value in sorted(set(values) & taken | repeated, key=str)
+        ]
+    if conflicts:
+        shown = "; ".join(conflicts[:10])
+        more = len(conflicts) - 10
+        raise ImportConflict(
+            f"{model._meta.db_table}: уже есть строки с такими "
+            f"значениями: {shown}" + (f" и ещё {more}" if more > 0 else ""))
+    return rows
+
+
+def import_table(directory, table, checkpoint, batch_size):
+    """Загрузить таблицу пачками, продолжая с последней сохранённой
+    позиции в файле. Возвращает число прочитанных строк."""
+    state = checkpoint.get(table)
+    path = os.path.join(directory, f"{table}.jsonl")
+    if state.get("done") or not os.path.exists(path):
+        return 0
+    model = TABLES[table]
+    fields = {field.attname: field for field in fields_of(model)}
+    offset = state.get("offset", 0)
+    count = 0
+
+    def flush(batch):
+        try:
+            with transaction.atomic():
+                insert_rows(model, _new_rows(model, batch), batch_size)
+        except IntegrityError as error:
+            # Например, ссылка на строку, которой нет в выгрузке
+            raise ImportConflict(
+                f"{model._meta.db_table}: {error}") from error
+        # Отметка пишется после коммита: при сбое между ними пачка
+        # загрузится ещё раз, и существующие строки будут пропущены
+        checkpoint.update(table, offset=offset)
+
+    with open(path, "rb") as file:
+        file.seek(offset)
+        batch = []
+        for line in file:
+            offset += len(line)
+            if not line.strip():
+                continue
+            batch.append(_decode(fields, line))
+            count += 1
+            if len(batch) == batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    checkpoint.update(table, done=True)
+    return count
+
+
+def _import_in_thread(*args):
+    try:
+        return import_table(*args)
+    finally:
+        # У каждого потока своё соединение с базой
+        connection.close()
+
+
+def rebuild_derived():
+    """Построить то, что не выгружается: счётчики, ленты подписок,
+    поисковый индекс и очередь вариантов картинок."""
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(
+                no_style(), list(TABLES.values())):
+            cursor.execute(sql)
+    with transaction.atomic():
+        counters.rebuild_all()
+        timeline.rebuild()
+        search.rebuild()
+    thumbnails.queue_missing()
+    reset_caches()
+
+
+def _chunked(iterable, size=1000):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def reset_caches():
+    """Сбросить кеши, собранные по содержимому базы до загрузки: версии
+    всех лент, число постов главной, граф подписок, сообщества и снимок
+    популярного."""
+    feed_cache.invalidate(*feed_cache.ALL_FEEDS)
+    feed_cache.invalidate("groups")
+    cache.delete("feed-count:index")
+    user_ids = User.objects.values_list("pk", flat=True).iterator()
+    for chunk in _chunked(user_ids):
+        follow_graph.forget_users(chunk)
+    for group_id, slug in Group.objects.values_list("pk", "slug"):
+        group_cache.forget(group_id, slug)
+    trending.forget_snapshot()
+
+
+def import_all(directory, batch_size=1000, jobs=2, restart=False):
+    checkpoint = Checkpoint(directory, "import", restart)
+    counts = {}
+    for stage in STAGES:
+        if jobs < 2:
+            for table in stage:
+                counts[table] = import_table(directory, table, checkpoint,
+                                             batch_size)
+            continue
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {table: executor.submit(
+                _import_in_thread, directory, table, checkpoint, batch_size)
+                for table in stage}
+            for table, future in futures.items():
+                counts[table] = future.result()
+    rebuild_derived()
+    checkpoint.remove()
+    return counts
@@ -0,0 +1,89 @@
+from django.contrib.auth import get_user_model
+from django.db.models import (Case, Count, F, OuterRef, Q, Subquery, Value,
+                              When)
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Follow, Group, Post, UserStats
+
+User = get_user_model()
+
+
+def _count_of(queryset, field):
+    """Подзапрос с числом строк queryset, у которых field совпадает
+    с pk внешней записи; 0, если таких нет."""
+    counted = queryset.filter(**{field: OuterRef("pk")}).order_by().values(
+        field).annotate(total=Count("pk")).values("total")
+    return Coalesce(Subquery(counted), Value(0))
+
+
+def _latest_post_in_group():
+    return Subquery(Post.objects.filter(group=OuterRef("pk")).order_by(
+        "-pub_date").values("pub_date")[:1])
+
+
+def user_counts(user_id):
+    return {
+        "posts_count": Post.objects.filter(author_id=user_id).count(),
+        "followers_count": Follow.objects.filter(author_id=user_id).count(),
+        "following_count": Follow.objects.filter(user_id=user_id).count(),
+    }
+
+
+def bump_user(user_id, create_missing=True, **deltas):
+    """Сдвинуть счётчики пользователя на deltas одним UPDATE.
+
+    Если строки со счётчиками ещё нет, при create_missing она создаётся
+    с честно посчитанными значениями. При удалениях create_missing
+    выключен: пользователь может удаляться каскадом вместе со своими
+    счётчиками.
+    """
+    updated = UserStats.objects.filter(user_id=user_id).update(
+        **{name: F(name) + delta for name, delta in deltas.items()}
+    )
+    if not updated and create_missing:
+        UserStats.objects.get_or_create(user_id=user_id,
+                                        defaults=user_counts(user_id))
+
+
+def bump_group(group_id, delta, pub_date=None):
+    """Сдвинуть число постов сообщества на delta. Новый пост с датой
+    pub_date может стать последним; после ухода поста последний
+    пересчитывается по индексу (group, -pub_date)."""
+    if group_id is None:
+        return
+    if delta > 0:
+        last_post_at = Case(
+            When(Q(last_post_at__isnull=True)
+                 | Q(last_post_at__lt=pub_date), then=Value(pub_date)),
+            default=F("last_post_at"),
+        )
+    else:
+        last_post_at = _latest_post_in_group()
+    Group.objects.filter(pk=group_id).update(
+        posts_count=F("posts_count") + delta, last_post_at=last_post_at)
+
+
+def bump_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comment_count=F("comment_count") + delta
+    )
+
+
+def rebuild_all():
+    """Пересчитать все счётчики с нуля несколькими UPDATE по всей
+    таблице, без загрузки строк в память."""
+    missing = User.objects.filter(stats__isnull=True).values_list("pk",
+                                                                  flat=True)
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk) for pk in missing.iterator()],
+        batch_size=1000, ignore_conflicts=True,
+    )
+    UserStats.objects.update(
+        posts_count=_count_of(Post.objects.all(), "author"),
+        followers_count=_count_of(Follow.objects.all(), "author"),
+        following_count=_count_of(Follow.objects.all(), "user"),
+    )
+    Post.objects.update(comment_count=_count_of(Comment.objects.all(),
+                                                "post"))
+    Group.objects.update(posts_count=_count_of(Post.objects.all(), "group"),
+                         last_post_at=_latest_post_in_group())
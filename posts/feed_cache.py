@@ -0,0 +1,93 @@
+"""Версии кеша лент.
+
+Отрисованные страницы лент кешируются фрагментным кешем под ключом, в
+который входят номер версии ленты, страница и зритель. Сигналы на
+изменения Post, Comment и Group увеличивают версии затронутых лент,
+поэтому старые фрагменты просто перестают запрашиваться и доживают
+свой срок в кеше, а новые страницы отрисовываются заново. Вместе с
+версией запоминается время изменения ленты, из него и версий строятся
+валидаторы условных GET (posts/conditional.py).
+"""
+import time
+
+from django.core.cache import cache
+from django.utils import timezone
+
+ALL_FEEDS = ("all",)
+
+
+def _key(scope, kind="version"):
+    return f"feed-{kind}:" + ":".join(str(part) for part in scope)
+
+
+def version(*scope):
+    """Текущая версия ленты scope, например ("group", 3)."""
+    key = _key(scope)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, _seed(), None)
+        value = cache.get(key)
+    return value
+
+
+def _seed():
+    # Версия растёт от текущего времени в наносекундах, а не от единицы
+    # и не от секунд: если счётчик вытеснят из кеша, новая версия не
+    # совпадёт с уже выданной, даже если до вытеснения ленту сбрасывали
+    # много раз в секунду, и старые фрагменты не оживут.
+    return time.time_ns()
+
+
+def invalidate(*scope):
+    key = _key(scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _seed(), None)
+    cache.set(_key(scope, "modified"), timezone.now(), None)
+
+
+def modified(scope, default):
+    """Время последнего изменения ленты scope. Если его нет в кеше, оно
+    берётся из default() и запоминается."""
+    key = _key(scope, "modified")
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, default(), None)
+        value = cache.get(key)
+    return value
+
+
+def invalidate_post(author_id, *group_ids):
+    """Сбросить все ленты, где показывается пост автора author_id из
+    сообществ group_ids."""
+    invalidate_posts((author_id, group_id)
+                     for group_id in group_ids or (None,))
+
+
+def invalidate_posts(posts):
+    """Сбросить ленты сразу нескольких постов, заданных парами
+    (author_id, group_id); каждая лента сбрасывается один раз."""
+    authors, groups = set(), set()
+    for author_id, group_id in posts:
+        authors.add(author_id)
+        groups.add(group_id)
+    if not authors:
+        return
+    invalidate("index")
+    for author_id in authors:
+        invalidate("profile", author_id)
+    for group_id in groups - {None}:
+        invalidate("group", group_id)
+
+
+def page_key(request, page, *scope):
+    """Часть ключа фрагментного кеша для страницы ленты scope.
+
+    Зритель входит в ключ, потому что автор видит у своих постов
+    кнопку редактирования.
+    """
+    position = request.GET.get("cursor") or page.number
+    viewer = request.user.pk if request.user.is_authenticated else "anon"
+    return "{}.{}.{}.{}".format(version(*ALL_FEEDS), version(*scope),
+                                position, viewer)
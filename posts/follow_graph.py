@@ -0,0 +1,79 @@
+"""Граф подписок из кеша.
+
+Для каждого пользователя в кеше лежат множество id авторов, на которых
+он подписан, и число его подписчиков. «Подписан ли A на B», «на кого
+подписан A» и «сколько подписчиков у B» проверяются без SQL, если
+запись уже в кеше; при промахе она поднимается из базы одним запросом.
+Подписки и отписки сбрасывают записи обоих пользователей сигналами
+(см. signals.py), следующий запрос заполнит их заново.
+
+Ключи без версии, так что в L1 (см. yatube/cache.py) они не попадают, и
+кнопка «Подписаться» в соседнем процессе сразу видит новое состояние.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Follow, UserStats
+
+TIMEOUT = 60 * 60
+
+
+def _followees_key(user_id):
+    return f"followees:{user_id}"
+
+
+def _followers_key(author_id):
+    return f"follower-count:{author_id}"
+
+
+def followees(user_id):
+    """Множество id авторов, на которых подписан user_id."""
+    key = _followees_key(user_id)
+    authors = cache.get(key)
+    if authors is None:
+        authors = frozenset(Follow.objects.filter(
+            user_id=user_id).values_list("author_id", flat=True))
+        cache.set(key, authors, TIMEOUT)
+    return authors
+
+
+def is_following(user_id, author_id):
+    return author_id in followees(user_id)
+
+
+def follower_counts(author_ids):
+    """Число подписчиков для каждого из author_ids: {id: число}."""
+    author_ids = set(author_ids)
+    keys = {_followers_key(author_id): author_id for author_id in author_ids}
+    counts = {keys[key]: count
+              for key, count in cache.get_many(list(keys)).items()}
+    missing = author_ids - counts.keys()
+    if missing:
+        loaded = dict.fromkeys(missing, 0)
+        loaded.update(UserStats.objects.filter(user_id__in=missing)
+                      .values_list("user_id", "followers_count"))
+        cache.set_many({_followers_key(author_id): count
+                        for author_id, count in loaded.items()}, TIMEOUT)
+        counts.update(loaded)
+    return counts
+
+
+def follower_count(author_id):
+    return follower_counts([author_id])[author_id]
+
+
+def forget(follow):
+    """Сбросить записи подписчика и автора после подписки или отписки."""
+    keys = [_followees_key(follow.user_id), _followers_key(follow.author_id)]
+    cache.delete_many(keys)
+    # И ещё раз после коммита: до него параллельный запрос мог снова
+    # положить в кеш то, что было в базе до подписки
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def forget_users(user_ids):
+    """Сбросить записи пользователей user_ids, например после загрузки
+    контента в обход сигналов."""
+    cache.delete_many([key for user_id in user_ids
+                       for key in (_followees_key(user_id),
+                                   _followers_key(user_id))])
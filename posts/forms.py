@@ -1,6 +1,8 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
 from .models import Post, Comment
+from .uploads import pop_rejected, validate_image
 
 
 class PostForm(forms.ModelForm):
@@ -8,6 +10,19 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ["group", "text", "image"]
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.files = self.files.copy()
+        self.image_rejection = pop_rejected(self.files, "image")
+
+    def clean_image(self):
+        image = self.cleaned_data["image"]
+        if self.image_rejection:
+            raise forms.ValidationError(self.image_rejection)
+        if isinstance(image, UploadedFile):
+            validate_image(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
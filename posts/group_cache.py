@@ -0,0 +1,40 @@
+"""Сообщества из кеша.
+
+Сообщества меняются редко, поэтому страница сообщества берёт его по
+slug из кеша, а не из базы. Кеш двухступенчатый: slug → id и id →
+сообщество. Счётчики сообщества меняются с каждым постом и сбрасывают
+только вторую ступень; устаревшая запись slug → id безвредна, потому
+что найденное сообщество сверяется со slug.
+"""
+from django.core.cache import cache
+from django.http import Http404
+
+from .models import Group
+
+TIMEOUT = 60 * 60
+
+
+def _slug_key(slug):
+    return f"group-slug:{slug}"
+
+
+def _group_key(group_id):
+    return f"group:{group_id}"
+
+
+def get_or_404(slug):
+    group_id = cache.get(_slug_key(slug))
+    group = cache.get(_group_key(group_id)) if group_id is not None else None
+    if group is None or group.slug != slug:
+        group = Group.objects.filter(slug=slug).first()
+        if group is None:
+            raise Http404("Нет такого сообщества")
+        cache.set_many({_slug_key(slug): group.pk,
+                        _group_key(group.pk): group}, TIMEOUT)
+    return group
+
+
+def forget(group_id, *slugs):
+    """Убрать из кеша сообщество group_id и его бывшие slug."""
+    cache.delete_many([_group_key(group_id)]
+                      + [_slug_key(slug) for slug in slugs if slug])
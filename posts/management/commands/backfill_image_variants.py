@@ -0,0 +1,13 @@
+from posts import thumbnails
+
+from .process_thumbnails import Command as ProcessThumbnailsCommand
+
+
+class Command(ProcessThumbnailsCommand):
+    help = ("Ставит в очередь картинки постов без вариантов для srcset "
+            "и строит их параллельно в нескольких процессах")
+
+    def handle(self, *args, **options):
+        queued = thumbnails.queue_missing()
+        self.stdout.write(f"Поставлено в очередь: {queued}")
+        super().handle(*args, **options)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from posts import content
+
+
+class Command(BaseCommand):
+    help = ("Выгружает пользователей, сообщества, посты, комментарии и "
+            "подписки в папку с файлами JSONL. Прерванная выгрузка "
+            "продолжается с последней отметки")
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument("--chunk-size", type=int, default=2000,
+                            help="сколько строк читать из базы за раз")
+        parser.add_argument("--restart", action="store_true",
+                            help="начать заново, не глядя на отметку")
+
+    def handle(self, *args, **options):
+        counts = content.export_all(options["directory"],
+                                    chunk_size=options["chunk_size"],
+                                    restart=options["restart"])
+        for table, count in counts.items():
+            self.stdout.write(f"{table}: {count}")
+        self.stdout.write(self.style.SUCCESS("Контент выгружен"))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import content
+
+
+class Command(BaseCommand):
+    help = ("Загружает контент, выгруженный export_content, пачками в "
+            "отдельных транзакциях. Независимые таблицы грузятся "
+            "параллельно, прерванная загрузка продолжается с последней "
+            "отметки. Картинки из media/ нужно скопировать отдельно")
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="сколько строк вставлять одной транзакцией")
+        parser.add_argument("--jobs", type=int, default=2,
+                            help="сколько таблиц грузить одновременно; "
+                                 "SQLite всё равно пишет по очереди")
+        parser.add_argument("--restart", action="store_true",
+                            help="начать заново, не глядя на отметку")
+
+    def handle(self, *args, **options):
+        try:
+            counts = content.import_all(options["directory"],
+                                        batch_size=options["batch_size"],
+                                        jobs=options["jobs"],
+                                        restart=options["restart"])
+        except content.ImportConflict as error:
+            raise CommandError(f"{error}. Загрузка остановлена, после "
+                               f"исправления данных она продолжится "
+                               f"с отметки")
+        for table, count in counts.items():
+            self.stdout.write(f"{table}: {count}")
+        self.stdout.write(self.style.SUCCESS("Контент загружен"))
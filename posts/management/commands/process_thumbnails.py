@@ -0,0 +1,32 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.workers import process_pool
+
+
+class Command(BaseCommand):
+    help = ("Строит миниатюры картинок постов из очереди параллельно "
+            "в нескольких процессах")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="число процессов, по умолчанию по ядрам")
+        parser.add_argument("--loop", action="store_true",
+                            help="не завершаться, а ждать новые задания")
+        parser.add_argument("--interval", type=float, default=2.0,
+                            help="пауза между проверками очереди, секунды")
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        with process_pool(workers, thumbnails.init_worker) as pool:
+            while True:
+                done = thumbnails.process_pending(pool,
+                                                  batch_size=workers * 4)
+                if done:
+                    self.stdout.write(f"Построено миниатюр: {done}")
+                if not options["loop"]:
+                    break
+                time.sleep(options["interval"])
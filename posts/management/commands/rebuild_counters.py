@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = ("Пересчитывает с нуля счётчики постов, подписчиков, подписок "
+            "и комментариев")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            counters.rebuild_all()
+        self.stdout.write(self.style.SUCCESS("Счётчики пересчитаны"))
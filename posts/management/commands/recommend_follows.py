@@ -0,0 +1,22 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import recommendations
+
+
+class Command(BaseCommand):
+    help = ("Пересчитывает рекомендации «Кого почитать» по графу подписок "
+            "параллельно в нескольких процессах")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="число процессов, по умолчанию по ядрам")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = recommendations.rebuild(workers=options["workers"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Рекомендаций: {count}, "
+            f"{time.perf_counter() - started:.1f} с"))
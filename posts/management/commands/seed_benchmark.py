@@ -0,0 +1,132 @@
+import random
+import time
+from bisect import bisect
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from posts import counters, search, timeline
+from posts.content import insert_rows
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+WORDS = (
+    "утро вечер город море лес река кошка собака книга музыка кино "
+    "поезд дорога дом сад чай кофе снег дождь солнце работа отпуск "
+    "друзья семья праздник ёлка игрушка фото рецепт пирог велосипед "
+    "горы озеро небо звёзды осень весна лето зима школа проект код "
+    "сервер база запрос индекс кеш очередь лента подписка новости"
+).split()
+
+
+class Command(BaseCommand):
+    help = ("Заполняет пустую базу синтетическими данными для замеров: "
+            "пользователи, сообщества, посты, комментарии и подписки, "
+            "популярность авторов распределена по степенному закону. "
+            "Базу для замеров задаёт YATUBE_DB_PATH")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--posts", type=int, default=1000000)
+        parser.add_argument("--groups", type=int, default=100)
+        parser.add_argument("--follows", type=int, default=20,
+                            help="сколько авторов в среднем читает "
+                                 "пользователь")
+        parser.add_argument("--comments", type=float, default=0.2,
+                            help="комментариев в среднем на пост")
+        parser.add_argument("--readers", type=int, default=100,
+                            help="скольким пользователям разложить ленту "
+                                 "подписок (у остальных она пустая)")
+        parser.add_argument("--skew", type=float, default=1.1,
+                            help="показатель степенного закона "
+                                 "популярности авторов")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def stage(self, title, started):
+        self.stdout.write(f"{title}: {time.perf_counter() - started:.1f} с")
+        return time.perf_counter()
+
+    def handle(self, *args, **options):
+        if User.objects.exists() or Post.objects.exists():
+            raise CommandError("База не пуста, заполнять можно только "
+                               "пустую базу")
+        rnd = random.Random(options["seed"])
+        users = options["users"]
+        posts = options["posts"]
+        batch_size = options["batch_size"]
+        # Пользователь с id = n — n-й по популярности автор
+        popularity = list(accumulate(
+            1 / rank ** options["skew"] for rank in range(1, users + 1)))
+
+        def popular_user():
+            return bisect(popularity, rnd.random() * popularity[-1]) + 1
+
+        now = timezone.now()
+        start = now - timedelta(days=365)
+        step = timedelta(days=365) / max(posts, 1)
+        started = time.perf_counter()
+        with transaction.atomic():
+            insert_rows(User, (
+                {"id": pk, "username": f"user{pk}", "password": "!",
+                 "date_joined": start}
+                for pk in range(1, users + 1)), batch_size)
+            insert_rows(Group, (
+                {"id": pk, "title": f"Сообщество {pk}",
+                 "slug": f"group-{pk}", "description": ""}
+                for pk in range(1, options["groups"] + 1)), batch_size)
+            started = self.stage("Пользователи и сообщества", started)
+
+            insert_rows(Post, (
+                {"id": pk, "text": " ".join(rnd.choices(
+                    WORDS, k=rnd.randint(5, 30))).capitalize(),
+                 "pub_date": start + step * pk,
+                 "updated_at": start + step * pk,
+                 "author_id": popular_user(),
+                 "group_id": (rnd.randint(1, options["groups"])
+                              if options["groups"] and rnd.random() < 0.5
+                              else None)}
+                for pk in range(1, posts + 1)), batch_size)
+            started = self.stage("Посты", started)
+
+            # Чем свежее пост, тем больше у него комментариев
+            insert_rows(Comment, (
+                {"post_id": posts - int(posts * rnd.random() ** 3),
+                 "author_id": rnd.randint(1, users),
+                 "text": " ".join(rnd.choices(WORDS, k=rnd.randint(2, 12))),
+                 "created": now}
+                for _ in range(int(posts * options["comments"]))),
+                batch_size)
+            started = self.stage("Комментарии", started)
+
+            follows = set()
+            for user_id in range(1, users + 1):
+                wanted = min(users - 1, max(1, int(rnd.expovariate(
+                    1 / options["follows"]))))
+                authors = set()
+                # Популярные авторы выпадают часто, повторы отбрасываются,
+                # поэтому попыток даётся с запасом
+                for _ in range(wanted * 3):
+                    if len(authors) == wanted:
+                        break
+                    author_id = popular_user()
+                    if author_id != user_id:
+                        authors.add(author_id)
+                follows.update((user_id, author_id) for author_id in authors)
+            insert_rows(Follow, (
+                {"user_id": user_id, "author_id": author_id}
+                for user_id, author_id in sorted(follows)), batch_size)
+            started = self.stage("Подписки", started)
+
+            counters.rebuild_all()
+            started = self.stage("Счётчики", started)
+            timeline.rebuild(User.objects.filter(pk__lte=options["readers"]))
+            started = self.stage("Ленты подписок", started)
+            search.rebuild()
+            self.stage("Поисковый индекс", started)
+        self.stdout.write(self.style.SUCCESS("База заполнена"))
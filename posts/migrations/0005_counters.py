@@ -0,0 +1,62 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:46
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def count_of(queryset, field):
+    counted = queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+        field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counted), Value(0))
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk)
+         for pk in User.objects.values_list('pk', flat=True).iterator()],
+        batch_size=1000,
+    )
+    UserStats.objects.update(
+        posts_count=count_of(Post.objects.all(), 'author'),
+        followers_count=count_of(Follow.objects.all(), 'author'),
+        following_count=count_of(Follow.objects.all(), 'user'),
+    )
+    Post.objects.update(comment_count=count_of(Comment.objects.all(), 'post'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0004_follow'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('posts_count', models.PositiveIntegerField(default=0, editable=False, verbose_name='Записей')),
+                ('followers_count', models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписчиков')),
+                ('following_count', models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписан')),
+            ],
+            options={
+                'verbose_name': 'Счётчики пользователя',
+                'verbose_name_plural': 'Счётчики пользователей',
+            },
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Комментариев'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def queue_existing_images(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    ThumbnailJob = apps.get_model('posts', 'ThumbnailJob')
+    posts = Post.objects.exclude(image='').exclude(image__isnull=True)
+    ThumbnailJob.objects.bulk_create(
+        [ThumbnailJob(post_id=pk)
+         for pk in posts.values_list('pk', flat=True).iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='thumbnail',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='Миниатюра'),
+        ),
+        migrations.CreateModel(
+            name='ThumbnailJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], db_index=True, default='pending', max_length=10, verbose_name='Состояние')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Изменено')),
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='thumbnail_job', to='posts.Post')),
+            ],
+            options={
+                'verbose_name': 'Задание на миниатюру',
+                'verbose_name_plural': 'Задания на миниатюры',
+            },
+        ),
+        migrations.RunPython(queue_existing_images, migrations.RunPython.noop),
+    ]
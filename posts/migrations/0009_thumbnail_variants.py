@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='thumbnail_srcset',
+            field=models.TextField(blank=True, editable=False, verbose_name='Варианты миниатюры'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='thumbnail_webp_srcset',
+            field=models.TextField(blank=True, editable=False, verbose_name='Варианты миниатюры в WebP'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+
+def normalize(text):
+    return text.lower().replace('ё', 'е')
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    sql = 'INSERT INTO posts_search (rowid, text, post_id) VALUES (%s, %s, %s)'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE VIRTUAL TABLE posts_search USING fts5('
+            'text, post_id UNINDEXED, '
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        # rowid: id * 2 для постов, id * 2 + 1 для комментариев
+        cursor.executemany(sql, (
+            (pk * 2, normalize(text), pk)
+            for pk, text in Post.objects.values_list('pk', 'text').iterator()
+        ))
+        cursor.executemany(sql, (
+            (pk * 2 + 1, normalize(text), post_id)
+            for pk, post_id, text in Comment.objects.values_list(
+                'pk', 'post_id', 'text').iterator()
+        ))
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS posts_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_thumbnail_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
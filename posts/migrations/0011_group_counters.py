@@ -0,0 +1,36 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_group_counters(apps, schema_editor):
+    Group = apps.get_model('posts', 'Group')
+    Post = apps.get_model('posts', 'Post')
+    posts = Post.objects.filter(group=OuterRef('pk')).order_by()
+    Group.objects.update(
+        posts_count=Coalesce(Subquery(posts.values('group').annotate(
+            total=Count('pk')).values('total')), Value(0)),
+        last_post_at=Subquery(posts.order_by('-pub_date').values(
+            'pub_date')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Записей'),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='last_post_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Последняя запись'),
+        ),
+        migrations.RunPython(fill_group_counters, migrations.RunPython.noop),
+    ]
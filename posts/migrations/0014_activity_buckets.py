@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_follow_suggestions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post_id', models.PositiveIntegerField(verbose_name='Пост')),
+                ('start', models.DateTimeField(db_index=True, verbose_name='Начало отрезка')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Событий')),
+            ],
+            options={
+                'verbose_name': 'Активность поста',
+                'verbose_name_plural': 'Активность постов',
+                'unique_together': {('start', 'post_id')},
+            },
+        ),
+    ]
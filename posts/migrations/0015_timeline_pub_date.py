@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+
+def copy_pub_date(apps, schema_editor):
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    Post = apps.get_model('posts', 'Post')
+    TimelineEntry.objects.update(pub_date=models.Subquery(
+        Post.objects.filter(pk=models.OuterRef('post_id')).values('pub_date')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_activity_buckets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timelineentry',
+            name='pub_date',
+            field=models.DateTimeField(null=True, verbose_name='Дата публикации поста'),
+        ),
+        migrations.RunPython(copy_pub_date, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='timelineentry',
+            name='pub_date',
+            field=models.DateTimeField(verbose_name='Дата публикации поста'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-post'], name='timeline_user_pub_date_idx'),
+        ),
+    ]
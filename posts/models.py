@@ -14,6 +14,10 @@ class Group(models.Model):
     description = models.TextField(max_length=200,
                                    verbose_name="Описание сообщества",
                                    help_text="Описание сообщества")
+    posts_count = models.PositiveIntegerField("Записей", default=0,
+                                              editable=False)
+    last_post_at = models.DateTimeField("Последняя запись", blank=True,
+                                        null=True, editable=False)
 
     class Meta:
         verbose_name = "Сообщество"
@@ -23,9 +27,19 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Посты для ленты: автор и сообщество подгружаются тем же
+        запросом, число комментариев хранится в самом посте."""
+        return self.select_related("author", "group").order_by(
+            "-pub_date", "-id"
+        )
+
+
 class Post(models.Model):
     text = models.TextField(verbose_name="Текст", help_text="Текст")
     pub_date = models.DateTimeField("Дата публикации", auto_now_add=True)
+    updated_at = models.DateTimeField("Изменён", auto_now=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name="posts", verbose_name="Автор",
                                help_text="Автор")
@@ -36,16 +50,65 @@ class Post(models.Model):
     image = models.ImageField(verbose_name="Картинка", upload_to="posts/",
                               blank=True, null=True,
                               help_text="Загрузите картинку")
+    comment_count = models.PositiveIntegerField("Комментариев", default=0,
+                                                editable=False)
+    thumbnail = models.CharField("Миниатюра", max_length=255, blank=True,
+                                 editable=False)
+    thumbnail_srcset = models.TextField("Варианты миниатюры", blank=True,
+                                        editable=False)
+    thumbnail_webp_srcset = models.TextField("Варианты миниатюры в WebP",
+                                             blank=True, editable=False)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Пост"
         verbose_name_plural = "Посты"
         ordering = ["-pub_date"]
+        # Ленты сортируются по (-pub_date, -id), см. PostQuerySet.for_feed
+        indexes = [
+            models.Index(fields=["-pub_date", "-id"],
+                         name="post_pub_date_idx"),
+            models.Index(fields=["author", "-pub_date", "-id"],
+                         name="post_author_pub_date_idx"),
+            models.Index(fields=["group", "-pub_date", "-id"],
+                         name="post_group_pub_date_idx"),
+        ]
 
     def __str__(self):
         return self.text
 
 
+class ThumbnailJob(models.Model):
+    """Задание на построение миниатюры картинки поста (см.
+    posts/thumbnails.py)."""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [
+        (PENDING, "В очереди"),
+        (RUNNING, "Выполняется"),
+        (DONE, "Готово"),
+        (FAILED, "Ошибка"),
+    ]
+
+    post = models.OneToOneField(Post, on_delete=models.CASCADE,
+                                related_name="thumbnail_job")
+    status = models.CharField("Состояние", max_length=10, choices=STATUSES,
+                              default=PENDING, db_index=True)
+    attempts = models.PositiveSmallIntegerField("Попыток", default=0)
+    error = models.TextField("Ошибка", blank=True)
+    updated = models.DateTimeField("Изменено", auto_now=True)
+
+    class Meta:
+        verbose_name = "Задание на миниатюру"
+        verbose_name_plural = "Задания на миниатюры"
+
+    def __str__(self):
+        return f"{self.post_id}: {self.status}"
+
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE,
                              related_name="comments")
@@ -55,11 +118,16 @@ class Comment(models.Model):
                             help_text="Введите комментарий")
     created = models.DateTimeField("Дата публикации комментария",
                                    auto_now_add=True)
+    updated_at = models.DateTimeField("Изменён", auto_now=True)
 
     class Meta:
         verbose_name = "Комментарий"
         verbose_name_plural = "Комментарии"
         ordering = ["-created"]
+        indexes = [
+            models.Index(fields=["post", "-created"],
+                         name="comment_post_created_idx"),
+        ]
 
     def __str__(self):
         return self.text
@@ -73,3 +141,89 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ["user", "author"]
+        # Уникальность (user, author) покрывает поиск по подписчику,
+        # этот индекс — поиск подписчиков автора
+        indexes = [
+            models.Index(fields=["author", "user"],
+                         name="follow_author_user_idx"),
+        ]
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, которые обновляются сигналами при создании
+    и удалении постов и подписок (см. posts/counters.py)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True, related_name="stats")
+    posts_count = models.PositiveIntegerField("Записей", default=0,
+                                              editable=False)
+    followers_count = models.PositiveIntegerField("Подписчиков", default=0,
+                                                  editable=False)
+    following_count = models.PositiveIntegerField("Подписан", default=0,
+                                                  editable=False)
+
+    class Meta:
+        verbose_name = "Счётчики пользователя"
+        verbose_name_plural = "Счётчики пользователей"
+
+    def __str__(self):
+        return str(self.user)
+
+
+class TimelineEntry(models.Model):
+    """Пост в ленте подписок конкретного пользователя.
+
+    Записи раскладываются при публикации поста всем подписчикам автора
+    (см. posts/timeline.py), поэтому лента подписок читается по индексу
+    без соединения со всей таблицей подписок. Дата публикации поста
+    скопирована в запись: страница ленты выбирается по индексу (user,
+    -pub_date, -post) без соединения с постами и без сортировки.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name="timeline")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name="timeline_entries")
+    pub_date = models.DateTimeField("Дата публикации поста")
+
+    class Meta:
+        verbose_name = "Запись ленты подписок"
+        verbose_name_plural = "Записи ленты подписок"
+        unique_together = ["user", "post"]
+        indexes = [
+            models.Index(fields=["user", "-pub_date", "-post"],
+                         name="timeline_user_pub_date_idx"),
+        ]
+
+
+class FollowSuggestion(models.Model):
+    """Автор, на которого стоит подписаться пользователю. Рекомендации
+    пересчитываются целиком командой recommend_follows (см.
+    posts/recommendations.py)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name="follow_suggestions")
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name="+")
+    score = models.FloatField("Оценка")
+
+    class Meta:
+        verbose_name = "Рекомендация подписки"
+        verbose_name_plural = "Рекомендации подписок"
+        unique_together = ["user", "author"]
+        indexes = [
+            models.Index(fields=["user", "-score"],
+                         name="suggestion_user_score_idx"),
+        ]
+
+
+class ActivityBucket(models.Model):
+    """Сколько событий (новый пост, комментарий, подписка на автора) было
+    у поста за отрезок времени, который начинается в start. Отрезки
+    складывает и удаляет posts/trending.py; это не внешний ключ, чтобы
+    удаление поста не трогало таблицу, а старые отрезки уходят сами."""
+    post_id = models.PositiveIntegerField("Пост")
+    start = models.DateTimeField("Начало отрезка", db_index=True)
+    count = models.PositiveIntegerField("Событий", default=0)
+
+    class Meta:
+        verbose_name = "Активность поста"
+        verbose_name_plural = "Активность постов"
+        unique_together = ["start", "post_id"]
@@ -0,0 +1,239 @@
+import base64
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+NEXT = "n"
+PREVIOUS = "p"
+
+
+def encode_token(values):
+    """Непрозрачный для пользователя токен курсора из списка значений."""
+    raw = json.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_token(token):
+    """Обратное к encode_token. Бросает ValueError, TypeError или
+    UnicodeDecodeError, если токен испорчен."""
+    raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    return json.loads(raw.decode())
+
+
+def encode_cursor(direction, obj, fields=("pub_date", "id")):
+    """Токен курсора, который ведёт от записи obj в направлении direction
+    по ключу из полей fields."""
+    return encode_token([direction]
+                        + [str(getattr(obj, name)) for name in fields])
+
+
+class CursorPage(Page):
+    """Страница ленты, полученная по курсору, а не по номеру.
+
+    Номера у такой страницы нет: вместо ``?page=`` навигация строится
+    по непрозрачным токенам ``next_cursor`` и ``previous_cursor``.
+    """
+
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        super().__init__(object_list, None, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return "<Page by cursor>"
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        return self.paginator.encode_cursor(NEXT, self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous():
+            return None
+        return self.paginator.encode_cursor(PREVIOUS, self.object_list[0])
+
+
+class LazyCursorPage(CursorPage):
+    """Страница ленты по курсору, которая выбирает записи только при
+    первом обращении к ним. Если страница целиком попала во фрагментный
+    кеш шаблона, запрос не выполняется вовсе, как и у нумерованной."""
+
+    def __init__(self, queryset, paginator, direction):
+        self.number = None
+        self.paginator = paginator
+        self._queryset = queryset
+        self._direction = direction
+
+    @cached_property
+    def _rows(self):
+        rows = list(self._queryset[:self.paginator.per_page + 1])
+        has_more = len(rows) > self.paginator.per_page
+        rows = rows[:self.paginator.per_page]
+        if self._direction == PREVIOUS:
+            rows.reverse()
+        return rows, has_more
+
+    @property
+    def object_list(self):
+        return self._rows[0]
+
+    def has_next(self):
+        # Назад от курсора всегда есть куда вернуться вперёд
+        return self._direction == PREVIOUS or self._rows[1]
+
+    def has_previous(self):
+        if self._direction == PREVIOUS:
+            return self._rows[1]
+        return self._direction is not None
+
+
+class CursorPaginator(Paginator):
+    """Постраничный вывод по ключу (seek pagination).
+
+    Вместо ``OFFSET n LIMIT k`` выбирает записи строго после (или до)
+    ключа последней показанной записи, поэтому любая страница стоит
+    столько же, сколько первая. Ключ задаётся полями ``ordering``,
+    последнее из них должно быть уникальным.
+    """
+
+    def __init__(self, object_list, per_page,
+                 ordering=("-pub_date", "-id"), **kwargs):
+        self.ordering = tuple(ordering)
+        super().__init__(object_list.order_by(*self.ordering), per_page,
+                         **kwargs)
+
+    @property
+    def _fields(self):
+        return [name.lstrip("-") for name in self.ordering]
+
+    def encode_cursor(self, direction, obj):
+        return encode_cursor(direction, obj, self._fields)
+
+    def decode_cursor(self, cursor):
+        """Вернуть пару (направление, значения ключа) или (None, None),
+        если курсор пустой или испорчен."""
+        if not cursor:
+            return None, None
+        try:
+            direction, *values = decode_token(cursor)
+            model = self.object_list.model
+            values = [
+                model._meta.get_field(name).to_python(value)
+                for name, value in zip(self._fields, values)
+            ]
+        except (ValueError, TypeError, UnicodeDecodeError):
+            return None, None
+        if direction not in (NEXT, PREVIOUS) or len(values) != len(
+                self._fields) or None in values:
+            return None, None
+        return direction, values
+
+    def _seek(self, values, forward):
+        """Условие «строго после ключа» (или «строго до» при forward=False)
+        в лексикографическом порядке ordering."""
+        condition = Q()
+        for position, name in enumerate(self.ordering):
+            field = name.lstrip("-")
+            lookup = "lt" if name.startswith("-") == forward else "gt"
+            step = Q(**{f"{field}__{lookup}": values[position]})
+            for prev_name, prev_value in zip(self._fields[:position],
+                                             values[:position]):
+                step &= Q(**{prev_name: prev_value})
+            condition |= step
+        return condition
+
+    def _reversed_ordering(self):
+        return [name[1:] if name.startswith("-") else f"-{name}"
+                for name in self.ordering]
+
+    def page_by_cursor(self, cursor):
+        direction, values = self.decode_cursor(cursor)
+        queryset = self.object_list
+        if direction == PREVIOUS:
+            queryset = queryset.filter(
+                self._seek(values, forward=False)
+            ).order_by(*self._reversed_ordering())
+        elif direction == NEXT:
+            queryset = queryset.filter(self._seek(values, forward=True))
+        return LazyCursorPage(queryset, self, direction)
+
+
+def feed_count(object_list, estimate=None, cache_key=None):
+    """Число записей ленты для нумерации страниц.
+
+    Точный ``COUNT(*)`` по большой ленте — самый медленный запрос
+    страницы, поэтому ленты длиннее ``FEED_EXACT_COUNT_LIMIT`` считаются
+    приблизительно: по estimate из таблиц счётчиков или по числу,
+    сохранённому в кеше под cache_key на ``FEED_COUNT_TIMEOUT`` секунд.
+    Короткие ленты считаются точно: там ошибка на пару записей спрятала
+    бы последнюю страницу, а запрос и так дешёвый.
+    """
+    if estimate is None and cache_key is not None:
+        estimate = cache.get(cache_key)
+    if estimate is not None and estimate >= settings.FEED_EXACT_COUNT_LIMIT:
+        return estimate
+    count = object_list.count()
+    if cache_key is not None and count >= settings.FEED_EXACT_COUNT_LIMIT:
+        cache.set(cache_key, count, settings.FEED_COUNT_TIMEOUT)
+    return count
+
+
+def get_page(request, object_list, per_page=None, estimate=None,
+             count_key=None):
+    """Страница ленты для запроса: по ``?cursor=``, если он передан,
+    иначе обычная нумерованная по ``?page=``, для которой число записей
+    считает feed_count с estimate и count_key."""
+    per_page = per_page or settings.PAGE_SIZE
+    if "cursor" in request.GET:
+        paginator = CursorPaginator(object_list, per_page)
+        return paginator.page_by_cursor(request.GET.get("cursor"))
+    paginator = Paginator(object_list, per_page)
+    # count у Paginator — cached_property, подставляем готовое значение
+    paginator.__dict__["count"] = feed_count(object_list, estimate,
+                                             count_key)
+    return paginator.get_page(request.GET.get("page"))
+
+
+def page_cursor(page, direction):
+    """Курсор соседней страницы (NEXT или PREVIOUS) для нумерованной
+    страницы ленты длиннее ``FEED_EXACT_COUNT_LIMIT``, иначе None.
+
+    Число записей у такой ленты приблизительное, а глубокие ``?page=``
+    стоят дорогого OFFSET, поэтому дальше она листается по курсору.
+    """
+    has_neighbour = (page.has_next() if direction == NEXT
+                     else page.has_previous())
+    if (not has_neighbour or not len(page)
+            or page.paginator.count < settings.FEED_EXACT_COUNT_LIMIT):
+        return None
+    return encode_cursor(direction,
+                         page[-1] if direction == NEXT else page[0])
+
+
+def page_window(page, on_each_side=3):
+    """Номера страниц для навигации: первая, последняя и по on_each_side
+    с каждой стороны от текущей. Пропуски обозначены None."""
+    last = page.paginator.num_pages
+    numbers = {1, last}
+    numbers.update(range(max(1, page.number - on_each_side),
+                         min(last, page.number + on_each_side) + 1))
+    window = []
+    for number in sorted(numbers):
+        if window and number - window[-1] > 1:
+            window.append(None)
+        window.append(number)
+    return window
@@ -0,0 +1,160 @@
+"""Кого почитать: рекомендации подписок по графу подписок.
+
+Рекомендации считаются целиком командой recommend_follows и хранятся в
+FollowSuggestion, боковая панель профиля читает их одним запросом.
+Оценка автора c для пользователя u складывается из двух долей:
+
+- друзья друзей: какая доля авторов, на которых подписан u, сама
+  подписана на c;
+- совместные подписки: средняя по авторам u косинусная близость к c,
+  где близость двух авторов — число общих подписчиков, делённое на
+  корень из произведения чисел их подписчиков.
+
+Граф целиком загружается в память: списки подписок и подписчиков как
+массивы целых (``array``), по 4 байта на ребро в каждую сторону.
+Близкие авторы, а затем рекомендации считаются порциями параллельно в
+пуле процессов; граф попадает в каждый процесс один раз через
+инициализатор. У популярных авторов общие подписчики оцениваются по
+случайной выборке из ``SAMPLE`` подписчиков.
+"""
+import heapq
+import math
+import random
+from array import array
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+from . import feed_cache
+from .content import insert_rows
+from .models import Follow, FollowSuggestion
+from .workers import process_pool
+
+TOP = 10
+SIMILAR = 20
+SAMPLE = 1000
+CHUNK_SIZE = 500
+BATCH_SIZE = 1000
+
+# Граф и близкие авторы в процессах пула, см. init_worker
+_followees = {}
+_followers = {}
+_similar = {}
+_norms = {}
+
+
+def load_graph():
+    """Списки подписок и подписчиков: ({user: array}, {author: array})."""
+    followees = defaultdict(lambda: array("i"))
+    followers = defaultdict(lambda: array("i"))
+    edges = Follow.objects.values_list("user_id", "author_id").order_by()
+    for user_id, author_id in edges.iterator(chunk_size=10000):
+        followees[user_id].append(author_id)
+        followers[author_id].append(user_id)
+    return dict(followees), dict(followers)
+
+
+def init_worker(followees, followers, similar=None):
+    """Передать граф процессу пула (или текущему процессу без пула)."""
+    global _followees, _followers, _similar, _norms
+    _followees, _followers, _similar = followees, followers, similar or {}
+    _norms = {author_id: 1 / math.sqrt(len(users))
+              for author_id, users in followers.items()}
+
+
+def similar_authors(author_ids):
+    """Для каждого из author_ids до SIMILAR самых близких авторов:
+    {author: [(близость, другой автор), ...]}."""
+    result = {}
+    for author_id in author_ids:
+        followers = _followers[author_id]
+        sample = followers
+        if len(followers) > SAMPLE:
+            # Случайная выборка, а не первые по id: иначе у популярных
+            # авторов учитывались бы только самые давние подписчики.
+            # Зерно — id автора, так что при любом числе процессов
+            # выборка одна и та же
+            sample = random.Random(author_id).sample(followers, SAMPLE)
+        common = Counter()
+        for user_id in sample:
+            common.update(_followees[user_id])
+        del common[author_id]
+        # Общих подписчиков по выборке — в оценку на всех подписчиков
+        scale = len(followers) / len(sample) * _norms[author_id]
+        result[author_id] = heapq.nlargest(SIMILAR, (
+            (count * scale * _norms[other], other)
+            for other, count in common.items()))
+    return result
+
+
+def suggest(user_ids):
+    """До TOP рекомендаций для каждого из user_ids:
+    [(user, author, оценка), ...]."""
+    rows = []
+    for user_id in user_ids:
+        followees = _followees[user_id]
+        share = 1 / len(followees)
+        # Друзей друзей считает Counter.update на C, а не цикл Python
+        friends = Counter()
+        for author_id in followees:
+            friends.update(_followees.get(author_id, ()))
+        scores = Counter({other: count * share
+                          for other, count in friends.items()})
+        for author_id in followees:
+            for closeness, other in _similar.get(author_id, ()):
+                scores[other] += closeness * share
+        for author_id in followees:
+            scores.pop(author_id, None)
+        scores.pop(user_id, None)
+        rows.extend((user_id, author_id, score)
+                    for author_id, score in scores.most_common(TOP))
+    return rows
+
+
+def _chunks(ids):
+    ids = sorted(ids)
+    return [ids[start:start + CHUNK_SIZE]
+            for start in range(0, len(ids), CHUNK_SIZE)]
+
+
+def _run(function, ids, workers, *state):
+    """Посчитать function по порциям ids в workers процессах."""
+    if workers <= 1:
+        init_worker(*state)
+        try:
+            return list(map(function, _chunks(ids)))
+        finally:
+            init_worker({}, {})
+    with process_pool(workers, init_worker, state) as executor:
+        return list(executor.map(function, _chunks(ids)))
+
+
+def rebuild(workers=1):
+    """Пересчитать рекомендации для всех пользователей в workers
+    процессах. Возвращает число рекомендаций."""
+    followees, followers = load_graph()
+    similar = {}
+    for part in _run(similar_authors, followers, workers,
+                     followees, followers):
+        similar.update(part)
+    parts = _run(suggest, followees, workers, followees, followers, similar)
+    with transaction.atomic():
+        FollowSuggestion.objects.all().delete()
+        # executemany без моделей: bulk_create тратил здесь половину времени
+        count = insert_rows(FollowSuggestion, (
+            {"user_id": user_id, "author_id": author_id, "score": score}
+            for rows in parts for user_id, author_id, score in rows
+        ), batch_size=BATCH_SIZE)
+    # Рекомендации показываются на страницах профилей
+    feed_cache.invalidate(*feed_cache.ALL_FEEDS)
+    return count
+
+
+def for_user(user, exclude=(), limit=5):
+    """До limit рекомендаций для user, лучшие сверху. Авторы из exclude
+    (например, на которых уже подписался после пересчёта) пропускаются.
+    """
+    suggestions = FollowSuggestion.objects.filter(user=user).select_related(
+        "author").order_by("-score")[:TOP]
+    return [suggestion.author for suggestion in suggestions
+            if suggestion.author_id not in exclude][:limit]
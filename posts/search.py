@@ -0,0 +1,190 @@
+"""Полнотекстовый поиск по постам и комментариям.
+
+Индекс — виртуальная таблица SQLite FTS5 ``posts_search`` из миграции
+0010_search_index, по строке на каждый пост и комментарий. В rowid
+закодированы вид записи и её id, поэтому строка индекса обновляется и
+удаляется по первичному ключу. Сигналы поддерживают индекс при каждом
+сохранении и удалении, а ``rebuild`` строит его заново.
+
+Выдача — посты, у которых слова запроса нашлись в тексте или в
+комментариях, по убыванию релевантности (bm25). Листается она по ключу
+(оценка, id поста), как ленты с курсором, а не через OFFSET.
+
+На других СУБД FTS5 нет, там поиск сводится к ``icontains`` по тексту.
+"""
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Comment, Post
+from .pagination import NEXT, PREVIOUS, CursorPage, decode_token, encode_token
+
+TABLE = "posts_search"
+POST, COMMENT = 0, 1
+BATCH_SIZE = 1000
+
+
+def enabled():
+    return connection.vendor == "sqlite"
+
+
+def normalize(text):
+    # unicode61 не считает «ё» и «е» одной буквой
+    return text.lower().replace("ё", "е")
+
+
+def match_query(terms):
+    """Запрос FTS5 из пользовательского ввода: все слова должны найтись,
+    каждое может быть началом более длинного слова. Кавычки не дают
+    пользователю писать синтаксис FTS5."""
+    words = re.findall(r"\w+", normalize(terms))
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def _rowid(kind, pk):
+    return pk * 2 + kind
+
+
+def _write(kind, pk, post_id, text):
+    if not enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s",
+                       [_rowid(kind, pk)])
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, text, post_id) VALUES (%s, %s, %s)",
+            [_rowid(kind, pk), normalize(text), post_id],
+        )
+
+
+def index_post(post):
+    _write(POST, post.pk, post.pk, post.text)
+
+
+def index_comment(comment):
+    _write(COMMENT, comment.pk, comment.post_id, comment.text)
+
+
+def remove(kind, pk):
+    if not enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s",
+                       [_rowid(kind, pk)])
+
+
+def rebuild():
+    """Построить индекс заново по всем постам и комментариям."""
+    if not enabled():
+        return
+    sql = f"INSERT INTO {TABLE} (rowid, text, post_id) VALUES (%s, %s, %s)"
+    sources = [
+        (POST, Post.objects.values_list("pk", "pk", "text")),
+        (COMMENT, Comment.objects.values_list("pk", "post_id", "text")),
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+        for kind, rows in sources:
+            batch = []
+            for pk, post_id, text in rows.iterator():
+                batch.append((_rowid(kind, pk), normalize(text), post_id))
+                if len(batch) == BATCH_SIZE:
+                    cursor.executemany(sql, batch)
+                    batch = []
+            if batch:
+                cursor.executemany(sql, batch)
+
+
+def filter_matching(queryset, terms, kind):
+    """Оставить в queryset постов или комментариев только найденные
+    по terms. Так поиск в админке идёт по тому же индексу."""
+    query = match_query(terms)
+    if not query:
+        return queryset
+    if not enabled():
+        return queryset.filter(text__icontains=terms)
+    return queryset.filter(pk__in=RawSQL(
+        f"SELECT rowid / 2 FROM {TABLE} "
+        f"WHERE {TABLE} MATCH %s AND rowid %% 2 = %s",
+        [query, kind],
+    ))
+
+
+class SearchPaginator:
+    """Выдача поиска по ключу (оценка, id поста), без подсчёта общего
+    числа найденного."""
+
+    def __init__(self, terms, per_page):
+        self.query = match_query(terms)
+        self.terms = terms
+        self.per_page = per_page
+
+    def encode_cursor(self, direction, post):
+        return encode_token([direction, post.search_score, post.pk])
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None, None
+        try:
+            direction, score, pk = decode_token(cursor)
+            values = [float(score), int(pk)]
+        except (ValueError, TypeError, UnicodeDecodeError):
+            return None, None
+        if direction not in (NEXT, PREVIOUS):
+            return None, None
+        return direction, values
+
+    def _hits(self, direction, values, limit):
+        # bm25 нельзя звать в агрегате напрямую, поэтому лучшая оценка
+        # поста по всем его строкам считается над подзапросом
+        sql = (f"SELECT post_id, MIN(score) AS best FROM ("
+               f"SELECT post_id, rank AS score FROM {TABLE} "
+               f"WHERE {TABLE} MATCH %s) GROUP BY post_id")
+        params = [self.query]
+        order = "ASC"
+        if direction is not None:
+            sign = ">" if direction == NEXT else "<"
+            sql += (f" HAVING best {sign} %s "
+                    f"OR (best = %s AND post_id {sign} %s)")
+            params += [values[0], values[0], values[1]]
+            if direction == PREVIOUS:
+                order = "DESC"
+        sql += f" ORDER BY best {order}, post_id {order} LIMIT %s"
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + [limit])
+            return cursor.fetchall()
+
+    def _fallback_hits(self, direction, values, limit):
+        posts = Post.objects.filter(text__icontains=self.terms)
+        if direction == NEXT:
+            posts = posts.filter(pk__lt=values[1]).order_by("-pk")
+        elif direction == PREVIOUS:
+            posts = posts.filter(pk__gt=values[1]).order_by("pk")
+        else:
+            posts = posts.order_by("-pk")
+        return [(pk, 0.0) for pk in posts.values_list("pk", flat=True)[
+            :limit]]
+
+    def page_by_cursor(self, cursor):
+        direction, values = self.decode_cursor(cursor)
+        hits = []
+        if self.query:
+            fetch = self._hits if enabled() else self._fallback_hits
+            hits = fetch(direction, values, self.per_page + 1)
+        has_more = len(hits) > self.per_page
+        hits = hits[:self.per_page]
+        if direction == PREVIOUS:
+            hits.reverse()
+        posts = Post.objects.for_feed().in_bulk([pk for pk, _ in hits])
+        rows = []
+        for pk, score in hits:
+            # Пост мог быть удалён после того, как попал в выдачу
+            if pk in posts:
+                posts[pk].search_score = score
+                rows.append(posts[pk])
+        if direction == PREVIOUS:
+            return CursorPage(rows, self, has_next=True,
+                              has_previous=has_more)
+        return CursorPage(rows, self, has_next=has_more,
+                          has_previous=direction is not None)
@@ -0,0 +1,258 @@
+import threading
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from . import (counters, feed_cache, follow_graph, group_cache, search,
+               thumbnails, timeline, trending)
+from .models import Comment, Follow, Group, Post, UserStats
+
+User = get_user_model()
+
+_deleting = threading.local()
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_user(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.bump_user(instance.author_id, create_missing=False,
+                       posts_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_comments(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.bump_comments(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_user(instance.author_id, followers_count=1)
+        counters.bump_user(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    counters.bump_user(instance.author_id, create_missing=False,
+                       followers_count=-1)
+    counters.bump_user(instance.user_id, create_missing=False,
+                       following_count=-1)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def forget_follow_graph(sender, instance, **kwargs):
+    # Раньше раскладки лент: та читает число подписчиков из графа
+    follow_graph.forget(instance)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.backfill(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    timeline.prune(instance)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_profiles(sender, instance, **kwargs):
+    # Счётчики подписок и кнопка «Подписаться» есть на страницах профиля
+    # и постов обоих пользователей
+    feed_cache.invalidate("profile", instance.author_id)
+    feed_cache.invalidate("profile", instance.user_id)
+
+
+@receiver(post_save, sender=Post)
+def record_post_activity(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        trending.record(instance.pk, instance.pub_date)
+
+
+@receiver(post_save, sender=Comment)
+def record_comment_activity(sender, instance, created, raw=False,
+                            **kwargs):
+    if created and not raw:
+        trending.record(instance.post_id)
+
+
+@receiver(post_save, sender=Follow)
+def record_follow_activity(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        trending.record_follow(instance.author_id)
+
+
+@receiver(post_init, sender=Post)
+def remember_loaded_state(sender, instance, **kwargs):
+    # Сообщество и картинка поста на момент загрузки: при переносе поста
+    # сбрасываются ленты и старого, и нового сообщества, а миниатюра
+    # пересоздаётся, только если картинка сменилась.
+    instance._loaded_group_id = instance.__dict__.get("group_id")
+    instance._loaded_image = thumbnails.image_name(
+        instance.__dict__.get("image"))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_feeds(sender, instance, **kwargs):
+    feed_cache.invalidate_post(instance.author_id, instance.group_id,
+                               instance._loaded_group_id)
+
+
+@receiver(post_save, sender=Comment)
+def invalidate_comment_feeds(sender, instance, **kwargs):
+    # Число комментариев показывается в карточке поста во всех лентах
+    _invalidate_commented_posts({instance.post_id})
+
+
+def _deleting_set(name):
+    if not hasattr(_deleting, name):
+        setattr(_deleting, name, set())
+    return getattr(_deleting, name)
+
+
+@receiver(pre_delete, sender=Post)
+def remember_deleting_post(sender, instance, **kwargs):
+    _deleting_set("posts").add(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def forget_deleting_post(sender, instance, **kwargs):
+    _deleting_set("posts").discard(instance.pk)
+
+
+@receiver(pre_delete, sender=Comment)
+def remember_deleting_comment(sender, instance, **kwargs):
+    _deleting_set("commented").add(instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def invalidate_deleted_comment_feeds(sender, instance, **kwargs):
+    # Collector сначала шлёт pre_delete для всех удаляемых объектов, а
+    # потом post_delete для каждого. Посты всех удаляемых комментариев
+    # собраны в pre_delete, и ленты сбрасываются один раз, на первом
+    # post_delete: остальные комментарии пачки уже ничего не делают.
+    # Посты, которые удаляются тем же каскадом, пропускаются: их ленты
+    # сбросит invalidate_post_feeds.
+    commented = _deleting_set("commented")
+    if instance.post_id not in commented:
+        return
+    post_ids = commented - _deleting_set("posts")
+    commented.clear()
+    _invalidate_commented_posts(post_ids)
+
+
+def _invalidate_commented_posts(post_ids):
+    if not post_ids:
+        return
+    posts = Post.objects.filter(pk__in=post_ids).values_list(
+        "author_id", "group_id").distinct()
+    feed_cache.invalidate_posts(posts)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_feeds(sender, instance, **kwargs):
+    # Название сообщества есть в карточках постов любой ленты
+    feed_cache.invalidate(*feed_cache.ALL_FEEDS)
+
+
+def forget_group_counts(*group_ids):
+    changed = {group_id for group_id in group_ids if group_id is not None}
+    for group_id in changed:
+        group_cache.forget(group_id)
+    if changed:
+        feed_cache.invalidate("groups")
+
+
+@receiver(post_save, sender=Post)
+def count_group_posts(sender, instance, created, raw=False, **kwargs):
+    if raw or instance.group_id == instance._loaded_group_id and not created:
+        return
+    if not created:
+        counters.bump_group(instance._loaded_group_id, -1)
+    counters.bump_group(instance.group_id, 1, instance.pub_date)
+    forget_group_counts(instance._loaded_group_id, instance.group_id)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_group_post(sender, instance, **kwargs):
+    counters.bump_group(instance.group_id, -1)
+    forget_group_counts(instance.group_id)
+
+
+@receiver(post_init, sender=Group)
+def remember_loaded_slug(sender, instance, **kwargs):
+    instance._loaded_slug = instance.__dict__.get("slug")
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def forget_cached_group(sender, instance, **kwargs):
+    group_cache.forget(instance.pk, instance._loaded_slug, instance.slug)
+    instance._loaded_slug = instance.slug
+    feed_cache.invalidate("groups")
+
+
+@receiver(post_save, sender=Post)
+def enqueue_thumbnail(sender, instance, created, raw=False, **kwargs):
+    image = thumbnails.image_name(instance.image)
+    changed = image != instance._loaded_image or created and image
+    instance._loaded_image = image
+    if changed and not raw:
+        thumbnails.enqueue(instance)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove(search.POST, instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, **kwargs):
+    search.index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    search.remove(search.COMMENT, instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def remember_saved_group(sender, instance, **kwargs):
+    # Последним из обработчиков: до него все видят сообщество, из
+    # которого пост перенесли
+    instance._loaded_group_id = instance.group_id
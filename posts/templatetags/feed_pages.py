@@ -0,0 +1,20 @@
+from django import template
+
+from posts.pagination import NEXT, PREVIOUS, page_cursor, page_window
+
+register = template.Library()
+
+
+@register.filter
+def window(page, on_each_side=3):
+    return page_window(page, on_each_side)
+
+
+@register.filter
+def next_cursor(page):
+    return page_cursor(page, NEXT)
+
+
+@register.filter
+def previous_cursor(page):
+    return page_cursor(page, PREVIOUS)
@@ -1,12 +1,20 @@
-from django.test import Client, TestCase
+from unittest import mock
+
+from django.core.signals import request_started
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
-from posts.models import Post, Group
+from posts import thumbnails
+from posts.uploads import ImageUploadHandler
+from posts.models import Post, Group, ThumbnailJob
 
+import re
+import struct
 import tempfile
 import shutil
+import zlib
 
 User = get_user_model()
 
@@ -108,3 +116,122 @@ class PostCreateFormTests(TestCase):
         # Проверяем, что колиество записей не изменилось
         self.assertEqual(Post.objects.count(), posts_count,
                          'Кол-во записей увеличивается при редактировании!')
+
+    def test_image_thumbnail_is_built_in_background(self):
+        """Варианты картинки строятся из очереди, до этого показывается
+        заглушка, а не оригинал"""
+        uploaded = SimpleUploadedFile(
+            name="thumb.gif",
+            content=(b'\x47\x49\x46\x38\x39\x61\x01\x00'
+                     b'\x01\x00\x00\x00\x00\x21\xf9\x04'
+                     b'\x01\x0a\x00\x01\x00\x2c\x00\x00'
+                     b'\x00\x00\x01\x00\x01\x00\x00\x02'
+                     b'\x02\x4c\x01\x00\x3b'),
+            content_type="image/gif"
+        )
+        self.authorized_client.post(reverse("posts:new_post"),
+                                    data={"text": "С картинкой",
+                                          "image": uploaded})
+        post = Post.objects.get(text="С картинкой")
+        self.assertEqual(post.thumbnail_job.status, ThumbnailJob.PENDING)
+        response = self.authorized_client.get(reverse("posts:index"))
+        self.assertContains(response, "Картинка обрабатывается")
+        self.assertNotContains(response, f'src="{post.image.url}"')
+
+        self.assertEqual(thumbnails.process_pending(), 1)
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnail.endswith("-960.jpg"))
+        self.assertIn("320w", post.thumbnail_srcset)
+        self.assertEqual(post.thumbnail_job.status, ThumbnailJob.DONE)
+        response = self.authorized_client.get(reverse("posts:index"))
+        self.assertContains(response, post.thumbnail_srcset)
+
+    def test_failed_thumbnail_is_retried_later(self):
+        """Неудачное задание повторяется не сразу, а через RETRY_AFTER;
+        после последней неудачи вместо заглушки показывается оригинал"""
+        # Файла small.gif нет, построить варианты нельзя
+        job = self.post.thumbnail_job
+        self.assertEqual(thumbnails.process_pending(), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts),
+                         (ThumbnailJob.PENDING, 1))
+        self.assertEqual(thumbnails.claim(10), [])
+        ThumbnailJob.objects.filter(pk=job.pk).update(
+            updated=job.updated - thumbnails.RETRY_AFTER)
+        self.assertEqual(thumbnails.claim(10), [job.pk])
+
+        ThumbnailJob.objects.filter(pk=job.pk).update(
+            status=ThumbnailJob.PENDING,
+            attempts=thumbnails.MAX_ATTEMPTS - 1,
+            updated=job.updated - thumbnails.RETRY_AFTER)
+        self.assertEqual(thumbnails.process_pending(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ThumbnailJob.FAILED)
+        response = self.authorized_client.get(reverse("posts:index"))
+        self.assertContains(response, f'src="{self.post.image.url}"')
+
+    def test_leftover_jobs_resumed_on_first_request(self):
+        """Задания прошлых запусков разбираются с первого запроса
+        процесса, а не с первой новой картинки"""
+        request_started.connect(thumbnails.resume)
+        with mock.patch.object(thumbnails, "_kick") as kick:
+            self.authorized_client.get(reverse("posts:index"))
+            self.authorized_client.get(reverse("posts:index"))
+        kick.assert_called_once_with()
+
+    def test_backfill_image_variants_queues_old_images(self):
+        """Картинки без вариантов попадают в очередь заново"""
+        ThumbnailJob.objects.all().delete()
+        self.assertEqual(thumbnails.queue_missing(), 1)
+        self.assertEqual(
+            ThumbnailJob.objects.get().status, ThumbnailJob.PENDING)
+
+
+def png_header(width, height):
+    """Начало PNG с заданными размерами, сами пиксели не нужны."""
+    ihdr = b"IHDR" + struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + ihdr
+            + struct.pack(">I", zlib.crc32(ihdr))
+            + struct.pack(">I", 0) + b"IDAT")
+
+
+class ImageUploadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username="uploader")
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def upload(self, content):
+        uploaded = SimpleUploadedFile(name="big.png", content=content,
+                                      content_type="image/png")
+        return self.authorized_client.post(
+            reverse("posts:new_post"),
+            data={"text": "Большая картинка", "image": uploaded})
+
+    def test_decompression_bomb_rejected_by_header(self):
+        """Картинка с огромными размерами отвергается по заголовку"""
+        content = png_header(50000, 50000) + b"\0" * 300000
+        with self.assertLogs("posts.uploads") as logs:
+            response = self.upload(content)
+        self.assertFormError(
+            response, "form", "image",
+            f"Картинка больше {settings.IMAGE_UPLOAD_MAX_PIXELS // 1000000} "
+            "мегапикселей.")
+        self.assertFalse(Post.objects.exists())
+        # В памяти был только первый кусок тела, а не весь файл
+        self.assertIn("rejected", logs.output[0])
+        self.assertIn(f"{len(content)} bytes", logs.output[0])
+        peak = int(re.search(r"peak memory (\d+)", logs.output[0])[1])
+        self.assertLessEqual(peak, ImageUploadHandler.chunk_size)
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=1024)
+    def test_too_large_file_rejected(self):
+        """Файл больше IMAGE_UPLOAD_MAX_SIZE отвергается"""
+        response = self.upload(png_header(10, 10) + b"\0" * 2048)
+        self.assertFormError(response, "form", "image",
+                             "Файл больше 1,0\xa0КБ.")
+        self.assertFalse(Post.objects.exists())
@@ -1,7 +1,20 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from array import array
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import Client, TestCase
+from django.urls import reverse
 from django.contrib.auth import get_user_model
 
-from posts.models import Post, Group
+from posts import (content, feed_cache, follow_graph, group_cache,
+                   recommendations, search, timeline, trending)
+from posts.models import (Post, Group, Comment, Follow, FollowSuggestion,
+                          UserStats)
 
 User = get_user_model()
 
@@ -65,3 +78,259 @@ class PostModelTest(TestCase):
         expected_object_name_for_post = post.text[:15]
         self.assertEqual(expected_object_name, str(group))
         self.assertEqual(expected_object_name_for_post, str(post))
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author')
+        self.reader = User.objects.create(username='reader')
+
+    def assertStats(self, user, posts, followers, following):
+        stats = UserStats.objects.get(user=user)
+        self.assertEqual(
+            (stats.posts_count, stats.followers_count, stats.following_count),
+            (posts, followers, following))
+
+    def test_counters_follow_creates_and_deletes(self):
+        """Счётчики меняются при создании и удалении записей"""
+        post = Post.objects.create(author=self.author, text='Текст')
+        comment = Comment.objects.create(post=post, author=self.reader,
+                                         text='Комментарий')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertStats(self.author, posts=1, followers=1, following=0)
+        self.assertStats(self.reader, posts=0, followers=0, following=1)
+
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+        self.assertStats(self.author, posts=1, followers=0, following=0)
+        self.assertStats(self.reader, posts=0, followers=0, following=0)
+
+        post.delete()
+        self.assertStats(self.author, posts=0, followers=0, following=0)
+
+    def test_rebuild_counters_command(self):
+        """rebuild_counters восстанавливает испорченные счётчики"""
+        post = Post.objects.create(author=self.author, text='Текст')
+        Comment.objects.create(post=post, author=self.reader, text='Раз')
+        Follow.objects.create(user=self.reader, author=self.author)
+        UserStats.objects.update(posts_count=7, followers_count=7,
+                                 following_count=7)
+        Post.objects.update(comment_count=7)
+        UserStats.objects.filter(user=self.reader).delete()
+
+        call_command('rebuild_counters', stdout=StringIO())
+
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertStats(self.author, posts=1, followers=1, following=0)
+        self.assertStats(self.reader, posts=0, followers=0, following=1)
+
+
+class FollowGraphTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author')
+        self.reader = User.objects.create(username='reader')
+
+    def test_answers_from_cache_after_first_lookup(self):
+        """Прогретый граф отвечает без запросов к базе"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        # Раскладка ленты при подписке уже прогрела число подписчиков
+        cache.clear()
+        with self.assertNumQueries(2):
+            self.assertTrue(follow_graph.is_following(self.reader.pk,
+                                                      self.author.pk))
+            self.assertEqual(follow_graph.follower_count(self.author.pk), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(follow_graph.followees(self.reader.pk),
+                             {self.author.pk})
+            self.assertFalse(follow_graph.is_following(self.reader.pk,
+                                                       self.reader.pk))
+            self.assertEqual(follow_graph.follower_counts([self.author.pk]),
+                             {self.author.pk: 1})
+
+    def test_follow_and_unfollow_reset_cached_graph(self):
+        """Подписка и отписка сбрасывают прогретые записи"""
+        self.assertFalse(follow_graph.is_following(self.reader.pk,
+                                                   self.author.pk))
+        self.assertEqual(follow_graph.follower_count(self.author.pk), 0)
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertTrue(follow_graph.is_following(self.reader.pk,
+                                                  self.author.pk))
+        self.assertEqual(follow_graph.follower_count(self.author.pk), 1)
+        follow.delete()
+        self.assertFalse(follow_graph.is_following(self.reader.pk,
+                                                   self.author.pk))
+        self.assertEqual(follow_graph.follower_count(self.author.pk), 0)
+
+
+class RecommendationsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = {name: User.objects.create(username=name)
+                      for name in ('ann', 'bob', 'cat', 'dan', 'eve', 'max')}
+        for user, author in (('ann', 'bob'), ('ann', 'cat'), ('bob', 'dan'),
+                             ('cat', 'dan'), ('cat', 'eve'), ('max', 'bob'),
+                             ('max', 'eve')):
+            Follow.objects.create(user=self.users[user],
+                                  author=self.users[author])
+
+    def suggested(self, name):
+        return [suggestion.author.username
+                for suggestion in FollowSuggestion.objects.filter(
+                    user=self.users[name]).order_by('-score', 'author')]
+
+    def test_friends_of_friends_ranked_first(self):
+        """Автор, на которого подписаны все авторы пользователя, идёт
+        первым; свои подписки и сам пользователь не предлагаются"""
+        call_command('recommend_follows', workers=1, stdout=StringIO())
+        self.assertEqual(self.suggested('ann'), ['dan', 'eve'])
+        self.assertEqual(self.suggested('dan'), [])
+
+    def test_workers_give_same_result(self):
+        """Пул процессов считает то же, что и один процесс"""
+        recommendations.rebuild(workers=1)
+        single = {name: self.suggested(name) for name in self.users}
+        recommendations.rebuild(workers=2)
+        self.assertEqual(
+            {name: self.suggested(name) for name in self.users}, single)
+
+    def test_popular_author_sampled_across_followers(self):
+        """Выборка подписчиков популярного автора случайна, а не самые
+        давние из них"""
+        followers = {1: array('i', range(100)), 2: array('i', range(50)),
+                     3: array('i', range(50, 100))}
+        followees = {user_id: array('i', [1, 2 if user_id < 50 else 3])
+                     for user_id in range(100)}
+        recommendations.init_worker(followees, followers)
+        try:
+            with mock.patch.object(recommendations, 'SAMPLE', 50):
+                similar = recommendations.similar_authors([1])[1]
+        finally:
+            recommendations.init_worker({}, {})
+        self.assertEqual({other for _, other in similar}, {2, 3})
+
+    def test_shown_in_profile_sidebar(self):
+        """Рекомендации видны в профиле, пока на автора не подписались"""
+        recommendations.rebuild()
+        client = Client()
+        client.force_login(self.users['ann'])
+        url = reverse('posts:profile', args=['bob'])
+        response = client.get(url)
+        self.assertEqual(response.context['suggestions'][0],
+                         self.users['dan'])
+        Follow.objects.create(user=self.users['ann'],
+                              author=self.users['dan'])
+        # Закешированная в браузере страница bob не должна подтвердиться
+        response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(self.users['dan'], response.context['suggestions'])
+        response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class SeedBenchmarkTest(TestCase):
+    def test_seed_fills_empty_database(self):
+        """seed_benchmark создаёт данные и согласованные с ними счётчики"""
+        call_command('seed_benchmark', users=30, posts=200, groups=3,
+                     readers=5, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertTrue(Follow.objects.exists())
+        stats = UserStats.objects.get(user_id=1)
+        self.assertEqual(stats.posts_count,
+                         Post.objects.filter(author_id=1).count())
+        self.assertEqual(stats.followers_count,
+                         Follow.objects.filter(author_id=1).count())
+        # Самый популярный автор пишет больше самого непопулярного
+        self.assertGreater(stats.posts_count,
+                           Post.objects.filter(author_id=30).count())
+
+    def test_seed_refuses_non_empty_database(self):
+        User.objects.create(username='existing')
+        with self.assertRaises(CommandError):
+            call_command('seed_benchmark', users=5, posts=5,
+                         stdout=StringIO())
+
+
+class ContentTransferTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        author = User.objects.create(username='author')
+        reader = User.objects.create(username='reader')
+        group = Group.objects.create(title='Группа', slug='group')
+        self.post = Post.objects.create(author=author, group=group,
+                                        text='Пост про ёжика')
+        Comment.objects.create(post=self.post, author=reader, text='Ура')
+        Follow.objects.create(user=reader, author=author)
+
+    def clear_content(self):
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+    def test_export_and_import_restore_content(self):
+        """Выгруженный контент загружается обратно вместе с датами,
+        а счётчики, ленты и поиск строятся заново"""
+        pub_date = self.post.pub_date
+        call_command('export_content', self.directory, stdout=StringIO())
+        self.clear_content()
+        call_command('import_content', self.directory, jobs=1,
+                     stdout=StringIO())
+        post = Post.objects.get()
+        self.assertEqual(post.pub_date, pub_date)
+        self.assertEqual(post.comment_count, 1)
+        reader = User.objects.get(username='reader')
+        self.assertEqual(reader.stats.following_count, 1)
+        self.assertEqual(list(timeline.posts_for(reader)), [post])
+        self.assertEqual(
+            search.filter_matching(Post.objects.all(), 'ежик',
+                                   search.POST).get(), post)
+
+    def test_import_resumes_from_checkpoint(self):
+        """Загрузка продолжается с отметки и не дублирует строки"""
+        call_command('export_content', self.directory, stdout=StringIO())
+        self.clear_content()
+        checkpoint = content.Checkpoint(self.directory, 'import')
+        content.import_table(self.directory, 'users', checkpoint, 1)
+        checkpoint.update('users', offset=0, done=False)
+        call_command('import_content', self.directory, jobs=1,
+                     stdout=StringIO())
+        self.assertEqual(User.objects.count(), 2)
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertFalse(os.path.exists(checkpoint.path))
+
+    def test_import_resets_caches(self):
+        """После загрузки ленты, граф подписок, сообщества и снимок
+        популярного собираются заново"""
+        call_command('export_content', self.directory, stdout=StringIO())
+        reader = User.objects.get(username='reader')
+        self.clear_content()
+        # Кеши, заполненные по пустой базе
+        self.assertEqual(follow_graph.followees(reader.pk), frozenset())
+        trending.rebuild_snapshot()
+        versions = {scope: feed_cache.version(*scope)
+                    for scope in (feed_cache.ALL_FEEDS, ('groups',))}
+        call_command('import_content', self.directory, jobs=1,
+                     stdout=StringIO())
+        for scope, version in versions.items():
+            self.assertGreater(feed_cache.version(*scope), version)
+        self.assertEqual(follow_graph.followees(reader.pk),
+                         {self.post.author_id})
+        self.assertEqual(group_cache.get_or_404('group').title, 'Группа')
+        self.assertIsNone(cache.get(trending.SNAPSHOT_KEY))
+
+    def test_import_stops_on_unique_conflict(self):
+        """Строка, совпадающая с существующей по уникальному полю, не
+        пропускается молча, а останавливает загрузку"""
+        call_command('export_content', self.directory, stdout=StringIO())
+        self.clear_content()
+        User.objects.create(username='reader')
+        with self.assertRaisesMessage(CommandError, 'username=reader'):
+            call_command('import_content', self.directory, jobs=1,
+                         stdout=StringIO())
+        self.assertFalse(Post.objects.exists())
@@ -1,16 +1,23 @@
 import shutil
 import tempfile
+from datetime import timedelta
 
 from django.core.cache import cache
+from django.db import connection
 from django.contrib.auth import get_user_model
 from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from django import forms
 
-from posts.models import Post, Group, User, Follow, Comment
+from posts.models import (Post, Group, User, Follow, Comment, TimelineEntry,
+                          ActivityBucket)
+from posts import feed_cache, timeline, trending, write_behind
+from posts.pagination import NEXT, page_cursor, page_window
 
 User = get_user_model()
 
@@ -279,21 +286,106 @@ class PostPagesTests(TestCase):
 
 
 class CacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create(username='Bruno')
+
     def test_index_page_cache(self):
         """Тест корректности кеширования в шаблоне index"""
-        client = Client()
-        user = User.objects.create(username='Bruno')
-        Post.objects.create(
-            text='Lorem impsum', author=user)
-        temp_response = client.get(reverse('posts:index'))
-        Post.objects.create(
-            text='Lorem impsum', author=user)
-        response = client.get(reverse('posts:index'))
+        post = Post.objects.create(text='Lorem impsum', author=self.user)
+        temp_response = self.client.get(reverse('posts:index'))
+        # Изменение в обход сигналов кеш не сбрасывает
+        Post.objects.filter(pk=post.pk).update(text='Dolor sit amet')
+        response = self.client.get(reverse('posts:index'))
         self.assertEqual(temp_response.content, response.content)
         cache.clear()
-        Post.objects.create(text='Lorem impsum', author=user)
-        response_new = client.get(reverse('posts:index'))
-        self.assertNotEqual(temp_response.content, response_new)
+        response_new = self.client.get(reverse('posts:index'))
+        self.assertNotEqual(temp_response.content, response_new.content)
+
+    def test_index_cache_invalidated_by_changes(self):
+        """Новый пост, комментарий и правка сообщества сбрасывают кеш"""
+        group = Group.objects.create(title='Old title', slug='slug')
+        post = Post.objects.create(text='First post', author=self.user,
+                                   group=group)
+        self.client.get(reverse('posts:index'))
+        Post.objects.create(text='Second post', author=self.user)
+        self.assertContains(self.client.get(reverse('posts:index')),
+                            'Second post')
+        Comment.objects.create(post=post, author=self.user, text='Hi')
+        self.assertContains(self.client.get(reverse('posts:index')),
+                            'Комментариев: 1')
+        group.title = 'New title'
+        group.save()
+        self.assertContains(self.client.get(reverse('posts:index')),
+                            'New title')
+
+    def test_index_cache_is_per_page(self):
+        """Разные страницы кешируются под разными ключами"""
+        posts = [Post(author=self.user, text=f'Post number {i}')
+                 for i in range(settings.PAGE_SIZE + 1)]
+        Post.objects.bulk_create(posts)
+        self.client.get(reverse('posts:index'))
+        response = self.client.get(reverse('posts:index') + '?page=2')
+        self.assertContains(response, 'Post number 0')
+        self.assertNotContains(response, 'Post number 10')
+
+    def test_version_not_reused_after_eviction(self):
+        """Версия, заново заведённая после вытеснения, не совпадает ни с
+        одной уже выданной"""
+        used = {feed_cache.version('index')}
+        for _ in range(5):
+            feed_cache.invalidate('index')
+            used.add(feed_cache.version('index'))
+        cache.delete('feed-version:index')
+        self.assertNotIn(feed_cache.version('index'), used)
+
+    def test_deleting_comments_invalidates_each_feed_once(self):
+        """Удаление пачки комментариев сбрасывает ленты их постов одним
+        запросом, а каскад от удаления поста постов не выбирает"""
+        other = User.objects.create(username='Other')
+        group = Group.objects.create(title='Group', slug='group')
+        first = Post.objects.create(text='First', author=self.user,
+                                    group=group)
+        second = Post.objects.create(text='Second', author=other)
+        for post in (first, second, first, second):
+            Comment.objects.create(post=post, author=other, text='Hi')
+        scopes = [('index',), ('profile', self.user.pk),
+                  ('profile', other.pk), ('group', group.pk)]
+        before = {scope: feed_cache.version(*scope) for scope in scopes}
+        with CaptureQueriesContext(connection) as queries:
+            Comment.objects.filter(author=other).delete()
+        for scope in scopes:
+            self.assertGreater(feed_cache.version(*scope), before[scope])
+        post_selects = [query for query in queries
+                        if query['sql'].startswith('SELECT')
+                        and 'FROM "posts_post"' in query['sql']]
+        self.assertEqual(len(post_selects), 1)
+
+        for _ in range(3):
+            Comment.objects.create(post=first, author=other, text='Hi')
+        with CaptureQueriesContext(connection) as queries:
+            first.delete()
+        post_selects = [query for query in queries
+                        if query['sql'].startswith('SELECT')
+                        and 'FROM "posts_post"' in query['sql']]
+        self.assertEqual(post_selects, [])
+
+    def test_cursor_page_served_from_cache_without_query(self):
+        """Страница по курсору из фрагментного кеша не выбирает посты"""
+        Post.objects.bulk_create(
+            [Post(author=self.user, text=f'Post number {i}')
+             for i in range(settings.PAGE_SIZE + 1)])
+        first = self.client.get(reverse('posts:index') + '?cursor=')
+        url = (reverse('posts:index')
+               + f'?cursor={first.context["page"].next_cursor}')
+        cached = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.content, cached.content)
+        self.assertContains(response, 'Post number 0')
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'posts_post' in query['sql']])
 
 
 class PaginatorViewsTest(TestCase):
@@ -338,3 +430,680 @@ class PaginatorViewsTest(TestCase):
 
         self.assertEqual(len(response.context.get('page').object_list), 3)
         self.assertEqual(len(response_1.context.get('page').object_list), 3)
+
+    def test_cursor_pages_walk_whole_feed(self):
+        """Навигация по ?cursor= проходит ленту без пропусков и повторов"""
+        url = reverse('posts:group', kwargs={'slug': self.group.slug})
+        response = self.authorized_client.get(url + '?cursor=')
+        first_page = response.context.get('page')
+        self.assertEqual(len(first_page.object_list), 10)
+        self.assertFalse(first_page.has_previous())
+
+        response = self.authorized_client.get(
+            url + f'?cursor={first_page.next_cursor}')
+        second_page = response.context.get('page')
+        self.assertEqual(len(second_page.object_list), 3)
+        self.assertFalse(second_page.has_next())
+        seen = [post.id for post in first_page.object_list]
+        seen += [post.id for post in second_page.object_list]
+        self.assertEqual(
+            seen,
+            list(Post.objects.order_by('-pub_date', '-id')
+                 .values_list('id', flat=True)))
+
+        response = self.authorized_client.get(
+            url + f'?cursor={second_page.previous_cursor}')
+        self.assertEqual(list(response.context.get('page').object_list),
+                         list(first_page.object_list))
+
+    @override_settings(FEED_EXACT_COUNT_LIMIT=100)
+    def test_large_feed_counted_by_counters(self):
+        """Большая лента берёт число записей из счётчика, а навигация
+        показывает только окно страниц"""
+        cache.clear()
+        Group.objects.filter(pk=self.group.pk).update(posts_count=1000)
+        url = reverse('posts:group', kwargs={'slug': self.group.slug})
+        # сессия, пользователь, сообщество, время последней правки постов
+        # и комментариев и сами посты, но не COUNT(*)
+        with self.assertNumQueries(6):
+            response = self.authorized_client.get(url + '?page=50')
+        self.assertEqual(response.context['page'].paginator.count, 1000)
+        self.assertEqual(page_window(response.context['page']),
+                         [1, None, 47, 48, 49, 50, 51, 52, 53, None, 100])
+        self.assertContains(response, '?page=100')
+        self.assertNotContains(response, '?page=46"')
+
+    @override_settings(FEED_EXACT_COUNT_LIMIT=10)
+    def test_long_feed_pages_switch_to_cursor(self):
+        """Соседние страницы длинной ленты открываются по курсору"""
+        cache.clear()
+        url = reverse('posts:group', kwargs={'slug': self.group.slug})
+        response = self.authorized_client.get(url)
+        cursor = page_cursor(response.context['page'], NEXT)
+        self.assertIsNotNone(cursor)
+        self.assertContains(response, f'?cursor={cursor}')
+        self.assertNotContains(response, '?page=2">Следующая')
+        second = self.authorized_client.get(
+            url + f'?cursor={cursor}').context['page']
+        self.assertEqual(len(second.object_list), 3)
+
+        with self.settings(FEED_EXACT_COUNT_LIMIT=100):
+            cache.clear()
+            response = self.authorized_client.get(url)
+            self.assertIsNone(page_cursor(response.context['page'], NEXT))
+        self.assertContains(response, '?page=2">Следующая')
+
+    def test_broken_cursor_returns_first_page(self):
+        """Испорченный курсор отдаёт первую страницу"""
+        response = self.authorized_client.get(
+            reverse('posts:index') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context.get('page').object_list), 10)
+
+
+class FeedQueriesTest(TestCase):
+    """Число запросов при отрисовке ленты не зависит от числа постов."""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='reader')
+        cls.author = User.objects.create(username='writer')
+        cls.group = Group.objects.create(
+            title='Test',
+            slug='test-slug',
+            description='Много букв'
+        )
+        Follow.objects.create(user=cls.user, author=cls.author)
+        for i in range(settings.PAGE_SIZE):
+            post = Post.objects.create(author=cls.author, group=cls.group,
+                                       text=f'Пост {i}')
+            Comment.objects.create(post=post, author=cls.user,
+                                   text='Комментарий')
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_feed_query_budget(self):
+        """Ленты укладываются в фиксированный бюджет запросов"""
+        # сессия и пользователь, COUNT(*) и сами посты; у сообщества
+        # ещё сама группа, у профиля автор со счётчиками, подписка и
+        # рекомендации подписок.
+        # Кеш пуст, поэтому лентам с условным GET нужно время последней
+        # правки постов и комментариев, профилю ещё id автора и время
+        # правки профиля зрителя, а ленте подписок — список подписок,
+        # число подписчиков этих авторов и сумма их счётчиков постов, а
+        # посты она выбирает в два запроса: ключи страницы и посты по ним
+        budgets = {
+            reverse('posts:index'): 6,
+            reverse('posts:group', kwargs={'slug': self.group.slug}): 7,
+            reverse('posts:profile',
+                    kwargs={'username': self.author.username}): 12,
+            reverse('posts:follow_index'): 8,
+        }
+        for url, budget in budgets.items():
+            cache.clear()
+            with self.subTest(url=url):
+                with self.assertNumQueries(budget):
+                    response = self.authorized_client.get(url)
+                self.assertContains(response, 'Комментариев: 1',
+                                    count=settings.PAGE_SIZE)
+
+
+class TimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create(username='reader')
+        cls.author = User.objects.create(username='writer')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        """Подписка добавляет старые посты в ленту, отписка убирает"""
+        Post.objects.create(author=self.author, text='old_post')
+        self.client.get(reverse('posts:profile_follow',
+                                args=[self.author.username]))
+        Post.objects.create(author=self.author, text='new_post')
+        self.assertEqual(TimelineEntry.objects.filter(
+            user=self.reader).count(), 2)
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page']), 2)
+
+        self.client.get(reverse('posts:profile_unfollow',
+                                args=[self.author.username]))
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_popular_author_is_read_on_the_fly(self):
+        """Посты популярного автора подмешиваются в ленту при чтении"""
+        other = User.objects.create(username='other')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(author=self.author, text='popular_post')
+        Post.objects.create(author=other, text='unrelated_post')
+        self.assertFalse(TimelineEntry.objects.exists())
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertContains(response, 'popular_post')
+        self.assertNotContains(response, 'unrelated_post')
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_feed_survives_crossing_the_limit(self):
+        """Посты, опубликованные сверх предела, не пропадают из ленты,
+        когда автор снова в него укладывается"""
+        other = User.objects.create(username='other')
+        Follow.objects.create(user=other, author=self.author)
+        Post.objects.create(author=self.author, text='before_post')
+        # Подписчиков стало больше предела: без раскладки и без добавления
+        # старых постов в ленту нового подписчика
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(author=self.author, text='popular_post')
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=self.reader).exists())
+        texts = ['popular_post', 'before_post']
+        feed = timeline.posts_for(self.reader)
+        self.assertEqual([post.text for post in feed], texts)
+
+        Follow.objects.filter(user=other).delete()
+        self.assertEqual(TimelineEntry.objects.filter(
+            user=self.reader).count(), 2)
+        feed = timeline.posts_for(self.reader)
+        self.assertEqual([post.text for post in feed], texts)
+
+        Follow.objects.create(user=other, author=self.author)
+        Post.objects.create(author=self.author, text='again_post')
+        feed = timeline.posts_for(self.reader)
+        self.assertEqual([post.text for post in feed],
+                         ['again_post'] + texts)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_cursor_walks_entries_and_popular_posts(self):
+        """Курсор проходит записи ленты вперемешку с постами популярного
+        автора без пропусков и повторов, а записи хранят дату поста"""
+        popular = User.objects.create(username='popular')
+        other = User.objects.create(username='other')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.reader, author=popular)
+        Follow.objects.create(user=other, author=popular)
+        for number in range(settings.PAGE_SIZE + 3):
+            Post.objects.create(author=(self.author, popular)[number % 2],
+                                text=f'post {number}')
+        for entry in TimelineEntry.objects.select_related('post'):
+            self.assertEqual(entry.pub_date, entry.post.pub_date)
+        expected = list(Post.objects.filter(
+            author__in=[self.author, popular]
+        ).order_by('-pub_date', '-id'))
+        url = reverse('posts:follow_index')
+        first = self.client.get(url + '?cursor=').context['page']
+        self.assertFalse(first.has_previous())
+        second = self.client.get(
+            url + f'?cursor={first.next_cursor}').context['page']
+        self.assertFalse(second.has_next())
+        self.assertEqual(list(first) + list(second), expected)
+        back = self.client.get(
+            url + f'?cursor={second.previous_cursor}').context['page']
+        self.assertEqual(list(back), list(first))
+        # Нумерованная страница собирается из тех же двух источников
+        page = self.client.get(url + '?page=2').context['page']
+        self.assertEqual(list(page), expected[settings.PAGE_SIZE:])
+        self.assertEqual(page.paginator.count, len(expected))
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='searcher')
+        cls.admin = User.objects.create_superuser(
+            'search_admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def search(self, query, **params):
+        return self.client.get(reverse('posts:search'),
+                               {'q': query, **params})
+
+    def test_finds_posts_by_text_and_comments(self):
+        """Поиск находит пост по тексту и по комментариям к нему"""
+        by_text = Post.objects.create(author=self.author,
+                                      text='Ёлочные игрушки')
+        by_comment = Post.objects.create(author=self.author, text='Праздник')
+        Comment.objects.create(post=by_comment, author=self.author,
+                               text='Купил игрушку на ёлку')
+        Post.objects.create(author=self.author, text='Совсем о другом')
+        response = self.search('елоч игруш')
+        self.assertEqual(list(response.context['page']), [by_text])
+        response = self.search('игруш')
+        self.assertEqual(set(response.context['page']),
+                         {by_text, by_comment})
+
+    def test_index_follows_edits_and_deletes(self):
+        """Индекс обновляется при изменении и удалении поста"""
+        post = Post.objects.create(author=self.author, text='Первый вариант')
+        post.text = 'Второй вариант'
+        post.save()
+        self.assertFalse(self.search('первый').context['page'])
+        self.assertEqual(list(self.search('второй').context['page']),
+                         [post])
+        post.delete()
+        self.assertFalse(self.search('второй').context['page'])
+
+    def test_results_paged_by_cursor(self):
+        """Выдача листается курсором без повторов"""
+        posts = [Post.objects.create(author=self.author,
+                                     text=f'Кошка номер {i}')
+                 for i in range(settings.PAGE_SIZE + 3)]
+        first = self.search('кошка').context['page']
+        self.assertEqual(len(first), settings.PAGE_SIZE)
+        second = self.search('кошка',
+                             cursor=first.next_cursor).context['page']
+        self.assertEqual(len(second), 3)
+        self.assertFalse(second.has_next())
+        self.assertEqual(set(first) | set(second), set(posts))
+        back = self.search('кошка',
+                           cursor=second.previous_cursor).context['page']
+        self.assertEqual(list(back), list(first))
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке идёт по тому же индексу"""
+        Post.objects.create(author=self.author, text='Ёжик в тумане')
+        Post.objects.create(author=self.author, text='Медвежонок')
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin:posts_post_changelist'),
+                                   {'q': 'ежик'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+class GroupDirectoryTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='grouper')
+        cls.quiet = Group.objects.create(title='Тихое', slug='quiet')
+        cls.busy = Group.objects.create(title='Шумное', slug='busy')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_counts_follow_new_moved_and_deleted_posts(self):
+        """Число постов и последняя запись сообщества пересчитываются"""
+        first = Post.objects.create(author=self.author, group=self.busy,
+                                    text='Первый')
+        second = Post.objects.create(author=self.author, group=self.busy,
+                                     text='Второй')
+        self.busy.refresh_from_db()
+        self.assertEqual(self.busy.posts_count, 2)
+        self.assertEqual(self.busy.last_post_at, second.pub_date)
+        second.group = self.quiet
+        second.save()
+        self.busy.refresh_from_db()
+        self.quiet.refresh_from_db()
+        self.assertEqual(self.busy.posts_count, 1)
+        self.assertEqual(self.busy.last_post_at, first.pub_date)
+        self.assertEqual(self.quiet.posts_count, 1)
+        first.delete()
+        self.busy.refresh_from_db()
+        self.assertEqual(self.busy.posts_count, 0)
+        self.assertIsNone(self.busy.last_post_at)
+
+    def test_directory_lists_recently_active_first(self):
+        """Каталог показывает сначала сообщества со свежими записями"""
+        url = reverse('posts:groups')
+        Post.objects.create(author=self.author, group=self.busy,
+                            text='Первый')
+        self.assertEqual(list(self.client.get(url).context['groups']),
+                         [self.busy, self.quiet])
+        Post.objects.create(author=self.author, group=self.quiet,
+                            text='Наконец-то')
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['groups']),
+                         [self.quiet, self.busy])
+        self.assertContains(response, 'Записей: 1')
+
+    def test_group_page_uses_cached_group(self):
+        """Страница сообщества берёт его из кеша до правки сообщества"""
+        url = reverse('posts:group', kwargs={'slug': self.busy.slug})
+        self.client.get(url)
+        # сессии нет, а постов нет ни на одной странице: только COUNT(*)
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        self.busy.slug = 'renamed'
+        self.busy.save()
+        self.assertEqual(self.client.get(url).status_code, 404)
+        response = self.client.get(
+            reverse('posts:group', kwargs={'slug': 'renamed'}))
+        self.assertEqual(response.context['group'].slug, 'renamed')
+        self.busy.slug = 'busy'
+        self.busy.save()
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='conditional')
+        cls.reader = User.objects.create(username='conditional_reader')
+        cls.post = Post.objects.create(author=cls.author, text='Исходный')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_feed_answers_304_without_queries(self):
+        """Неизменная лента отвечает 304, не обращаясь к базе"""
+        url = reverse('posts:index')
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        Post.objects.create(author=self.author, text='Свежий')
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_edits_comments_and_follows_change_post_page(self):
+        """Правка поста, комментарий и подписка меняют ETag страницы поста"""
+        url = reverse('posts:post', kwargs={'username': self.author.username,
+                                            'post_id': self.post.id})
+        before = self.post.updated_at
+        changes = [
+            lambda: Post.objects.get(pk=self.post.pk).save(),
+            lambda: Comment.objects.create(post=self.post, author=self.reader,
+                                           text='Комментарий'),
+            lambda: Follow.objects.create(user=self.reader,
+                                          author=self.author),
+        ]
+        for change in changes:
+            response = self.client.get(url)
+            change()
+            self.assertEqual(self.revalidate(url, response).status_code, 200)
+        self.post.refresh_from_db()
+        self.assertGreater(self.post.updated_at, before)
+
+    def test_etag_depends_on_viewer(self):
+        """Зритель входит в ETag: после входа страница отдаётся заново"""
+        url = reverse('posts:profile',
+                      kwargs={'username': self.author.username})
+        response = self.client.get(url)
+        self.client.force_login(self.reader)
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+
+@override_settings(WRITE_BEHIND='thread', WRITE_BEHIND_INTERVAL=3600,
+                   WRITE_BEHIND_BATCH=1000)
+class WriteBehindTest(TestCase):
+    # Фоновый поток в тестах не успевает сработать, буфер сбрасывается
+    # явно: поток не видит транзакцию теста
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='viral')
+        cls.reader = User.objects.create(username='commenter')
+        cls.post = Post.objects.create(author=cls.author, text='Вирусный')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+        self.post_url = reverse('posts:post', kwargs={
+            'username': self.author.username, 'post_id': self.post.id})
+
+    def test_comment_visible_to_author_before_flush(self):
+        """Отложенный комментарий автор видит сразу, в базе он после
+        сброса буфера"""
+        self.client.post(reverse('posts:add_comment', kwargs={
+            'username': self.author.username, 'post_id': self.post.id}),
+            {'text': 'Первый!'})
+        self.assertFalse(Comment.objects.exists())
+        self.assertContains(self.client.get(self.post_url), 'Первый!')
+        self.assertNotContains(Client().get(self.post_url), 'Первый!')
+        self.assertEqual(write_behind.flush(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertContains(self.client.get(self.post_url), 'Первый!',
+                            count=1)
+
+    def test_follow_and_unfollow(self):
+        """Отложенная подписка видна в профиле, отписка её дожидается"""
+        profile_url = reverse('posts:profile',
+                              kwargs={'username': self.author.username})
+        self.client.get(reverse('posts:profile_follow',
+                                kwargs={'username': self.author.username}))
+        self.assertFalse(Follow.objects.exists())
+        self.assertTrue(self.client.get(profile_url).context['following'])
+        self.client.get(reverse('posts:profile_unfollow',
+                                kwargs={'username': self.author.username}))
+        self.assertFalse(Follow.objects.exists())
+        self.assertFalse(self.client.get(profile_url).context['following'])
+        write_behind.flush()
+        self.assertFalse(Follow.objects.exists())
+
+    def test_unfollow_cancels_follow_buffered_elsewhere(self):
+        """Отписка отменяет подписку из буфера другого процесса, даже если
+        та дойдёт до базы позже"""
+        self.client.get(reverse('posts:profile_follow',
+                                kwargs={'username': self.author.username}))
+        # Подписка ждёт в буфере соседнего процесса
+        other_buffer = write_behind._buffer[:]
+        del write_behind._buffer[:]
+        response = self.client.get(reverse(
+            'posts:profile_unfollow',
+            kwargs={'username': self.author.username}))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(write_behind.flush(), 1)
+        write_behind._buffer[:] = other_buffer
+        self.assertEqual(write_behind.flush(), 1)
+        self.assertFalse(Follow.objects.exists())
+        self.assertFalse(self.client.get(reverse(
+            'posts:profile', kwargs={'username': self.author.username}
+        )).context['following'])
+
+    def test_unfollow_after_follow_written(self):
+        """Отписка от уже записанной подписки удаляет её при сбросе"""
+        write_behind.follow(self.reader, self.author)
+        write_behind.flush()
+        self.assertTrue(Follow.objects.exists())
+        self.client.get(reverse('posts:profile_unfollow',
+                                kwargs={'username': self.author.username}))
+        self.assertTrue(Follow.objects.exists())
+        write_behind.flush()
+        self.assertFalse(Follow.objects.exists())
+
+    def test_broken_write_does_not_lose_batch(self):
+        """Запись, которую база отвергла, не мешает остальным"""
+        write_behind.add_comment(self.post, self.reader, None)
+        write_behind.add_comment(self.post, self.reader, 'Успел')
+        with self.assertLogs('posts.write_behind', 'WARNING'):
+            write_behind.flush()
+        self.assertEqual(list(Comment.objects.values_list('text', flat=True)),
+                         ['Успел'])
+
+
+@override_settings(COMMENTS_PAGE_SIZE=2)
+class CommentPagesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='talkative')
+        cls.post = Post.objects.create(author=cls.author, text='Обсуждаем')
+        cls.comments = [
+            Comment.objects.create(post=cls.post, author=cls.author,
+                                   text=f'Комментарий {number}')
+            for number in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_post_page_renders_first_chunk(self):
+        """Под постом сразу только первая порция и кнопка «Показать ещё»"""
+        response = self.client.get(reverse(
+            'posts:post', args=[self.author.username, self.post.id]))
+        self.assertEqual(list(response.context['comments']),
+                         self.comments[:-3:-1])
+        self.assertContains(response, 'Показать ещё')
+
+    def test_load_more_walks_all_comments(self):
+        """Порции по курсору проходят все комментарии без повторов,
+        по одному запросу на порцию"""
+        response = self.client.get(reverse(
+            'posts:post', args=[self.author.username, self.post.id]))
+        seen = list(response.context['comments'])
+        cursor = response.context['more_comments']
+        url = reverse('posts:comments',
+                      args=[self.author.username, self.post.id])
+        while cursor:
+            # ETag по автору поста, пост с автором и порция комментариев
+            # с авторами
+            with self.assertNumQueries(3):
+                response = self.client.get(url, {'cursor': cursor})
+            page = response.context['page']
+            seen += page.object_list
+            cursor = page.next_cursor
+        self.assertEqual(seen, self.comments[::-1])
+        self.assertNotContains(response, 'Показать ещё')
+
+
+class PostPageQueriesTest(TestCase):
+    """Число запросов страницы поста не зависит от числа комментариев."""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='popular')
+        cls.reader = User.objects.create(username='fan')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.quiet = Post.objects.create(author=cls.author, text='Тихий')
+        cls.busy = Post.objects.create(author=cls.author, text='Шумный')
+        Comment.objects.create(post=cls.quiet, author=cls.reader,
+                               text='Единственный')
+        for number in range(settings.COMMENTS_PAGE_SIZE + 5):
+            commenter = User.objects.create(username=f'commenter{number}')
+            Comment.objects.create(post=cls.busy, author=commenter,
+                                   text=f'Комментарий {number}')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_post_page_query_budget(self):
+        """Страница поста укладывается в фиксированный бюджет запросов"""
+        # id автора и время последней правки (кеш пуст) для условного
+        # GET, пост с автором и счётчиками, комментарии; у вошедшего ещё
+        # сессия, пользователь и его подписки
+        follower = Client()
+        follower.force_login(self.reader)
+        for client, budget in ((Client(), 5), (follower, 8)):
+            for post in (self.quiet, self.busy):
+                cache.clear()
+                with self.subTest(post=post.text, budget=budget):
+                    with self.assertNumQueries(budget):
+                        response = client.get(reverse(
+                            'posts:post',
+                            args=[self.author.username, post.id]))
+                    self.assertContains(response, 'Записей: 2')
+        self.assertTrue(response.context['following'])
+        self.assertContains(response, 'Отписаться')
+
+
+class TrendingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        # События других тестов копятся в памяти процесса
+        trending.flush()
+        ActivityBucket.objects.all().delete()
+        self.author = User.objects.create(username='trendsetter')
+        self.reader = User.objects.create(username='onlooker')
+        self.cats = Group.objects.create(title='Котики', slug='cats')
+        self.dogs = Group.objects.create(title='Собаки', slug='dogs')
+        self.quiet = Post.objects.create(author=self.author, text='Тихий',
+                                         group=self.dogs)
+        self.busy = Post.objects.create(author=self.author, text='Шумный',
+                                        group=self.cats)
+        for number in range(3):
+            Comment.objects.create(post=self.busy, author=self.reader,
+                                   text=f'Комментарий {number}')
+
+    def test_ranks_by_activity(self):
+        """Обсуждаемый пост и его сообщество — первые"""
+        trending.flush()
+        response = self.client.get(reverse('posts:trending'))
+        self.assertEqual(response.context['posts'], [self.busy, self.quiet])
+        self.assertEqual(response.context['groups'], [self.cats, self.dogs])
+
+    def test_follow_credits_latest_post(self):
+        """Подписка засчитывается последнему посту автора"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        trending.flush()
+        self.assertEqual(ActivityBucket.objects.get(
+            post_id=self.busy.pk).count, 5)
+
+    def test_old_activity_decays(self):
+        """Давняя активность весит меньше свежей"""
+        old = timezone.now() - timedelta(hours=24)
+        for _ in range(10):
+            trending.record(self.quiet.pk, old)
+        trending.flush()
+        self.assertEqual(trending.snapshot()['posts'][0][0], self.busy.pk)
+
+    def test_stale_snapshot_rebuilt(self):
+        """Снимок, который давно не обновлялся, пересчитывается при
+        чтении"""
+        trending.flush()
+        stale = timezone.now() - timedelta(
+            seconds=settings.TRENDING_INTERVAL)
+        cache.set(trending.SNAPSHOT_KEY,
+                  {'posts': [], 'groups': [], 'computed': stale}, None)
+        current = trending.snapshot()
+        self.assertGreater(current['computed'], stale)
+        self.assertEqual(current['posts'][0][0], self.busy.pk)
+
+    def test_stale_snapshot_rebuilt_once(self):
+        """Пока снимок пересчитывает другой запрос, остальные получают
+        прежний снимок без запросов к базе"""
+        trending.flush()
+        stale = {'posts': [(self.quiet.pk, 1.0)], 'groups': [],
+                 'computed': timezone.now() - timedelta(hours=1)}
+        cache.set(trending.SNAPSHOT_KEY, stale, None)
+        cache.add(trending.REBUILD_KEY, True)
+        with self.assertNumQueries(0):
+            self.assertEqual(trending.snapshot(), stale)
+        cache.delete(trending.SNAPSHOT_KEY)
+        with self.assertNumQueries(0):
+            self.assertEqual(trending.snapshot()['posts'], [])
+        cache.delete(trending.REBUILD_KEY)
+        self.assertEqual(trending.snapshot()['posts'][0][0], self.busy.pk)
+        self.assertIsNone(cache.get(trending.REBUILD_KEY))
+
+    def test_scores_decay_by_half_life(self):
+        """Оценка, посчитанная базой, падает вдвое за TRENDING_HALF_LIFE"""
+        trending.flush()
+        ActivityBucket.objects.all().delete()
+        now = timezone.now()
+        half_life = timedelta(seconds=settings.TRENDING_HALF_LIFE)
+        start = trending._bucket(now - half_life)
+        ActivityBucket.objects.create(post_id=self.quiet.pk, start=start,
+                                      count=4)
+        posts = trending.rebuild_snapshot(now)['posts']
+        middle = timedelta(minutes=trending.BUCKET_MINUTES) / 2
+        age = (now - start - middle) / half_life
+        self.assertEqual(posts[0][0], self.quiet.pk)
+        self.assertAlmostEqual(posts[0][1], 4 * 0.5 ** age, places=5)
+
+    def test_page_does_not_read_comments(self):
+        """Страница читает снимок из кеша и посты, но не комментарии"""
+        trending.flush()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:trending'))
+        self.assertContains(response, 'Шумный')
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'posts_comment' in query['sql']])
@@ -0,0 +1,236 @@
+"""Фоновое построение миниатюр картинок постов.
+
+Сохранение поста с новой картинкой ставит ThumbnailJob в очередь,
+а карточка поста показывает заглушку того же размера, пока в
+Post.thumbnail нет готовой ссылки. Если задание исчерпало попытки, в
+Post.thumbnail записывается адрес оригинала: лучше тяжёлая картинка,
+чем вечная заглушка. Очередь
+разбирают либо потоки самого веб-процесса (``THUMBNAIL_WORKER =
+"thread"``), либо команда ``process_thumbnails``, которая строит
+миниатюры параллельно в нескольких процессах. Потоки веб-процесса
+начинают с заданий, оставшихся от прошлых запусков, на первом его
+запросе, а упавшее задание пробуют снова через ``RETRY_AFTER``.
+
+Из картинки делается набор вариантов разной ширины в JPEG и WebP для
+``srcset``. Имена файлов содержат хеш исходника, поэтому варианты никогда
+не меняются по одному адресу и их можно отдавать с вечным кешированием.
+"""
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from . import feed_cache
+from .models import Post, ThumbnailJob
+
+# Карточка поста 960x339, варианты сохраняют её пропорции
+CARD_WIDTH, CARD_HEIGHT = 960, 339
+VARIANT_WIDTHS = (320, 640, 960)
+VARIANT_DIR = "posts/variants"
+FORMATS = [("jpg", "JPEG", {"quality": 85, "progressive": True})]
+if features.check("webp"):
+    FORMATS.append(("webp", "WEBP", {"quality": 80, "method": 4}))
+MAX_ATTEMPTS = 3
+# Через сколько повторять задание, которое не удалось выполнить
+RETRY_AFTER = timedelta(minutes=1)
+# Задание, которое столько времени числится выполняемым, считается
+# брошенным упавшим обработчиком и забирается снова
+STALE_AFTER = timedelta(minutes=10)
+BATCH_SIZE = 20
+
+_executor = None
+
+
+def image_name(value):
+    return getattr(value, "name", value) or ""
+
+
+def queue_missing():
+    """Поставить в очередь все картинки, для которых ещё нет вариантов.
+    Возвращает число новых заданий."""
+    posts = Post.objects.exclude(image="").exclude(image__isnull=True).filter(
+        thumbnail_srcset="")
+    queued = ThumbnailJob.objects.filter(post__in=posts).exclude(
+        status=ThumbnailJob.RUNNING).update(
+        status=ThumbnailJob.PENDING, attempts=0, error="",
+        updated=timezone.now())
+    missing = posts.filter(thumbnail_job__isnull=True).values_list(
+        "pk", flat=True)
+    created = ThumbnailJob.objects.bulk_create(
+        [ThumbnailJob(post_id=pk) for pk in missing.iterator()],
+        batch_size=1000,
+    )
+    return queued + len(created)
+
+
+def enqueue(post):
+    """Поставить в очередь миниатюру для новой картинки поста."""
+    Post.objects.filter(pk=post.pk).update(
+        thumbnail="", thumbnail_srcset="", thumbnail_webp_srcset="")
+    post.thumbnail = post.thumbnail_srcset = post.thumbnail_webp_srcset = ""
+    if not image_name(post.image):
+        ThumbnailJob.objects.filter(post=post).delete()
+        return
+    ThumbnailJob.objects.update_or_create(
+        post=post,
+        defaults={"status": ThumbnailJob.PENDING, "attempts": 0,
+                  "error": ""},
+    )
+    if settings.THUMBNAIL_WORKER == "thread":
+        transaction.on_commit(_kick)
+
+
+def _kick():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_THREADS,
+            thread_name_prefix="thumbnails",
+        )
+    _executor.submit(_process_in_thread)
+
+
+def resume(**kwargs):
+    """Разобрать задания, оставшиеся от прошлых запусков процесса, в том
+    числе поставленные миграцией. Подключается к первому запросу."""
+    request_started.disconnect(resume)
+    _kick()
+
+
+def _retry_later():
+    timer = threading.Timer(RETRY_AFTER.total_seconds(), _kick)
+    timer.daemon = True
+    timer.start()
+
+
+def _process_in_thread():
+    try:
+        process_pending()
+    finally:
+        connections.close_all()
+
+
+def init_worker():
+    """Подготовить процесс пула: соединения с базой, унаследованные от
+    родителя, использовать нельзя."""
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def claim(limit):
+    """Забрать до limit заданий. UPDATE с проверкой прежнего состояния
+    не даёт двум обработчикам взять одно задание."""
+    now = timezone.now()
+    candidates = ThumbnailJob.objects.filter(
+        Q(status=ThumbnailJob.PENDING, attempts=0)
+        | Q(status=ThumbnailJob.PENDING, updated__lt=now - RETRY_AFTER)
+        | Q(status=ThumbnailJob.RUNNING, updated__lt=now - STALE_AFTER),
+        attempts__lt=MAX_ATTEMPTS,
+    ).order_by("updated").values_list("pk", "status", "updated")[:limit]
+    claimed = []
+    for pk, status, updated in candidates:
+        if ThumbnailJob.objects.filter(
+            pk=pk, status=status, updated=updated
+        ).update(status=ThumbnailJob.RUNNING, attempts=F("attempts") + 1,
+                 updated=now):
+            claimed.append(pk)
+    return claimed
+
+
+def _content_hash(image):
+    digest = hashlib.sha256()
+    image.open("rb")
+    try:
+        for chunk in image.chunks():
+            digest.update(chunk)
+    finally:
+        image.close()
+    return digest.hexdigest()[:16]
+
+
+def build_variants(image):
+    """Сохранить варианты картинки и вернуть их адреса:
+    {расширение: [(ширина, url), ...]}."""
+    content_hash = _content_hash(image)
+    image.open("rb")
+    try:
+        source = ImageOps.exif_transpose(Image.open(image))
+        source = source.convert("RGB")
+    finally:
+        image.close()
+    variants = {extension: [] for extension, _, _ in FORMATS}
+    for width in VARIANT_WIDTHS:
+        size = (width, round(width * CARD_HEIGHT / CARD_WIDTH))
+        resized = None
+        for extension, image_format, options in FORMATS:
+            name = f"{VARIANT_DIR}/{content_hash}-{width}.{extension}"
+            if not default_storage.exists(name):
+                if resized is None:
+                    resized = ImageOps.fit(source, size, Image.LANCZOS)
+                buffer = BytesIO()
+                resized.save(buffer, image_format, **options)
+                name = default_storage.save(name,
+                                            ContentFile(buffer.getvalue()))
+            variants[extension].append((width, default_storage.url(name)))
+    return variants
+
+
+def _srcset(variants):
+    return ", ".join(f"{url} {width}w" for width, url in variants)
+
+
+def render(job_id):
+    """Построить варианты картинки по заданию. Возвращает True, если
+    они готовы."""
+    job = ThumbnailJob.objects.select_related("post").get(pk=job_id)
+    post = job.post
+    try:
+        variants = build_variants(post.image)
+    except Exception as error:
+        status = (ThumbnailJob.FAILED if job.attempts >= MAX_ATTEMPTS
+                  else ThumbnailJob.PENDING)
+        ThumbnailJob.objects.filter(
+            pk=job_id, status=ThumbnailJob.RUNNING
+        ).update(status=status, error=str(error), updated=timezone.now())
+        if status == ThumbnailJob.FAILED:
+            Post.objects.filter(pk=post.pk, image=post.image.name).update(
+                thumbnail=post.image.url)
+            feed_cache.invalidate_post(post.author_id, post.group_id)
+        elif settings.THUMBNAIL_WORKER == "thread":
+            _retry_later()
+        return False
+    # Пока варианты строились, картинку могли заменить: тогда ссылки
+    # уже не нужны, а задание снова стоит в очереди
+    Post.objects.filter(pk=post.pk, image=post.image.name).update(
+        thumbnail=variants["jpg"][-1][1],
+        thumbnail_srcset=_srcset(variants["jpg"]),
+        thumbnail_webp_srcset=_srcset(variants.get("webp", [])),
+    )
+    ThumbnailJob.objects.filter(pk=job_id, status=ThumbnailJob.RUNNING).update(
+        status=ThumbnailJob.DONE, error="", updated=timezone.now())
+    feed_cache.invalidate_post(post.author_id, post.group_id)
+    return True
+
+
+def process_pending(executor=None, batch_size=BATCH_SIZE):
+    """Разобрать очередь до конца, с executor — параллельно.
+    Возвращает число построенных миниатюр."""
+    done = 0
+    while True:
+        job_ids = claim(batch_size)
+        if not job_ids:
+            return done
+        results = executor.map(render, job_ids) if executor else map(
+            render, job_ids)
+        done += sum(results)
@@ -0,0 +1,222 @@
+"""Лента подписок, разложенная по пользователям при записи.
+
+Новый пост сразу записывается в TimelineEntry каждого подписчика автора,
+а лента подписок читает только свои записи. Авторы, у которых подписчиков
+больше ``TIMELINE_FANOUT_LIMIT``, не раскладываются: их посты
+подмешиваются в ленту при чтении. Когда после отписки автор снова
+укладывается в предел, ленты его подписчиков раскладываются заново (см.
+prune), иначе из них пропали бы посты, опубликованные сверх предела, и
+посты для тех, кто подписался в это время.
+
+Лента читается по ключу (pub_date, id): записи — по индексу (user,
+-pub_date, -post), посты популярных авторов — отдельным запросом по
+индексу (author, -pub_date, -id). Каждый запрос ограничен размером
+страницы, ключи сливаются в памяти, а сами посты выбираются по id.
+"""
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, Sum
+
+from . import follow_graph
+from .models import Follow, Post, TimelineEntry, UserStats
+from .pagination import PREVIOUS, CursorPage, CursorPaginator
+
+BATCH_SIZE = 1000
+
+
+def _is_celebrity(author_id):
+    return (follow_graph.follower_count(author_id)
+            > settings.TIMELINE_FANOUT_LIMIT)
+
+
+def _insert(entries):
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE,
+                                      ignore_conflicts=True)
+
+
+def fan_out(post):
+    """Положить новый пост в ленты всех подписчиков автора."""
+    if _is_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(author_id=post.author_id).values_list(
+        "user_id", flat=True)
+    _insert(TimelineEntry(user_id=user_id, post_id=post.pk,
+                          pub_date=post.pub_date)
+            for user_id in followers.iterator())
+
+
+def backfill(follow):
+    """Добавить в ленту подписчика уже опубликованные посты автора."""
+    if _is_celebrity(follow.author_id):
+        return
+    posts = Post.objects.filter(author_id=follow.author_id).values_list(
+        "pk", "pub_date")
+    _insert(TimelineEntry(user_id=follow.user_id, post_id=post_id,
+                          pub_date=pub_date)
+            for post_id, pub_date in posts.iterator())
+
+
+def prune(follow):
+    """Убрать из ленты бывшего подписчика посты автора. Если автор после
+    этого перестал быть популярным, разложить его посты заново."""
+    TimelineEntry.objects.filter(
+        user_id=follow.user_id, post__author_id=follow.author_id
+    ).delete()
+    # Отписки уменьшают число подписчиков по одному, так что переход через
+    # предел вниз — ровно равенство
+    if (follow_graph.follower_count(follow.author_id)
+            == settings.TIMELINE_FANOUT_LIMIT):
+        refill(follow.author_id)
+
+
+def refill(author_id):
+    """Разложить все посты автора по лентам всех его подписчиков одним
+    INSERT ... SELECT."""
+    TimelineEntry.objects.filter(post__author_id=author_id).delete()
+    sql = (
+        "INSERT INTO {entry} (user_id, post_id, pub_date) "
+        "SELECT f.user_id, p.id, p.pub_date FROM {follow} f "
+        "JOIN {post} p ON p.author_id = f.author_id "
+        "WHERE f.author_id = %s"
+    ).format(
+        entry=TimelineEntry._meta.db_table,
+        follow=Follow._meta.db_table,
+        post=Post._meta.db_table,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [author_id])
+
+
+def rebuild(users=None):
+    """Разложить ленты подписок заново, для всех пользователей или только
+    для queryset users. Одним INSERT ... SELECT: у популярных авторов
+    десятки тысяч постов, и через bulk_create это заняло бы минуты.
+    Счётчики подписчиков к этому времени должны быть пересчитаны."""
+    entries = TimelineEntry.objects.all()
+    sql = (
+        "INSERT INTO {entry} (user_id, post_id, pub_date) "
+        "SELECT f.user_id, p.id, p.pub_date FROM {follow} f "
+        "JOIN {post} p ON p.author_id = f.author_id "
+        "JOIN {stats} s ON s.user_id = f.author_id "
+        "WHERE s.followers_count <= %s"
+    ).format(
+        entry=TimelineEntry._meta.db_table,
+        follow=Follow._meta.db_table,
+        post=Post._meta.db_table,
+        stats=UserStats._meta.db_table,
+    )
+    params = [settings.TIMELINE_FANOUT_LIMIT]
+    if users is not None:
+        entries = entries.filter(user__in=users)
+        users_sql, users_params = users.values("pk").query.sql_with_params()
+        sql += f" AND f.user_id IN ({users_sql})"
+        params += users_params
+    entries.delete()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _seek(key, pk, forward):
+    """Условие «строго после ключа (pub_date, pk)» в порядке ленты, или
+    «строго до него» при forward=False."""
+    pub_date, post_id = key
+    lookup = "lt" if forward else "gt"
+    return (Q(**{f"pub_date__{lookup}": pub_date})
+            | Q(pub_date=pub_date, **{f"{pk}__{lookup}": post_id}))
+
+
+class Feed:
+    """Лента подписок пользователя, новые посты сверху.
+
+    Её можно отдать Paginator: срезы и count() не соединяют записи ленты
+    с постами. Страницы по курсору отдаёт page_by_cursor.
+    """
+
+    def __init__(self, user):
+        self.user_id = user.pk
+        counts = follow_graph.follower_counts(
+            follow_graph.followees(user.pk))
+        self.celebrities = [
+            author_id for author_id, count in counts.items()
+            if count > settings.TIMELINE_FANOUT_LIMIT
+        ]
+
+    def _sources(self):
+        sources = [(TimelineEntry.objects.filter(user_id=self.user_id),
+                    "post_id")]
+        if self.celebrities:
+            sources.append(
+                (Post.objects.filter(author_id__in=self.celebrities), "id"))
+        return sources
+
+    def keys(self, limit, key=None, forward=True):
+        """До limit ключей (pub_date, id) ленты, следующих за key (или
+        предшествующих ему при forward=False) в этом направлении."""
+        keys = set()
+        for queryset, pk in self._sources():
+            if key is not None:
+                queryset = queryset.filter(_seek(key, pk, forward))
+            ordering = ("-pub_date", f"-{pk}") if forward else ("pub_date",
+                                                                pk)
+            # Пост популярного автора может быть и в записях ленты, если
+            # автор стал популярным позже: set убирает повтор
+            keys.update(queryset.order_by(*ordering).values_list(
+                "pub_date", pk)[:limit])
+        return sorted(keys, reverse=forward)[:limit]
+
+    def posts(self, keys):
+        posts = Post.objects.for_feed().in_bulk([pk for _, pk in keys])
+        return [posts[pk] for _, pk in keys if pk in posts]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.stop is None or index.step:
+            raise TypeError("Лента подписок отдаёт только срезы [a:b]")
+        start = index.start or 0
+        return self.posts(self.keys(index.stop)[start:])
+
+    def __iter__(self):
+        key = None
+        while True:
+            keys = self.keys(BATCH_SIZE, key)
+            yield from self.posts(keys)
+            if len(keys) < BATCH_SIZE:
+                return
+            key = keys[-1]
+
+    def estimate(self):
+        """Примерная длина ленты по счётчикам постов авторов, на которых
+        подписан пользователь, без обхода самой ленты."""
+        authors = Follow.objects.filter(user_id=self.user_id).values(
+            "author_id")
+        return UserStats.objects.filter(user_id__in=authors).aggregate(
+            total=Sum("posts_count"))["total"] or 0
+
+    def count(self):
+        entries = TimelineEntry.objects.filter(user_id=self.user_id)
+        count = entries.count()
+        if self.celebrities:
+            count += Post.objects.filter(
+                author_id__in=self.celebrities
+            ).exclude(pk__in=entries.values("post_id")).count()
+        return count
+
+    def page_by_cursor(self, cursor, per_page):
+        """Страница по курсору в формате CursorPaginator."""
+        # Паджинатор по постам только разбирает и строит курсоры
+        paginator = CursorPaginator(Post.objects.all(), per_page)
+        direction, key = paginator.decode_cursor(cursor)
+        forward = direction != PREVIOUS
+        keys = self.keys(per_page + 1, key, forward)
+        has_more = len(keys) > per_page
+        keys = keys[:per_page]
+        if not forward:
+            keys.reverse()
+        return CursorPage(
+            self.posts(keys), paginator,
+            has_next=not forward or has_more,
+            has_previous=has_more if not forward else direction is not None)
+
+
+def posts_for(user):
+    """Лента подписок пользователя, см. Feed."""
+    return Feed(user)
@@ -0,0 +1,212 @@
+"""Популярное: посты и сообщества с самой заметной свежей активностью.
+
+Событие засчитывается посту: его публикация, комментарий к нему и
+подписка на его автора (последнему посту автора). События копятся в
+памяти процесса по отрезкам в ``BUCKET_MINUTES`` минут, а фоновый поток
+раз в ``TRENDING_INTERVAL`` секунд добавляет их в ActivityBucket,
+удаляет отрезки старше ``TRENDING_WINDOW`` и пересчитывает снимок.
+Вес события падает вдвое каждые ``TRENDING_HALF_LIFE`` секунд, оценка
+сообщества — сумма оценок его постов.
+
+Оценки считает сама база: вес каждого отрезка вычисляется один раз, а
+сумма по постам и сообществам и выбор лучших — агрегатами SQL, так что
+в память попадают только TOP_POSTS и TOP_GROUPS строк.
+
+Снимок лежит в кеше, и страница /trending/ читает только его и сами
+посты: ни комментарии, ни отрезки активности ей не нужны. Снимок
+пересчитывает поток сохранения. Если он давно не работал (например,
+после перезапуска или в затишье), снимок пересчитывает один запрос
+страницы, взявший блокировку через cache.add, а остальные тем временем
+отдают прежний снимок. Если процесс упадёт, события последнего
+интервала пропадут.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import content
+from .models import ActivityBucket, Post
+
+BUCKET_MINUTES = 5
+TOP_POSTS = 20
+TOP_GROUPS = 10
+# Ограничение SQLite на число параметров запроса
+CHUNK_SIZE = 500
+SNAPSHOT_KEY = "trending"
+# Ключ блокировки пересчёта; если пересчитывавший процесс упал, через
+# REBUILD_TIMEOUT секунд пересчитать сможет другой
+REBUILD_KEY = "trending-rebuild"
+REBUILD_TIMEOUT = 60
+EMPTY = {"posts": [], "groups": [], "computed": None}
+
+logger = logging.getLogger("posts.trending")
+
+_pending = Counter()
+_lock = threading.Lock()
+# Отрезки сохраняются по одному потоку за раз, как в write_behind
+_flush_lock = threading.Lock()
+_flusher = None
+
+
+def _bucket(moment):
+    return moment.replace(minute=moment.minute - moment.minute
+                          % BUCKET_MINUTES, second=0, microsecond=0)
+
+
+def _chunks(ids):
+    ids = list(ids)
+    return [ids[start:start + CHUNK_SIZE]
+            for start in range(0, len(ids), CHUNK_SIZE)]
+
+
+def record(post_id, moment=None):
+    """Засчитать событие посту post_id."""
+    global _flusher
+    start = _bucket(moment or timezone.now())
+    with _lock:
+        _pending[start, post_id] += 1
+        if _flusher is None and settings.TRENDING_FLUSHER == "thread":
+            _flusher = threading.Thread(target=_flush_forever,
+                                        name="trending", daemon=True)
+            _flusher.start()
+            atexit.register(flush)
+
+
+def record_follow(author_id):
+    """Подписка на автора засчитывается его последнему посту."""
+    post_id = Post.objects.filter(author_id=author_id).order_by(
+        "-pub_date", "-id").values_list("pk", flat=True).first()
+    if post_id is not None:
+        record(post_id)
+
+
+def _flush_forever():
+    while True:
+        time.sleep(settings.TRENDING_INTERVAL)
+        try:
+            flush()
+        except Exception:
+            logger.exception("Не удалось сохранить активность постов")
+        finally:
+            connections.close_all()
+
+
+def _save(pending):
+    with transaction.atomic():
+        content.insert_rows(ActivityBucket, (
+            {"start": start, "post_id": post_id, "count": 0}
+            for start, post_id in pending
+        ), ignore_conflicts=True)
+        # Одним UPDATE на отрезок и прибавку: чаще всего это +1
+        steps = defaultdict(list)
+        for (start, post_id), count in pending.items():
+            steps[start, count].append(post_id)
+        for (start, count), post_ids in steps.items():
+            for chunk in _chunks(post_ids):
+                ActivityBucket.objects.filter(
+                    start=start, post_id__in=chunk
+                ).update(count=F("count") + count)
+
+
+def flush():
+    """Сохранить накопленные события, удалить устаревшие отрезки и
+    обновить снимок. Если база занята, события возвращаются в память,
+    а ошибка пробрасывается."""
+    with _flush_lock:
+        with _lock:
+            pending = _pending.copy()
+            _pending.clear()
+        now = timezone.now()
+        # Без новых событий свежий снимок, посчитанный другим процессом,
+        # пересчитывать незачем
+        current = cache.get(SNAPSHOT_KEY)
+        fresh = timedelta(seconds=settings.TRENDING_INTERVAL)
+        if not pending and current and now - current["computed"] < fresh:
+            return current
+        try:
+            if pending:
+                _save(pending)
+            ActivityBucket.objects.filter(start__lt=now - timedelta(
+                seconds=settings.TRENDING_WINDOW)).delete()
+        except DatabaseError:
+            with _lock:
+                _pending.update(pending)
+            raise
+        return rebuild_snapshot(now)
+
+
+SCORES_SQL = (
+    # Вес отрезка зависит только от его начала и считается по разу на
+    # отрезок, а не на строку
+    "WITH scores AS ("
+    "SELECT b.post_id, SUM(b.count * w.weight) AS score FROM {bucket} b "
+    "JOIN (SELECT start, POWER(0.5, MAX((julianday(%s) - julianday(start))"
+    " * 86400 - %s, 0) / %s) AS weight "
+    "FROM {bucket} WHERE start >= %s GROUP BY start) w "
+    "ON w.start = b.start GROUP BY b.post_id) "
+)
+# Удалённые посты выпадают на соединении с таблицей постов
+TOP_POSTS_SQL = SCORES_SQL + (
+    "SELECT s.post_id, s.score FROM scores s "
+    "JOIN {post} p ON p.id = s.post_id "
+    "ORDER BY s.score DESC, s.post_id DESC LIMIT %s"
+)
+TOP_GROUPS_SQL = SCORES_SQL + (
+    "SELECT p.group_id, SUM(s.score) AS total FROM scores s "
+    "JOIN {post} p ON p.id = s.post_id WHERE p.group_id IS NOT NULL "
+    "GROUP BY p.group_id ORDER BY total DESC, p.group_id DESC LIMIT %s"
+)
+
+
+def rebuild_snapshot(now=None):
+    """Пересчитать снимок по ActivityBucket и положить его в кеш."""
+    now = now or timezone.now()
+    middle = timedelta(minutes=BUCKET_MINUTES) / 2
+    adapt = connection.ops.adapt_datetimefield_value
+    params = [
+        adapt(now), middle.total_seconds(), settings.TRENDING_HALF_LIFE,
+        adapt(now - timedelta(seconds=settings.TRENDING_WINDOW)),
+    ]
+    tables = {"bucket": ActivityBucket._meta.db_table,
+              "post": Post._meta.db_table}
+    with connection.cursor() as cursor:
+        cursor.execute(TOP_POSTS_SQL.format(**tables), params + [TOP_POSTS])
+        posts = [tuple(row) for row in cursor.fetchall()]
+        cursor.execute(TOP_GROUPS_SQL.format(**tables),
+                       params + [TOP_GROUPS])
+        groups = [tuple(row) for row in cursor.fetchall()]
+    snapshot = {"posts": posts, "groups": groups, "computed": now}
+    cache.set(SNAPSHOT_KEY, snapshot, None)
+    return snapshot
+
+
+def snapshot():
+    """Последний снимок: {"posts": [(id, оценка)], "groups": [...],
+    "computed": время}. Снимок старше ``TRENDING_INTERVAL`` пересчитывает
+    только тот, кто взял блокировку, остальные получают прежний (или
+    пустой, если снимка ещё нет) — без запросов к базе."""
+    current = cache.get(SNAPSHOT_KEY)
+    fresh = timedelta(seconds=settings.TRENDING_INTERVAL)
+    if current is not None and timezone.now() - current["computed"] < fresh:
+        return current
+    if not cache.add(REBUILD_KEY, True, REBUILD_TIMEOUT):
+        return current or EMPTY
+    try:
+        return rebuild_snapshot()
+    finally:
+        cache.delete(REBUILD_KEY)
+
+
+def forget_snapshot():
+    """Выбросить снимок, например после загрузки контента: следующий
+    запрос соберёт его по новым данным."""
+    cache.delete(SNAPSHOT_KEY)
@@ -0,0 +1,156 @@
+"""Потоковый приём картинок.
+
+``ImageUploadHandler`` пишет файл на диск кусками по мере чтения тела
+запроса и не держит его в памяти целиком. Из первых килобайт файла
+Pillow читает только заголовок: формат и размеры известны без
+декодирования, поэтому слишком большие файлы и картинки-бомбы
+отбрасываются ещё до того, как тело запроса дочитано. Остаток такого
+файла вычитывается из запроса и выбрасывается, а форма получает
+``RejectedUpload`` с причиной отказа и показывает её у поля.
+
+В памяти одновременно лежат не больше ``HEADER_BYTES`` заголовка и один
+кусок тела. Сколько памяти заняла загрузка на самом деле, пишется в лог
+``posts.uploads`` и в ``upload_stats`` загруженного файла.
+"""
+import logging
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+# Сколько начальных байт файла копится для чтения заголовка. Обычно
+# хватает первого куска, но у JPEG размеры могут стоять после EXIF.
+HEADER_BYTES = 256 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def check_size(size):
+    if size > settings.IMAGE_UPLOAD_MAX_SIZE:
+        return "Файл больше {}.".format(
+            filesizeformat(settings.IMAGE_UPLOAD_MAX_SIZE))
+
+
+def check_dimensions(width, height):
+    if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+        return "Картинка больше {} мегапикселей.".format(
+            settings.IMAGE_UPLOAD_MAX_PIXELS // 1000000)
+
+
+def read_dimensions(file):
+    """Размеры картинки по заголовку, без декодирования пикселей. None,
+    если по этим байтам заголовок не прочитать."""
+    try:
+        with Image.open(file) as image:
+            return image.size
+    except Image.DecompressionBombError:
+        # Pillow сам отказывается открывать такие картинки, их размеры
+        # заведомо больше допустимых
+        return (settings.IMAGE_UPLOAD_MAX_PIXELS + 1, 1)
+    except Exception:
+        return None
+
+
+class RejectedUpload(InMemoryUploadedFile):
+    """Пустой файл на месте отвергнутой загрузки: форма покажет
+    причину отказа вместо того, чтобы молча сохранить пост без
+    картинки."""
+
+    def __init__(self, field_name, name, content_type, rejection):
+        super().__init__(BytesIO(), field_name, name, content_type, 0, None)
+        self.rejection = rejection
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.header = bytearray()
+        self.received = 0
+        self.peak_memory = 0
+        self.image_size = None
+        self.rejection = None
+
+    def reject(self, rejection):
+        self.rejection = rejection
+        self.header = None
+        # Уже записанное на диск больше не нужно
+        self.file.close()
+
+    def inspect_header(self):
+        size = read_dimensions(BytesIO(self.header))
+        if size is None:
+            if len(self.header) >= HEADER_BYTES:
+                # Заголовок не читается: решит валидация формы, открыв
+                # файл с диска
+                self.header = None
+            return
+        self.header = None
+        self.image_size = size
+        rejection = check_dimensions(*size)
+        if rejection:
+            self.reject(rejection)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.rejection:
+            return None
+        buffered = len(raw_data)
+        rejection = check_size(self.received)
+        if rejection:
+            self.reject(rejection)
+        elif self.header is not None:
+            # Кусок уже скопирован в заголовок
+            self.header += raw_data
+            buffered = len(self.header)
+            self.inspect_header()
+        self.peak_memory = max(self.peak_memory, buffered)
+        if self.rejection:
+            return None
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        stats = {
+            "size": self.received,
+            "peak_memory": self.peak_memory,
+            "rejected": bool(self.rejection),
+        }
+        logger.info("upload %s: %d bytes, peak memory %d bytes%s",
+                    self.file_name, self.received, self.peak_memory,
+                    ", rejected: " + self.rejection if self.rejection
+                    else "")
+        if self.rejection:
+            upload = RejectedUpload(self.field_name, self.file_name,
+                                    self.content_type, self.rejection)
+        else:
+            upload = super().file_complete(file_size)
+            upload.image_size = self.image_size
+        upload.upload_stats = stats
+        return upload
+
+
+def pop_rejected(files, field_name):
+    """Убрать из files отвергнутую загрузку: ImageField принял бы её за
+    битую картинку. Возвращает причину отказа или None."""
+    upload = files.get(field_name)
+    rejection = getattr(upload, "rejection", None)
+    if rejection:
+        files.pop(field_name)
+    return rejection
+
+
+def validate_image(upload):
+    """Проверить размер файла и картинки. ImageField к этому моменту уже
+    открыл её, но пиксели ещё не декодированы."""
+    rejection = check_size(upload.size)
+    if rejection is None:
+        image = getattr(upload, "image", None)
+        size = image.size if image is not None else getattr(
+            upload, "image_size", None)
+        if size is not None:
+            rejection = check_dimensions(*size)
+    if rejection:
+        raise ValidationError(rejection, code="invalid_image")
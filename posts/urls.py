@@ -6,15 +6,20 @@ app_name = "posts"
 
 urlpatterns = [
     path("", views.index, name="index"),
+    path("groups/", views.group_index, name="groups"),
+    path("trending/", views.trending_index, name="trending"),
     path("group/<slug:slug>/", views.group_posts, name="group"),
     path("new/", views.new_post, name="new_post"),
     path("follow/", views.follow_index, name="follow_index"),
+    path("search/", views.search_posts, name="search"),
     path("<str:username>/follow/", views.profile_follow,
          name="profile_follow"),
     path("<str:username>/unfollow/", views.profile_unfollow,
          name="profile_unfollow"),
     path("<str:username>/", views.profile, name="profile"),
     path("<str:username>/<int:post_id>/", views.post_view, name="post"),
+    path("<str:username>/<int:post_id>/comments/", views.post_comments,
+         name="comments"),
     path("<str:username>/<int:post_id>/edit/", views.post_edit,
          name="post_edit"),
     path("<username>/<int:post_id>/comment", views.add_comment,
@@ -1,39 +1,71 @@
+from django.conf import settings
+from django.db.models import F
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
 from django.shortcuts import redirect
 from django.shortcuts import render
-from django.conf import settings
 
 from .forms import CommentForm
 from .models import Post, Group, Follow
 from .forms import PostForm
+from .pagination import NEXT, CursorPaginator, get_page
+from .conditional import (feed_condition, group_scope, index_scope,
+                          post_scope, profile_scope)
+from . import (feed_cache, follow_graph, group_cache, recommendations,
+               search, timeline, trending, write_behind)
 
 
 User = get_user_model()
 
 
+@feed_condition(index_scope)
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, settings.PAGE_SIZE)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
-    return render(request, "index.html", {"page": page})
+    post_list = Post.objects.for_feed()
+    page = get_page(request, post_list, count_key="feed-count:index")
+    cache_key = feed_cache.page_key(request, page, "index")
+    return render(request, "index.html",
+                  {"page": page, "cache_key": cache_key})
 
 
+@feed_condition(group_scope)
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, settings.PAGE_SIZE)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
-    return render(request, "group.html", {"group": group, "page": page})
+    group = group_cache.get_or_404(slug)
+    post_list = group.posts.for_feed()
+    page = get_page(request, post_list, estimate=group.posts_count)
+    cache_key = feed_cache.page_key(request, page, "group", group.pk)
+    return render(request, "group.html",
+                  {"group": group, "page": page, "cache_key": cache_key})
+
+
+def group_index(request):
+    # Запрос ленивый: при попадании во фрагментный кеш он не выполняется
+    groups = Group.objects.order_by(F("last_post_at").desc(nulls_last=True),
+                                    "title")
+    cache_key = feed_cache.version("groups")
+    return render(request, "groups.html",
+                  {"groups": groups, "cache_key": cache_key})
+
+
+def trending_index(request):
+    # Порядок и оценки берутся из снимка, комментарии не читаются
+    snapshot = trending.snapshot()
+    posts = Post.objects.for_feed().in_bulk(
+        [post_id for post_id, _ in snapshot["posts"]])
+    groups = Group.objects.in_bulk(
+        [group_id for group_id, _ in snapshot["groups"]])
+    return render(request, "trending.html", {
+        "posts": [posts[post_id] for post_id, _ in snapshot["posts"]
+                  if post_id in posts],
+        "groups": [groups[group_id] for group_id, _ in snapshot["groups"]
+                   if group_id in groups],
+        "computed": snapshot["computed"],
+    })
 
 
 @login_required
 def new_post(request):
-    form = PostForm(request.POST or None)
+    form = PostForm(request.POST or None, files=request.FILES or None)
     if request.method == "POST" and form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
@@ -43,34 +75,82 @@ def new_post(request):
     return render(request, "create_or_update_post.html", context)
 
 
+def _is_following(user, author):
+    # Отложенная подписка или отписка новее того, что уже в базе
+    if write_behind.enabled():
+        pending = write_behind.is_following(user, author)
+        if pending is not None:
+            return pending
+    return follow_graph.is_following(user.pk, author.pk)
+
+
+# Рекомендации в боковой панели зависят от подписок зрителя
+@feed_condition(profile_scope, for_viewer=True)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-    paginator = Paginator(post_list, settings.PAGE_SIZE)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
-    following = request.user.is_authenticated and Follow.objects.filter(
-        user=request.user, author=author
-    ).exists()
+    author = get_object_or_404(User.objects.select_related("stats"),
+                               username=username)
+    post_list = author.posts.for_feed()
+    stats = getattr(author, "stats", None)
+    page = get_page(request, post_list,
+                    estimate=stats.posts_count if stats else None)
+    following = request.user.is_authenticated and _is_following(
+        request.user, author)
+    suggestions = []
+    if request.user.is_authenticated:
+        suggestions = recommendations.for_user(
+            request.user, exclude=follow_graph.followees(request.user.pk))
+    cache_key = feed_cache.page_key(request, page, "profile", author.pk)
     return render(request, "profile.html",
-                  {"author": author, "page": page, "following": following})
+                  {"author": author, "page": page, "following": following,
+                   "suggestions": suggestions, "cache_key": cache_key})
 
 
+@feed_condition(post_scope)
 def post_view(request, username, post_id):
-    profile = get_object_or_404(Post, author__username=username, id=post_id)
-    comments = profile.comments.all()
-    if request.user.is_authenticated:
-        fil = Follow.objects.filter(user=request.user,
-                                    author=profile.author).exists()
-        following = request.user.is_authenticated and fil
-    else:
-        following = False
+    # Пост, автор со счётчиками и сообщество — одним запросом,
+    # комментарии — вторым, сколько бы их ни было; подписка — из графа
+    profile = get_object_or_404(
+        Post.objects.for_feed().select_related("author__stats"),
+        author__username=username, id=post_id
+    )
+    paginator = _comment_pages(profile)
+    # Сразу отрисовывается только первая порция, остальные догружает
+    # post_comments
+    comments = paginator.object_list[:paginator.per_page]
+    more_comments = None
+    if comments and profile.comment_count > len(comments):
+        more_comments = paginator.encode_cursor(
+            NEXT, comments[len(comments) - 1])
+    following = request.user.is_authenticated and _is_following(
+        request.user, profile.author)
     form = CommentForm()
     context = {"author": profile.author, "post": profile, "comments": comments,
-               "form": form, "following": following}
+               "more_comments": more_comments, "form": form,
+               "following": following}
+    if write_behind.enabled():
+        context["pending_comments"] = write_behind.pending_comments(
+            profile, request.user)
     return render(request, "post.html", context)
 
 
+def _comment_pages(post):
+    """Комментарии поста по ключу (created, id), новые сверху."""
+    return CursorPaginator(post.comments.select_related("author"),
+                           settings.COMMENTS_PAGE_SIZE,
+                           ordering=("-created", "-id"))
+
+
+@feed_condition(post_scope)
+def post_comments(request, username, post_id):
+    """Следующая порция комментариев к посту после ``?cursor=``:
+    фрагмент HTML для кнопки «Показать ещё»."""
+    post = get_object_or_404(Post.objects.select_related("author"),
+                             author__username=username, id=post_id)
+    page = _comment_pages(post).page_by_cursor(request.GET.get("cursor"))
+    return render(request, "comments_page.html", {"post": post,
+                                                  "page": page})
+
+
 @login_required
 def post_edit(request, username, post_id):
     post = get_object_or_404(Post, id=post_id, author__username=username)
@@ -90,7 +170,10 @@ def post_edit(request, username, post_id):
 def add_comment(request, username, post_id):
     post = get_object_or_404(Post, author__username=username, id=post_id)
     form = CommentForm(request.POST or None)
-    if form.is_valid():
+    if form.is_valid() and write_behind.enabled():
+        write_behind.add_comment(post, request.user,
+                                 form.cleaned_data["text"])
+    elif form.is_valid():
         comment = form.save(commit=False)
         comment.post = post
         comment.author = request.user
@@ -101,18 +184,29 @@ def add_comment(request, username, post_id):
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(posts, settings.PAGE_SIZE)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    feed = timeline.posts_for(request.user)
+    if "cursor" in request.GET:
+        page = feed.page_by_cursor(request.GET.get("cursor"),
+                                   settings.PAGE_SIZE)
+    else:
+        page = get_page(request, feed, estimate=feed.estimate())
     return render(request, "follow.html", {"page": page,
-                  "paginator": paginator})
+                  "paginator": page.paginator})
+
+
+def search_posts(request):
+    query = request.GET.get("q", "").strip()
+    paginator = search.SearchPaginator(query, settings.PAGE_SIZE)
+    page = paginator.page_by_cursor(request.GET.get("cursor"))
+    return render(request, "search.html", {"page": page, "query": query})
 
 
 @login_required
 def profile_follow(request, username):
     follow_user = get_object_or_404(User, username=username)
-    if request.user != follow_user:
+    if request.user != follow_user and write_behind.enabled():
+        write_behind.follow(request.user, follow_user)
+    elif request.user != follow_user:
         Follow.objects.get_or_create(user=request.user, author=follow_user)
     return redirect("posts:profile", username=username)
 
@@ -120,7 +214,12 @@ def profile_follow(request, username):
 @login_required
 def profile_unfollow(request, username):
     unfollow_user = get_object_or_404(User, username=username)
-    get_object_or_404(Follow, user=request.user, author=unfollow_user).delete()
+    if write_behind.enabled():
+        # Подписка могла ещё не дойти до базы, отписка её отменит
+        write_behind.unfollow(request.user, unfollow_user)
+    else:
+        get_object_or_404(Follow, user=request.user,
+                          author=unfollow_user).delete()
     return redirect("posts:profile", username=username)
 
 
@@ -0,0 +1,13 @@
+"""Пулы процессов для команд, которые считают на всех ядрах."""
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connections
+
+
+def process_pool(workers, initializer=None, initargs=()):
+    """ProcessPoolExecutor на workers процессов. Процессы пула не должны
+    унаследовать открытые соединения с базой, поэтому перед запуском они
+    закрываются, а initializer открывает в процессе свои."""
+    connections.close_all()
+    return ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                               initargs=initargs)
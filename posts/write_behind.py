@@ -0,0 +1,217 @@
+"""Отложенная запись комментариев и подписок.
+
+При ``WRITE_BEHIND = "thread"`` add_comment, profile_follow и
+profile_unfollow не пишут в базу сами, а кладут запись в буфер процесса
+и сразу отвечают. Фоновый поток сбрасывает буфер одной транзакцией, как
+только в нём набралось ``WRITE_BEHIND_BATCH`` записей или прошло
+``WRITE_BEHIND_INTERVAL`` секунд с первой из них. Под всплеском
+комментариев к одному посту база (SQLite особенно) берёт блокировку на
+запись раз на пачку, а не на каждую строку.
+
+Записи сохраняются обычным save(), поэтому счётчики, ленты подписок и
+поисковый индекс обновляются теми же сигналами. Пока запись в буфере,
+автор видит её через кеш: свой комментарий — под постом, подписку — на
+кнопке в профиле.
+
+Подписка и отписка могут оказаться в буферах разных процессов и дойти до
+базы в любом порядке. Поэтому последнее действие пользователя с автором
+и его время лежат в общем кеше, и подписка, после которой уже была
+отписка, не записывается. Буфер живёт в памяти: при штатной остановке
+процесса он сбрасывается, но при аварийной теряются записи последнего
+окна.
+"""
+import atexit
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import (DatabaseError, IntegrityError, connections,
+                       transaction)
+from django.utils import timezone
+
+from . import feed_cache
+from .models import Comment, Follow
+
+COMMENT = "comment"
+FOLLOW = "follow"
+UNFOLLOW = "unfollow"
+# Сколько показывать автору запись, которую так и не удалось сбросить
+PENDING_TIMEOUT = 60
+
+logger = logging.getLogger("posts.write_behind")
+
+_buffer = []
+_ready = threading.Condition()
+# Пачки пишутся по одной: две транзакции записи в SQLite мешают друг другу
+_flush_lock = threading.Lock()
+_flusher = None
+
+
+def enabled():
+    return settings.WRITE_BEHIND == "thread"
+
+
+def _comments_key(post_id, user_id):
+    return f"pending-comments:{post_id}:{user_id}"
+
+
+def _follow_key(user_id, author_id):
+    return f"pending-follow:{user_id}:{author_id}"
+
+
+def add_comment(post, author, text):
+    """Отложить комментарий author к посту post."""
+    token = uuid.uuid4().hex
+    key = _comments_key(post.pk, author.pk)
+    pending = cache.get(key, [])
+    pending.append({"token": token, "text": text, "created": timezone.now()})
+    cache.set(key, pending, PENDING_TIMEOUT)
+    # Иначе автор получит 304 на страницу поста без своего комментария
+    feed_cache.invalidate("profile", post.author_id)
+    _submit(COMMENT, {"post_id": post.pk, "author_id": author.pk,
+                      "text": text}, token)
+
+
+def follow(user, author):
+    """Отложить подписку user на author."""
+    _follow_state(FOLLOW, user, author)
+
+
+def unfollow(user, author):
+    """Отложить отписку user от author. Она отменяет и подписку, которая
+    ещё ждёт в буфере этого или другого процесса."""
+    _follow_state(UNFOLLOW, user, author)
+
+
+def _follow_state(kind, user, author):
+    requested = time.time()
+    cache.set(_follow_key(user.pk, author.pk),
+              {"following": kind == FOLLOW, "requested": requested},
+              PENDING_TIMEOUT)
+    feed_cache.invalidate("profile", author.pk)
+    feed_cache.invalidate("profile", user.pk)
+    _submit(kind, {"user_id": user.pk, "author_id": author.pk}, requested)
+
+
+def pending_comments(post, user):
+    """Ещё не записанные комментарии user к посту post, новые сверху."""
+    if not user.is_authenticated:
+        return []
+    pending = cache.get(_comments_key(post.pk, user.pk), [])
+    return [Comment(post=post, author=user, text=item["text"],
+                    created=item["created"])
+            for item in reversed(pending)]
+
+
+def is_following(user, author):
+    """True, если подписка user на author ждёт записи, False, если ждёт
+    отписка, и None, если ничего не ждёт."""
+    state = cache.get(_follow_key(user.pk, author.pk))
+    return None if state is None else state["following"]
+
+
+def _submit(kind, fields, token=None):
+    global _flusher
+    with _ready:
+        _buffer.append((kind, fields, token))
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_forever,
+                                        name="write-behind", daemon=True)
+            _flusher.start()
+            atexit.register(flush)
+        _ready.notify()
+
+
+def _flush_forever():
+    while True:
+        with _ready:
+            _ready.wait_for(lambda: _buffer)
+            _ready.wait_for(
+                lambda: len(_buffer) >= settings.WRITE_BEHIND_BATCH,
+                timeout=settings.WRITE_BEHIND_INTERVAL)
+        try:
+            flush()
+        except Exception:
+            logger.exception("Не удалось сбросить отложенные записи")
+            time.sleep(settings.WRITE_BEHIND_INTERVAL)
+        finally:
+            connections.close_all()
+
+
+def _write(kind, fields, token):
+    if kind == COMMENT:
+        Comment.objects.create(**fields)
+    elif kind == UNFOLLOW:
+        Follow.objects.filter(**fields).delete()
+    elif not _cancelled(fields, token):
+        Follow.objects.get_or_create(**fields)
+
+
+def _cancelled(fields, requested):
+    """Пользователь отписался позже, чем подписался."""
+    state = cache.get(_follow_key(fields["user_id"], fields["author_id"]))
+    return (state is not None and not state["following"]
+            and state["requested"] >= requested)
+
+
+def flush():
+    """Записать всё, что накопилось в буфере. Возвращает число записей.
+    Если база занята, недописанное возвращается в буфер, а ошибка
+    пробрасывается."""
+    with _flush_lock:
+        with _ready:
+            items = _buffer[:]
+            del _buffer[:]
+        if not items:
+            return 0
+        done = 0
+        try:
+            try:
+                with transaction.atomic():
+                    for kind, fields, token in items:
+                        _write(kind, fields, token)
+                done = len(items)
+            except IntegrityError:
+                # Например, пост удалили, пока комментарий ждал: пишем по
+                # одной, чтобы из-за одной записи не потерять всю пачку
+                for kind, fields, token in items:
+                    try:
+                        with transaction.atomic():
+                            _write(kind, fields, token)
+                    except IntegrityError:
+                        logger.warning("Отложенная запись %s %s отброшена",
+                                       kind, fields, exc_info=True)
+                    done += 1
+        except DatabaseError:
+            with _ready:
+                _buffer[:0] = items[done:]
+            raise
+        finally:
+            _forget_pending(items[:done])
+        return done
+
+
+def _forget_pending(items):
+    # Отписка остаётся в кеше до PENDING_TIMEOUT: подписка, которую она
+    # отменяет, может ещё ждать в буфере другого процесса
+    tokens = {}
+    for kind, fields, token in items:
+        if kind == FOLLOW:
+            key = _follow_key(fields["user_id"], fields["author_id"])
+            # Позднее действие могло прийти в другой процесс и ещё ждать
+            state = cache.get(key)
+            if state is not None and state["requested"] == token:
+                cache.delete(key)
+        elif kind == COMMENT:
+            key = _comments_key(fields["post_id"], fields["author_id"])
+            tokens.setdefault(key, set()).add(token)
+    for key, flushed in tokens.items():
+        pending = [item for item in cache.get(key, [])
+                   if item["token"] not in flushed]
+        if pending:
+            cache.set(key, pending, PENDING_TIMEOUT)
+        else:
+            cache.delete(key)
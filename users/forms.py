@@ -1,12 +1,42 @@
-from django.contrib.auth.forms import UserCreationForm
+from functools import lru_cache
 
+from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.urls import get_resolver
 
 
 User = get_user_model()
 
 
+@lru_cache(maxsize=None)
+def reserved_usernames():
+    """Первые части адресов сайта, например groups или search. Профиль
+    пользователя с таким именем открывался бы не по /<username>/, а
+    страницей сайта, поэтому такие имена не выдаются. Список строится по
+    маршрутам, так что новые разделы попадают в него сами."""
+    names = set()
+
+    def walk(patterns, prefix):
+        for pattern in patterns:
+            route = prefix + str(pattern.pattern)
+            first = route.split("/", 1)[0]
+            if first and "<" not in first:
+                names.add(first.lstrip("^").lower())
+            elif not first and hasattr(pattern, "url_patterns"):
+                walk(pattern.url_patterns, route)
+
+    walk(get_resolver().url_patterns, "")
+    return frozenset(names)
+
+
 class CreationForm(UserCreationForm):
     class Meta(UserCreationForm.Meta):
         model = User
         fields = ("first_name", "last_name", "username", "email")
+
+    def clean_username(self):
+        username = self.cleaned_data["username"]
+        if username.lower() in reserved_usernames():
+            raise ValidationError("Это имя занято разделом сайта.")
+        return username
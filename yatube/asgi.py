@@ -0,0 +1,184 @@
+"""
+ASGI config for yatube project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``::
+
+    uvicorn yatube.asgi:application --workers 4
+
+Django 2.2 сам ASGI не поддерживает, поэтому WSGI-приложение Django
+обёрнуто в тонкий мост. Соединения, медленных клиентов и keep-alive
+держит цикл событий сервера, тело запроса читается в нём же, а в
+поток попадает только готовый запрос. Запросы выполняются в пуле из
+``ASGI_THREADS`` потоков. Если пул занят, новые запросы ждут в очереди:
+число потоков и соединений с базой остаётся ограниченным.
+
+Тело длиннее ``DATA_UPLOAD_MAX_MEMORY_SIZE`` плюс
+``IMAGE_UPLOAD_MAX_SIZE`` (поля формы и картинка) мост не дочитывает и
+сразу отвечает 413: по заголовку Content-Length, а без него — как только
+прочитанное превысит предел. Поэтому ни память, ни диск под такие
+запросы не тратятся.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+
+
+class RequestTooLarge(Exception):
+    """Тело запроса больше допустимого."""
+
+
+def build_environ(scope, body):
+    """WSGI-окружение для HTTP-запроса ASGI (PEP 3333)."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin1'),
+        'PATH_INFO': scope['path'].encode().decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+            name = 'HTTP_' + name
+        value = value.decode('latin1')
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    return environ
+
+
+class ThreadPoolBridge:
+    """ASGI-приложение поверх WSGI-приложения и пула потоков."""
+
+    def __init__(self, wsgi_application, threads, spool_size,
+                 max_body_size=None):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(threads,
+                                           thread_name_prefix='asgi')
+        self.spool_size = spool_size
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f'Неподдерживаемый тип запроса {scope["type"]}')
+        try:
+            body = await self.read_body(receive, scope)
+        except RequestTooLarge:
+            await send({'type': 'http.response.start', 'status': 413,
+                        'headers': [(b'content-type',
+                                     b'text/plain; charset=utf-8'),
+                                    (b'connection', b'close')]})
+            await send({'type': 'http.response.body',
+                        'body': 'Слишком большой запрос'.encode()})
+            return
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            status, headers, content = await loop.run_in_executor(
+                self.executor, self.run, build_environ(scope, body))
+        finally:
+            body.close()
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    def too_large(self, size):
+        return self.max_body_size is not None and size > self.max_body_size
+
+    async def read_body(self, receive, scope):
+        """Тело запроса целиком; большие загрузки уходят на диск. None,
+        если клиент отключился раньше. Бросает RequestTooLarge, если
+        тело больше max_body_size."""
+        for name, value in scope.get('headers', []):
+            if name.lower() == b'content-length' and value.isdigit() \
+                    and self.too_large(int(value)):
+                raise RequestTooLarge
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if self.too_large(size):
+                body.close()
+                raise RequestTooLarge
+            body.write(chunk)
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+        return body
+
+    def run(self, environ):
+        # Ответ дочитывается и закрывается в том же потоке: по закрытию
+        # Django закрывает соединения с базой этого потока
+        response = {}
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin1'), value.encode('latin1'))
+                for name, value in headers
+            ]
+            return written.append
+
+        result = self.wsgi_application(environ, start_response)
+        try:
+            content = b''.join(written) + b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], content
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def get_asgi_application():
+    from django.conf import settings
+
+    wsgi_application = get_wsgi_application()
+    max_body_size = None
+    if settings.DATA_UPLOAD_MAX_MEMORY_SIZE is not None:
+        max_body_size = (settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+                         + settings.IMAGE_UPLOAD_MAX_SIZE)
+    return ThreadPoolBridge(wsgi_application, settings.ASGI_THREADS,
+                            settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+                            max_body_size)
+
+
+application = get_asgi_application()
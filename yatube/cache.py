@@ -0,0 +1,171 @@
+"""Двухуровневый кеш.
+
+L1 — небольшой LRU-кеш в памяти процесса с коротким временем жизни,
+L2 — общий для всех процессов кеш (файловый, memcached или Redis),
+который задаётся отдельным алиасом в ``CACHES``::
+
+    CACHES = {
+        "default": {
+            "BACKEND": "yatube.cache.TieredCache",
+            "OPTIONS": {"SHARED": "shared", "LOCAL_TIMEOUT": 5},
+        },
+        "shared": {...},
+    }
+
+Запись и удаление идут сквозь оба уровня, но сбросить L1 соседних
+процессов нельзя. Поэтому в L1 попадают только версионированные ключи,
+значение которых никогда не меняется, а сброс идёт сменой версии в L2:
+
+- ключи, записанные с явной версией (``cache.set(key, value,
+  version=...)``);
+- фрагменты шаблонов (``{% cache %}``), префиксы ``LOCAL_PREFIXES``:
+  все они зависят от версии своей ленты (см. posts/feed_cache.py).
+
+Все остальные ключи читаются из L2, и удаление или новая запись сразу
+видны во всех процессах.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.functional import cached_property
+
+_MISSING = object()
+
+
+class LocalStore:
+    """Ограниченный LRU-словарь со сроками жизни записей, общий для всех
+    потоков процесса."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {
+            "local": {"hits": 0, "misses": 0},
+            "shared": {"hits": 0, "misses": 0},
+        }
+
+    def count(self, tier, hit):
+        with self.lock:
+            self.stats[tier]["hits" if hit else "misses"] += 1
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return _MISSING
+            value, expires = item
+            if expires <= time.monotonic():
+                del self.items[key]
+                return _MISSING
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + ttl)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_entries:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+# Django создаёт объекты кеша для каждого потока отдельно, а L1 должен
+# быть один на процесс, поэтому хранилища живут на уровне модуля.
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._shared_alias = options.get("SHARED", "shared")
+        self._local_timeout = options.get("LOCAL_TIMEOUT", 5)
+        self._local_prefixes = tuple(
+            options.get("LOCAL_PREFIXES", ("template.cache.",)))
+        with _stores_lock:
+            self._local = _stores.setdefault(
+                location or self._shared_alias,
+                LocalStore(options.get("LOCAL_MAX_ENTRIES", 1000)),
+            )
+
+    @cached_property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def stats(self):
+        """Попадания и промахи по уровням с момента запуска процесса."""
+        with self._local.lock:
+            return {tier: dict(counts) for tier, counts in
+                    self._local.stats.items()}
+
+    def _is_local(self, key, version):
+        return version is not None or key.startswith(self._local_prefixes)
+
+    def _local_set(self, local_key, value, timeout):
+        ttl = self._local_timeout
+        if timeout is not None and timeout != DEFAULT_TIMEOUT:
+            ttl = min(ttl, timeout)
+        if ttl <= 0:
+            self._local.delete(local_key)
+        else:
+            self._local.set(local_key, value, ttl)
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_key(key, version)
+        if self._is_local(key, version):
+            value = self._local.get(local_key)
+            self._local.count("local", value is not _MISSING)
+            if value is not _MISSING:
+                return value
+        value = self.shared.get(key, _MISSING, version=version)
+        self._local.count("shared", value is not _MISSING)
+        if value is _MISSING:
+            return default
+        if self._is_local(key, version):
+            self._local_set(local_key, value, self._local_timeout)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        if self._is_local(key, version):
+            self._local_set(self.make_key(key, version), value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added and self._is_local(key, version):
+            self._local_set(self.make_key(key, version), value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._local.delete(self.make_key(key, version))
+        return self.shared.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def incr(self, key, delta=1, version=None):
+        self._local.delete(self.make_key(key, version))
+        return self.shared.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self._local.delete(self.make_key(key, version))
+        return self.shared.decr(key, delta, version=version)
+
+    def clear(self):
+        self._local.clear()
+        self.shared.clear()
@@ -0,0 +1,221 @@
+"""Метрики запросов по представлениям.
+
+``MetricsMiddleware`` для каждого запроса замеряет общее время, число и
+время SQL-запросов, время отрисовки шаблонов, размер ответа и пик памяти
+на приём загруженных файлов, и складывает замеры в скользящее окно
+последних ``METRICS_WINDOW`` запросов своего представления (по имени
+URL, например ``posts:index``). Перцентили по окну и кеш-статистика
+``cache.stats()`` отдаются в текстовом формате Prometheus по адресу
+``/metrics`` только сотрудникам, а сводка по текущему запросу — в
+заголовке ``Server-Timing``.
+
+Время шаблонов замеряет бэкенд ``TimedDjangoTemplates``, который
+settings.py подставляет в ``TEMPLATES`` при включённых метриках: он
+отдаёт те же шаблоны Django, только с замером в render(), и остальной
+Django не трогает.
+
+При ``METRICS_ENABLED = False`` middleware исключает себя из цепочки
+при запуске, и запросы не платят за него ничего.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+from django.template.backends.django import DjangoTemplates, Template
+
+QUANTILES = (0.5, 0.9, 0.99)
+UNRESOLVED = "<unresolved>"
+
+# Поля замера: имя метрики, описание
+FIELDS = (
+    ("duration", "yatube_request_duration_seconds",
+     "Время ответа целиком"),
+    ("queries", "yatube_request_queries",
+     "Число SQL-запросов"),
+    ("sql", "yatube_request_sql_seconds",
+     "Время SQL-запросов"),
+    ("template", "yatube_request_template_seconds",
+     "Время отрисовки шаблонов"),
+    ("size", "yatube_response_bytes",
+     "Размер ответа"),
+    ("upload_memory", "yatube_request_upload_peak_bytes",
+     "Пик памяти на приём файлов (см. posts/uploads.py)"),
+)
+
+_current = threading.local()
+
+
+class ViewStats:
+    """Скользящее окно замеров одного представления и накопленные с
+    запуска процесса суммы."""
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.sums = dict.fromkeys([name for name, _, _ in FIELDS], 0)
+
+    def add(self, sample):
+        self.samples.append(sample)
+        self.count += 1
+        for name, value in sample.items():
+            self.sums[name] += value
+
+    def quantiles(self, name):
+        values = sorted(sample[name] for sample in self.samples)
+        return [(q, values[min(len(values) - 1, int(q * len(values)))])
+                for q in QUANTILES]
+
+
+# Как и L1 кеша, замеры общие для всех потоков процесса
+_views = {}
+_views_lock = threading.Lock()
+
+
+def record(view, sample):
+    with _views_lock:
+        stats = _views.get(view)
+        if stats is None:
+            stats = _views[view] = ViewStats(settings.METRICS_WINDOW)
+        stats.add(sample)
+
+
+def reset():
+    with _views_lock:
+        _views.clear()
+
+
+class Collector:
+    """Замеры одного запроса, пока он выполняется."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.template = 0.0
+        self.rendering = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql += time.perf_counter() - started
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        collector = getattr(_current, "collector", None)
+        if collector is None or collector.rendering:
+            return super().render(context, request)
+        # Вложенные include идут мимо этого метода, но шаблон может
+        # отрисовать другой через render_to_string, не считаем время дважды
+        collector.rendering = True
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            collector.template += time.perf_counter() - started
+            collector.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Бэкенд шаблонов Django, который замеряет их отрисовку."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template,
+                             self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template,
+                             self)
+
+
+def _upload_memory(request):
+    # Файлы разбираются только по обращению к request.FILES: если
+    # представление их не читало, и памяти на них не ушло
+    files = request.__dict__.get("_files")
+    if not files:
+        return 0
+    return max((getattr(upload, "upload_stats", {}).get("peak_memory", 0)
+                for _, uploads in files.lists() for upload in uploads),
+               default=0)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        collector = _current.collector = Collector()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(collector))
+                response = self.get_response(request)
+        finally:
+            _current.collector = None
+        duration = time.perf_counter() - started
+        match = request.resolver_match
+        record(match.view_name if match else UNRESOLVED, {
+            "duration": duration,
+            "queries": collector.queries,
+            "sql": collector.sql,
+            "template": collector.template,
+            "size": 0 if response.streaming else len(response.content),
+            "upload_memory": _upload_memory(request),
+        })
+        response["Server-Timing"] = (
+            'db;dur={:.1f};desc="{} queries", tpl;dur={:.1f}, '
+            "total;dur={:.1f}".format(collector.sql * 1000, collector.queries,
+                                      collector.template * 1000,
+                                      duration * 1000))
+        return response
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def render_metrics():
+    """Текст метрик в формате Prometheus."""
+    with _views_lock:
+        views = {view: (stats.count, dict(stats.sums),
+                        {name: stats.quantiles(name)
+                         for name, _, _ in FIELDS})
+                 for view, stats in _views.items() if stats.samples}
+    lines = []
+    for name, metric, description in FIELDS:
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} summary")
+        for view, (count, sums, quantiles) in sorted(views.items()):
+            view = _label(view)
+            for quantile, value in quantiles[name]:
+                lines.append(f'{metric}{{view="{view}",quantile="{quantile}"}}'
+                             f" {value}")
+            lines.append(f'{metric}_sum{{view="{view}"}} {sums[name]}')
+            lines.append(f'{metric}_count{{view="{view}"}} {count}')
+    if hasattr(cache, "stats"):
+        lines.append("# HELP yatube_cache_requests_total Обращения к кешу "
+                     "по уровням")
+        lines.append("# TYPE yatube_cache_requests_total counter")
+        for tier, counts in sorted(cache.stats().items()):
+            for result, value in sorted(counts.items()):
+                lines.append(f'yatube_cache_requests_total{{tier="{tier}",'
+                             f'result="{result}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+@staff_member_required
+def metrics_view(request):
+    return HttpResponse(render_metrics(),
+                        content_type="text/plain; version=0.0.4")
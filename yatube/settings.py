@@ -11,12 +11,29 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
+from urllib.request import pathname2url
 
 PAGE_SIZE = 10
 
+# Сколько комментариев показывать под постом сразу и догружать за раз
+COMMENTS_PAGE_SIZE = 50
+
+# Посты авторов, у которых больше подписчиков, не раскладываются по лентам
+# подписок при публикации, а подмешиваются в ленту при чтении
+TIMELINE_FANOUT_LIMIT = 10000
+
+# Ленты длиннее этого не пересчитываются COUNT(*) на каждый запрос: число
+# страниц берётся из счётчиков или из кеша (posts/pagination.py)
+FEED_EXACT_COUNT_LIMIT = 10000
+FEED_COUNT_TIMEOUT = 60
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Запуск под manage.py test или pytest
+TESTING = "test" in sys.argv or "pytest" in sys.modules
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/2.2/howto/deployment/checklist/
@@ -39,7 +56,7 @@ ALLOWED_HOSTS = [
 
 INSTALLED_APPS = [
     'users',
-    'posts',
+    'posts.apps.PostsConfig',
     'about',
     'django.contrib.admin',
     'django.contrib.auth',
@@ -51,6 +68,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yatube.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,12 +78,19 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Замеры запросов по представлениям для /metrics и Server-Timing
+# (yatube/metrics.py); YATUBE_METRICS=off выключает их совсем
+METRICS_ENABLED = os.environ.get("YATUBE_METRICS", "on") != "off"
+METRICS_WINDOW = 1000
+
 ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # С метриками — тот же бэкенд, но с замером времени шаблонов
+        'BACKEND': ('yatube.metrics.TimedDjangoTemplates' if METRICS_ENABLED
+                    else 'django.template.backends.django.DjangoTemplates'),
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -81,17 +106,57 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
+# Размер пула потоков, в котором ASGI-мост (yatube/asgi.py) выполняет
+# запросы; это же верхняя граница числа соединений с базой на процесс
+ASGI_THREADS = int(os.environ.get("YATUBE_ASGI_THREADS", 8))
+
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+DB_PATH = os.environ.get('YATUBE_DB_PATH',
+                         os.path.join(BASE_DIR, 'db.sqlite3'))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'NAME': DB_PATH,
     }
 }
 
+# Профиль SQLite для небольших установок без отдельного сервера БД
+# (YATUBE_SQLITE_PROFILE=on). Журнал WAL, чтобы чтение не ждало записи,
+# synchronous=NORMAL (в WAL это не грозит порчей базы, при сбое питания
+# теряются только последние транзакции), отображение файла в память и
+# кеш страниц побольше. Соединения живут, пока жив поток, а чтение идёт
+# через отдельное соединение только для чтения (yatube/sqlite/router.py).
+SQLITE_PRAGMAS = {
+    "synchronous": "normal",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "busy_timeout": 5000,
+    "temp_store": "memory",
+}
+SQLITE_PROFILE = os.environ.get("YATUBE_SQLITE_PROFILE", "off") == "on"
+if SQLITE_PROFILE and not TESTING:
+    DATABASES = {
+        "default": {
+            "ENGINE": "yatube.sqlite",
+            "NAME": DB_PATH,
+            "CONN_MAX_AGE": None,
+            "PRAGMAS": {"journal_mode": "wal", **SQLITE_PRAGMAS},
+        },
+        "replica": {
+            "ENGINE": "yatube.sqlite",
+            "NAME": "file:{}?mode=ro".format(pathname2url(DB_PATH)),
+            "OPTIONS": {"uri": True},
+            "CONN_MAX_AGE": None,
+            "PRAGMAS": SQLITE_PRAGMAS,
+            "TEST": {"MIRROR": "default"},
+        },
+    }
+    DATABASE_ROUTERS = ["yatube.sqlite.router.ReadReplicaRouter"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -135,6 +200,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Загрузки пишутся на диск кусками, а картинки проверяются по заголовку
+# до того, как тело запроса дочитано (posts/uploads.py)
+FILE_UPLOAD_HANDLERS = ["posts.uploads.ImageUploadHandler"]
+IMAGE_UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+IMAGE_UPLOAD_MAX_PIXELS = 25000000
+
 LOGIN_URL = "/auth/login/"
 LOGIN_REDIRECT_URL = "posts:index"
 LOGOUT_REDIRECT_URL = "posts:index"
@@ -142,8 +213,73 @@ LOGOUT_REDIRECT_URL = "posts:index"
 EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
-CACHES = {
-    "default": {
+# Общий для всех процессов кеш (L2). По умолчанию файловый, ему не нужны
+# внешние сервисы; можно указать memcached://host:port или redis://host:port
+# (для Redis нужен пакет django-redis).
+SHARED_CACHE = os.environ.get("YATUBE_SHARED_CACHE", "file")
+# Тесты не должны видеть кеш, оставшийся от прошлых запусков
+if TESTING:
+    SHARED_CACHE = "locmem"
+
+if SHARED_CACHE.startswith("memcached://"):
+    SHARED_CACHE_BACKEND = {
+        "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
+        "LOCATION": SHARED_CACHE[len("memcached://"):],
+    }
+elif SHARED_CACHE.startswith("redis://"):
+    SHARED_CACHE_BACKEND = {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": SHARED_CACHE,
+    }
+elif SHARED_CACHE == "locmem":
+    SHARED_CACHE_BACKEND = {
         "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
     }
+else:
+    SHARED_CACHE_BACKEND = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(BASE_DIR, "cache"),
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+
+CACHES = {
+    # L1 в памяти процесса на несколько секунд, за ним общий кеш
+    "default": {
+        "BACKEND": "yatube.cache.TieredCache",
+        "OPTIONS": {
+            "SHARED": "shared",
+            "LOCAL_TIMEOUT": 5,
+            "LOCAL_MAX_ENTRIES": 1000,
+        },
+    },
+    "shared": SHARED_CACHE_BACKEND,
 }
+
+# Миниатюры картинок строятся в фоне (posts/thumbnails.py): "thread" — пулом
+# потоков самого веб-процесса, "queue" — только командой process_thumbnails.
+# В тестах очередь разбирается явно.
+THUMBNAIL_WORKER = os.environ.get("YATUBE_THUMBNAIL_WORKER", "thread")
+if TESTING:
+    THUMBNAIL_WORKER = "queue"
+THUMBNAIL_THREADS = 2
+
+# Запись комментариев и подписок (posts/write_behind.py): "off" — сразу,
+# каждая своей транзакцией; "thread" — пачками из фонового потока, раз в
+# WRITE_BEHIND_INTERVAL секунд или по WRITE_BEHIND_BATCH записей
+WRITE_BEHIND = os.environ.get("YATUBE_WRITE_BEHIND", "off")
+if TESTING:
+    WRITE_BEHIND = "off"
+WRITE_BEHIND_INTERVAL = 0.2
+WRITE_BEHIND_BATCH = 100
+
+# Популярное (posts/trending.py): события копятся в памяти процесса и раз в
+# TRENDING_INTERVAL секунд сохраняются фоновым потоком ("thread") или
+# только явным вызовом trending.flush() ("manual", так в тестах). Вес
+# события вдвое падает за TRENDING_HALF_LIFE секунд, события старше
+# TRENDING_WINDOW секунд не учитываются
+TRENDING_FLUSHER = os.environ.get("YATUBE_TRENDING_FLUSHER", "thread")
+if TESTING:
+    TRENDING_FLUSHER = "manual"
+TRENDING_INTERVAL = 10
+TRENDING_HALF_LIFE = 6 * 60 * 60
+TRENDING_WINDOW = 48 * 60 * 60
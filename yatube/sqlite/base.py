@@ -0,0 +1,21 @@
+"""Бэкенд SQLite с настройкой соединений через PRAGMA.
+
+То же, что ``django.db.backends.sqlite3``, но каждое новое соединение
+сразу получает PRAGMA из ключа ``PRAGMAS`` настроек базы::
+
+    "default": {
+        "ENGINE": "yatube.sqlite",
+        "NAME": "db.sqlite3",
+        "PRAGMAS": {"journal_mode": "wal", "synchronous": "normal"},
+    }
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        pragmas = self.settings_dict.get("PRAGMAS", {})
+        for name, value in pragmas.items():
+            connection.execute(f"PRAGMA {name} = {value}")
+        return connection
@@ -0,0 +1,25 @@
+from django.db import DEFAULT_DB_ALIAS, connections
+
+READ_ALIAS = "replica"
+
+
+class ReadReplicaRouter:
+    """Чтение через соединение только для чтения, запись через основное.
+
+    Пока основное соединение внутри транзакции, чтение идёт через него
+    же: иначе оно не увидело бы ещё не закоммиченные записи.
+    """
+
+    def db_for_read(self, model, **hints):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return READ_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,252 @@
+import asyncio
+import os
+import re
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.utils import ConnectionHandler
+from django.template.backends.django import Template
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from users.forms import CreationForm
+from yatube import metrics
+from yatube.asgi import ThreadPoolBridge, build_environ
+from yatube.cache import TieredCache
+from yatube.sqlite.router import ReadReplicaRouter
+
+TINY_GIF = (b"\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21"
+            b"\xf9\x04\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00"
+            b"\x01\x00\x00\x02\x02\x4c\x01\x00\x3b")
+
+
+class TieredCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.cache = TieredCache("test-tiered", {
+            "OPTIONS": {"SHARED": "shared", "LOCAL_MAX_ENTRIES": 2},
+        })
+        self.cache.clear()
+        self.shared = caches["shared"]
+
+    def test_local_tier_serves_repeated_reads(self):
+        """Повторное чтение версионированного ключа обслуживает L1, а не
+        общий кеш"""
+        before = self.cache.stats()
+        self.cache.set("key", "value", version=3)
+        self.shared.set("key", "changed elsewhere", version=3)
+        self.assertEqual(self.cache.get("key", version=3), "value")
+        after = self.cache.stats()
+        self.assertEqual(
+            after["local"]["hits"] - before["local"]["hits"], 1)
+        self.assertEqual(
+            after["shared"]["hits"] - before["shared"]["hits"], 0)
+
+    def test_local_tier_is_bounded(self):
+        """L1 вытесняет давно не читанные ключи"""
+        for key in ("a", "b", "c"):
+            self.cache.set(f"template.cache.{key}", key)
+        self.shared.delete("template.cache.a")
+        self.assertIsNone(self.cache.get("template.cache.a"))
+        self.assertEqual(self.cache.get("template.cache.c"), "c")
+
+    def test_unversioned_keys_bypass_local_tier(self):
+        """Ключи без версии, например счётчики версий и записи, которые
+        сбрасываются удалением, всегда читаются из общего кеша"""
+        self.cache.set("feed-version:index", 1)
+        self.shared.incr("feed-version:index")
+        self.assertEqual(self.cache.get("feed-version:index"), 2)
+        self.assertEqual(self.cache.incr("feed-version:index"), 3)
+        self.cache.set("group:1", "group")
+        self.shared.delete("group:1")
+        self.assertIsNone(self.cache.get("group:1"))
+
+    def test_delete_reaches_both_tiers(self):
+        self.cache.set("key", "value")
+        self.cache.delete("key")
+        self.assertIsNone(self.cache.get("key"))
+        self.assertIsNone(self.shared.get("key"))
+
+
+class MetricsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.staff = User.objects.create(username="staff", is_staff=True)
+        cls.user = User.objects.create(username="visitor")
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_server_timing_header(self):
+        """Ответ несёт сводку по SQL и шаблонам"""
+        response = self.client.get(reverse("posts:index"))
+        self.assertRegex(response["Server-Timing"],
+                         r'^db;dur=[\d.]+;desc="\d+ queries", '
+                         r"tpl;dur=[\d.]+, total;dur=[\d.]+$")
+
+    def test_metrics_per_view(self):
+        """На /metrics перцентили и счётчики по именам представлений"""
+        for _ in range(3):
+            self.client.get(reverse("posts:index"))
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("metrics"))
+        text = response.content.decode()
+        self.assertIn('yatube_request_queries_count{view="posts:index"} 3',
+                      text)
+        self.assertIn('yatube_request_duration_seconds{view="posts:index",'
+                      'quantile="0.99"}', text)
+        self.assertIn('yatube_cache_requests_total{tier="local",', text)
+
+    def test_template_time_measured_without_patching_django(self):
+        """Время шаблонов замеряет свой бэкенд, классы Django не
+        подменяются"""
+        self.client.get(reverse("posts:index"))
+        self.assertGreater(metrics._views["posts:index"].sums["template"], 0)
+        self.assertEqual(Template.render.__module__,
+                         "django.template.backends.django")
+
+    def test_upload_peak_memory_exported(self):
+        """Пик памяти на приём картинки виден на /metrics"""
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.client.force_login(self.staff)
+        image = SimpleUploadedFile("tiny.gif", TINY_GIF, "image/gif")
+        with self.settings(MEDIA_ROOT=media), self.assertLogs("posts.uploads"):
+            self.client.post(reverse("posts:new_post"),
+                             {"text": "С картинкой", "image": image})
+        text = self.client.get(reverse("metrics")).content.decode()
+        peak = re.search(r'yatube_request_upload_peak_bytes_sum'
+                         r'\{view="posts:new_post"\} (\d+)', text)
+        self.assertEqual(int(peak[1]), len(TINY_GIF))
+
+    def test_metrics_only_for_staff(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled_middleware_is_skipped(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            metrics.MetricsMiddleware(lambda request: None)
+
+
+class AsgiBridgeTest(SimpleTestCase):
+    def request(self, path, body=b'', headers=(), chunks=None,
+                max_body_size=None):
+        bridge = ThreadPoolBridge(get_wsgi_application(), 2, 1024,
+                                  max_body_size)
+        scope = {'type': 'http', 'method': 'GET', 'path': path,
+                 'query_string': b'', 'headers': list(headers),
+                 'http_version': '1.1'}
+        chunks = chunks or [body]
+        incoming = [{'type': 'http.request', 'body': chunk,
+                     'more_body': number < len(chunks)}
+                    for number, chunk in enumerate(chunks, 1)]
+        sent = []
+
+        async def receive():
+            return incoming.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(bridge(scope, receive, send))
+        bridge.executor.shutdown()
+        self.unread = incoming
+        return sent
+
+    def test_serves_django_responses(self):
+        """Мост отдаёт ответ Django через ASGI"""
+        start, body = self.request(reverse('about:author'))
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/html; charset=utf-8'),
+                      start['headers'])
+        self.assertIn('Об авторе'.encode(), body['body'])
+        start, _ = self.request('/about/no-such-page/')
+        self.assertEqual(start['status'], 404)
+
+    def test_rejects_too_large_body(self):
+        """Слишком большое тело отклоняется с 413 и не дочитывается:
+        по Content-Length сразу, без него — на превысившем предел куске"""
+        url = reverse('about:author')
+        start, _ = self.request(url, b'x', max_body_size=100,
+                                headers=[(b'content-length', b'101')])
+        self.assertEqual(start['status'], 413)
+        start, _ = self.request(url, chunks=[b'x' * 60] * 3,
+                                max_body_size=100)
+        self.assertEqual(start['status'], 413)
+        self.assertEqual(len(self.unread), 1)
+        start, _ = self.request(url, chunks=[b'x' * 60, b'x' * 40],
+                                max_body_size=100)
+        self.assertEqual(start['status'], 200)
+
+    def test_environ_from_scope(self):
+        """Заголовки ASGI превращаются в переменные WSGI"""
+        environ = build_environ({
+            'method': 'POST', 'path': '/путь/', 'query_string': b'a=1',
+            'headers': [(b'content-length', b'3'), (b'x-tag', b'a'),
+                        (b'x-tag', b'b')],
+        }, None)
+        self.assertEqual(environ['CONTENT_LENGTH'], '3')
+        self.assertEqual(environ['HTTP_X_TAG'], 'a,b')
+        self.assertEqual(environ['QUERY_STRING'], 'a=1')
+        self.assertEqual(environ['PATH_INFO'].encode('latin1').decode(),
+                         '/путь/')
+
+
+class SqlitePragmasTest(SimpleTestCase):
+    # Соединение открывается к отдельному временному файлу, но pytest
+    # пускает к базе только тесты, объявившие её
+    databases = "__all__"
+
+    def test_pragmas_applied_to_new_connections(self):
+        """Бэкенд выставляет PRAGMA из настроек каждому соединению"""
+        with tempfile.TemporaryDirectory() as directory:
+            handler = ConnectionHandler({"default": {
+                "ENGINE": "yatube.sqlite",
+                "NAME": os.path.join(directory, "profile.sqlite3"),
+                "PRAGMAS": {"journal_mode": "wal", "synchronous": "normal",
+                            "cache_size": -2048},
+            }})
+            profile = handler["default"]
+            try:
+                with profile.cursor() as cursor:
+                    values = [cursor.execute(f"PRAGMA {name}").fetchone()[0]
+                              for name in ("journal_mode", "synchronous",
+                                           "cache_size")]
+            finally:
+                profile.close()
+        self.assertEqual(values, ["wal", 1, -2048])
+
+
+class SqliteProfileTest(SimpleTestCase):
+    def test_router_reads_from_replica_outside_transactions(self):
+        """Чтение идёт через реплику, а внутри транзакции — через
+        основное соединение"""
+        router = ReadReplicaRouter()
+        self.assertEqual(router.db_for_read(None), "replica")
+        self.assertEqual(router.db_for_write(None), "default")
+        with mock.patch.object(connection, "in_atomic_block", True):
+            self.assertEqual(router.db_for_read(None), "default")
+        self.assertFalse(router.allow_migrate("replica", "posts"))
+
+
+class ReservedUsernameTest(TestCase):
+    def form(self, username):
+        return CreationForm({"username": username, "password1": "Sekr3t-pass",
+                             "password2": "Sekr3t-pass"})
+
+    def test_section_names_not_allowed(self):
+        """Имена разделов сайта не выдаются: профиль по ним не открылся
+        бы"""
+        for username in ("trending", "groups", "Search", "about"):
+            with self.subTest(username=username):
+                self.assertIn("username", self.form(username).errors)
+        self.assertNotIn("username", self.form("trendsetter").errors)
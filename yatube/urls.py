@@ -19,6 +19,8 @@ from django.conf.urls import handler404, handler500
 from django.conf import settings
 from django.conf.urls.static import static
 
+from yatube.metrics import metrics_view
+
 urlpatterns = [
     #  регистрация и авторизация
     path("auth/", include("users.urls")),
@@ -30,6 +32,9 @@ urlpatterns = [
     #  раздел администратора
     path("admin/", admin.site.urls),
 
+    #  метрики для Prometheus, только для сотрудников
+    path("metrics", metrics_view, name="metrics"),
+
     #  обработчик для главной страницы ищем в urls.py приложения posts
     path("", include("posts.urls")),
 